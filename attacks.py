@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Attack maps for the Chess Package
+
+An AttackMap keeps the set of squares each player attacks up to date as pieces are put on and taken off the board,
+so testing for check is a single lookup instead of a scan of the board.  Squares are numbered row * 8 + col.
+"""
+
+import pieces as p
+
+
+def _step_table(offsets):
+    """Builds, for each square, the tuple of squares reached by one of the (row, col) offsets"""
+    table = []
+    for r in range(8):
+        for c in range(8):
+            table.append(tuple((r + dr) * 8 + c + dc for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8))
+    return tuple(table)
+
+
+def _ray_table(directions):
+    """Builds, for each square, a tuple of rays, each ray a tuple of (row, col, square) walking out to the edge"""
+    table = []
+    for r in range(8):
+        for c in range(8):
+            rays = []
+            for dr, dc in directions:
+                ray = []
+                x, y = r + dr, c + dc
+                while 0 <= x < 8 and 0 <= y < 8:
+                    ray.append((x, y, x * 8 + y))
+                    x, y = x + dr, y + dc
+                if ray:
+                    rays.append(tuple(ray))
+            table.append(tuple(rays))
+    return tuple(table)
+
+
+KNIGHT_TARGETS = _step_table(p.KNIGHT_OFFSETS)
+KING_TARGETS = _step_table(p.KING_OFFSETS)
+PAWN_TARGETS = (_step_table(((1, -1), (1, 1))), _step_table(((-1, -1), (-1, 1))))
+SLIDER_RAYS = {
+    p.BISHOP: _ray_table(p.BISHOP_DIRECTIONS),
+    p.ROOK: _ray_table(p.ROOK_DIRECTIONS),
+    p.QUEEN: _ray_table(p.ROOK_DIRECTIONS + p.BISHOP_DIRECTIONS),
+}
+
+
+def _sign(x):
+    return (x > 0) - (x < 0)
+
+
+def _between(pos, start, end, dr, dc):
+    """Returns True if pos lies strictly between start and end on the line running from start in direction (dr, dc)"""
+    x, y = pos[0] - start[0], pos[1] - start[1]
+    dist = max(abs(x), abs(y))
+    return (x, y) == (dr * dist, dc * dist) and 0 < dist < max(abs(end[0] - start[0]), abs(end[1] - start[1]))
+
+
+class AttackMap:
+    """
+    Squares attacked by each player, updated one square change at a time.
+    When a square is filled or emptied only the piece on it and the sliding pieces whose lines run through it are
+    recomputed.
+    Attributes:
+    counts -- counts[0][sq] and counts[1][sq] are how many white and black pieces attack square sq
+    attackers -- attackers[sq] is the list of pieces attacking square sq, lists take a quarter of the memory of sets
+    _targets -- dict of the squares each piece on the board attacks
+    _board -- the ChessGame board the attacks are read from
+    """
+    def __init__(self, board):
+        self.clear(board)
+
+    def clear(self, board):
+        """Forgets every attack and starts tracking a new (empty) board"""
+        self._board = board
+        self.counts = ([0] * 64, [0] * 64)
+        self.attackers = [[] for _ in range(64)]
+        self._targets = {}
+
+    def place(self, piece, pos):
+        """Records piece being put on the board at pos, the board must already hold it"""
+        # Ghost pawns neither attack nor block
+        if piece.kind is None:
+            return
+        self._update_sliders(pos[0] * 8 + pos[1])
+        self._add(piece, pos)
+
+    def remove(self, piece, pos):
+        """Records piece being taken off the board at pos, the board must already be empty there"""
+        if piece.kind is None:
+            return
+        self._discard(piece)
+        self._update_sliders(pos[0] * 8 + pos[1])
+
+    def add_all(self, pieces):
+        """Records a list of pieces that were all put on the board since the last clear, faster than calling place
+        for each one since no sliding piece has to be recomputed
+        """
+        for piece in pieces:
+            if piece.kind is not None:
+                self._add(piece, piece.get_pos())
+
+    def is_attacked(self, pos, by_white, ignore=None):
+        """Checks if pos is attacked by the white or black pieces and returns True or False
+        Inputs:
+        pos -- Tuple with integer coordinates (x,y) of the square to test
+        by_white -- True to test the white pieces, False for the black pieces
+        ignore -- optional position treated as empty, the square a King is moving away from
+        """
+        if self.counts[0 if by_white else 1][pos[0] * 8 + pos[1]]:
+            return True
+        if ignore is None:
+            return False
+        # A sliding piece attacking the ignored square also attacks straight through it
+        return self.opens_line(ignore, pos, by_white)
+
+    def opens_line(self, pos, target, by_white, block=None):
+        """Checks if emptying pos would let a white or black Bishop, Rook or Queen attack target through it
+        Inputs:
+        pos -- Tuple with integer coordinates (x,y) of the square being emptied
+        target -- Tuple with integer coordinates (x,y) of the square that could be exposed, usually a King
+        by_white -- True to test the white pieces, False for the black pieces
+        block -- optional position that is filled at the same time, the square a piece moves to
+        """
+        for piece in self.attackers[pos[0] * 8 + pos[1]]:
+            # Capturing the sliding piece on block closes its line too
+            if piece.kind in SLIDER_RAYS and piece.get_player().isWhite == by_white and piece.get_pos() != block:
+                r, c = piece.get_pos()
+                dr, dc = _sign(pos[0] - r), _sign(pos[1] - c)
+                # Moving in between the sliding piece and pos keeps the line closed
+                if block is not None and _between(block, (r, c), pos, dr, dc):
+                    continue
+                x, y = pos[0] + dr, pos[1] + dc
+                while 0 <= x < 8 and 0 <= y < 8:
+                    if (x, y) == target:
+                        return True
+                    check_piece = self._board[x][y]
+                    if (x, y) == block or check_piece is not None and check_piece.kind is not None:
+                        break
+                    x, y = x + dr, y + dc
+        return False
+
+    def get_attackers(self, pos, by_white):
+        """Returns a list of the white or black pieces attacking pos"""
+        return [cp for cp in self.attackers[pos[0] * 8 + pos[1]] if cp.get_player().isWhite == by_white]
+
+    def _compute(self, piece, pos):
+        """Returns the tuple of squares piece attacks from pos on the current board"""
+        r, c = pos
+        sq = r * 8 + c
+        kind = piece.kind
+        if kind == p.PAWN:
+            return PAWN_TARGETS[0 if piece.get_player().isWhite else 1][sq]
+        if kind == p.KNIGHT:
+            return KNIGHT_TARGETS[sq]
+        if kind == p.KING:
+            return KING_TARGETS[sq]
+        board = self._board
+        targets = []
+        for ray in SLIDER_RAYS[kind][sq]:
+            for x, y, target in ray:
+                targets.append(target)
+                check_piece = board[x][y]
+                if check_piece is not None and check_piece.kind is not None:
+                    break
+        return targets
+
+    def _add(self, piece, pos):
+        targets = self._compute(piece, pos)
+        self._targets[piece] = targets
+        counts = self.counts[0 if piece.get_player().isWhite else 1]
+        attackers = self.attackers
+        for sq in targets:
+            counts[sq] += 1
+            attackers[sq].append(piece)
+
+    def _discard(self, piece):
+        targets = self._targets.pop(piece)
+        counts = self.counts[0 if piece.get_player().isWhite else 1]
+        attackers = self.attackers
+        for sq in targets:
+            counts[sq] -= 1
+            attackers[sq].remove(piece)
+
+    def _update_sliders(self, sq):
+        """Recomputes the sliding pieces whose lines run through sq after it was filled or emptied"""
+        sliders = [cp for cp in self.attackers[sq] if cp.kind in SLIDER_RAYS]
+        for piece in sliders:
+            self._discard(piece)
+            self._add(piece, piece.get_pos())
@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Batch self-play simulator for the Chess Package
+
+Plays many games at once with the state of every game held in NumPy arrays, so each ply of every game is generated,
+checked and played with a handful of vectorized steps instead of one ChessGame per game.
+
+The board of game i is board[i], 64 int8 squares numbered row * 8 + col like ChessGame.board.  Empty squares are 0,
+White pieces are Piece.kind + 1 and Black pieces the negative of that.  The rules follow ChessGame.move: En Passant
+right after a two square push, castling with an unmoved King and Rook, and promotion to the chosen piece.  Games end
+in checkmate, stalemate, bare Kings or when max_plies is reached.  verify() replays sampled games through
+ChessGame.move to check the two agree.
+
+Usage:
+    python batch.py --games 1000 --max-plies 200 --verify 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import chessgame as cg
+import pieces as p
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = (kind + 1 for kind in range(6))
+# Index used for squares off the board, the boards are padded with an always empty square 64
+OFF = 64
+SQUARES = np.arange(64)
+
+# Result reasons
+PLAYING, CHECKMATE, STALEMATE, BARE_KINGS, MAX_PLIES = range(5)
+REASONS = ('playing', 'checkmate', 'stalemate', 'bare kings', 'max plies')
+
+# Castling rights columns: White right (towards column 7), White left, Black right, Black left
+_CASTLES = (
+    # side, rights column, king from, king to, squares that must be empty, squares that must not be attacked
+    (1, 0, 4, 6, (5, 6), (4, 5, 6)),
+    (1, 1, 4, 2, (1, 2, 3), (4, 3, 2)),
+    (-1, 2, 60, 62, (61, 62), (60, 61, 62)),
+    (-1, 3, 60, 58, (57, 58, 59), (60, 59, 58)),
+)
+
+
+def _step_table(offsets):
+    """(64, len(offsets)) table of the square reached from each square by each offset, OFF if off the board"""
+    table = np.full((64, len(offsets)), OFF, np.intp)
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        for i, (dr, dc) in enumerate(offsets):
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                table[sq, i] = (r + dr) * 8 + c + dc
+    return table
+
+
+def _ray_table(directions):
+    """(len(directions), 64, 7) table of the squares along each ray from each square, OFF past the edge"""
+    table = np.full((len(directions), 64, 7), OFF, np.intp)
+    for d, (dr, dc) in enumerate(directions):
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            for k in range(7):
+                r, c = r + dr, c + dc
+                if not (0 <= r < 8 and 0 <= c < 8):
+                    break
+                table[d, sq, k] = r * 8 + c
+    return table
+
+
+KNIGHT_TABLE = _step_table(p.KNIGHT_OFFSETS)
+KING_TABLE = _step_table(p.KING_OFFSETS)
+_DIRECTIONS = p.ROOK_DIRECTIONS + p.BISHOP_DIRECTIONS
+RAY_TABLE = _ray_table(_DIRECTIONS)
+# The piece other than the Queen that slides along each direction
+RAY_PIECE = np.array([ROOK] * 4 + [BISHOP] * 4)
+# Pawn tables indexed [color, square], color 0 for White and 1 for Black
+PAWN_PUSH = np.stack([_step_table(((1, 0),))[:, 0], _step_table(((-1, 0),))[:, 0]])
+PAWN_DOUBLE = np.full((2, 64), OFF, np.intp)
+PAWN_DOUBLE[0, 8:16] = SQUARES[24:32]
+PAWN_DOUBLE[1, 48:56] = SQUARES[32:40]
+PAWN_CAPTURE = np.stack([_step_table(((1, -1), (1, 1))), _step_table(((-1, -1), (-1, 1)))])
+# Squares a pawn of each color attacks a square from
+PAWN_ATTACKER = np.stack([_step_table(((-1, -1), (-1, 1))), _step_table(((1, -1), (1, 1)))])
+PROMOTIONS = np.array([QUEEN, ROOK, BISHOP, KNIGHT], np.int8)
+
+START_BOARD = np.zeros(64, np.int8)
+START_BOARD[0:8] = [ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK]
+START_BOARD[8:16] = PAWN
+START_BOARD[48:56] = -PAWN
+START_BOARD[56:64] = -START_BOARD[0:8]
+
+
+def _pad(board):
+    """Adds the always empty OFF square to the end of each board"""
+    return np.concatenate([board, np.zeros((len(board), 1), board.dtype)], axis=1)
+
+
+def attacked(board, squares, by_side):
+    """Returns a bool array, True where squares[i] is attacked by side by_side[i] (1 White, -1 Black) on board[i]"""
+    padded = _pad(board)
+    rows = np.arange(len(board))[:, None]
+    by = by_side[:, None]
+    hit = (padded[rows, KNIGHT_TABLE[squares]] == by * KNIGHT).any(axis=1)
+    hit |= (padded[rows, KING_TABLE[squares]] == by * KING).any(axis=1)
+    hit |= (padded[rows, PAWN_ATTACKER[(by_side < 0).astype(np.intp), squares]] == by * PAWN).any(axis=1)
+    first = np.arange(len(board))
+    for d in range(len(_DIRECTIONS)):
+        # The first piece along each ray is the only one that can attack down it
+        values = padded[rows, RAY_TABLE[d, squares]]
+        nearest = values[first, (values != 0).argmax(axis=1)]
+        hit |= (nearest == by_side * RAY_PIECE[d]) | (nearest == by_side * QUEEN)
+    return hit
+
+
+def king_squares(board, side):
+    """Returns the square of side[i]'s King on board[i]"""
+    return (board == (side * KING)[:, None]).argmax(axis=1)
+
+
+def legal_moves(board, side, castling, ep):
+    """Generates the legal moves of every game
+    Returns (game, start, end, promotion, boards after) arrays with one entry per legal move, sorted by game.
+    promotion is the piece code a pawn is promoted to or 0.
+    Inputs:
+    board -- (n, 64) int8 boards
+    side -- (n,) side to move, 1 White or -1 Black
+    castling -- (n, 4) bool castling rights
+    ep -- (n,) ghost pawn square or -1
+    """
+    padded = _pad(board)
+    # +1 for the mover's pieces, -1 for the opponent's, 0 for empty and off the board
+    owner = np.sign(padded) * side[:, None]
+    own = owner[:, :64] == 1
+    kinds = np.abs(board)
+    games, starts, ends = [], [], []
+
+    def add(mask, targets):
+        # targets is the end square for each start square, shared by all games or one row per game
+        game, start = np.nonzero(mask)
+        games.append(game)
+        starts.append(start)
+        ends.append(targets[start] if targets.ndim == 1 else targets[game, start])
+
+    for code, table in ((KNIGHT, KNIGHT_TABLE), (KING, KING_TABLE)):
+        movers = own & (kinds == code)
+        for i in range(table.shape[1]):
+            add(movers & (owner[:, table[:, i]] != 1) & (table[:, i] != OFF), table[:, i])
+
+    for d in range(len(_DIRECTIONS)):
+        sliding = own & ((kinds == RAY_PIECE[d]) | (kinds == QUEEN))
+        for k in range(7):
+            if not sliding.any():
+                break
+            target = RAY_TABLE[d, :, k]
+            target_owner = owner[:, target]
+            add(sliding & (target_owner != 1) & (target != OFF), target)
+            sliding &= target_owner == 0
+
+    color = (side < 0).astype(np.intp)
+    pawns = own & (kinds == PAWN)
+    push = PAWN_PUSH[color]
+    single = pawns & (np.take_along_axis(owner, push, 1) == 0) & (push != OFF)
+    add(single, push)
+    double = PAWN_DOUBLE[color]
+    add(single & (np.take_along_axis(owner, double, 1) == 0) & (double != OFF), double)
+    for i in range(2):
+        capture = PAWN_CAPTURE[color, :, i]
+        takes = (np.take_along_axis(owner, capture, 1) == -1) | (capture == ep[:, None])
+        add(pawns & takes & (capture != OFF), capture)
+
+    game, start, end = np.concatenate(games), np.concatenate(starts), np.concatenate(ends)
+    promotion = np.zeros(len(game), np.int8)
+    # A pawn reaching the last row is one move for each piece it can be promoted to
+    promoting = (kinds[game, start] == PAWN) & (end >> 3 == np.where(side[game] > 0, 7, 0))
+    if promoting.any():
+        keep = ~promoting
+        extra = np.repeat(np.nonzero(promoting)[0], len(PROMOTIONS))
+        game = np.concatenate([game[keep], game[extra]])
+        start = np.concatenate([start[keep], start[extra]])
+        end = np.concatenate([end[keep], end[extra]])
+        promotion = np.concatenate([promotion[keep], np.tile(PROMOTIONS, promoting.sum())])
+
+    # Castling, the King can't castle out of, through or into check
+    for castle_side, right, king_from, king_to, empty, safe in _CASTLES:
+        can = castling[:, right] & (side == castle_side)
+        for sq in empty:
+            can &= board[:, sq] == 0
+        if not can.any():
+            continue
+        ids = np.nonzero(can)[0]
+        for sq in safe:
+            ids = ids[~attacked(board[ids], np.full(len(ids), sq), -side[ids])]
+        game = np.concatenate([game, ids])
+        start = np.concatenate([start, np.full(len(ids), king_from)])
+        end = np.concatenate([end, np.full(len(ids), king_to)])
+        promotion = np.concatenate([promotion, np.zeros(len(ids), np.int8)])
+
+    order = np.argsort(game, kind='stable')
+    game, start, end, promotion = game[order], start[order], end[order], promotion[order]
+
+    # Play every candidate and drop the ones that leave the mover's King attacked
+    after = apply_moves(board[game], start, end, promotion, ep[game])
+    mover = side[game]
+    legal = ~attacked(after, king_squares(after, mover), -mover)
+    return game[legal], start[legal], end[legal], promotion[legal], after[legal]
+
+
+def apply_moves(board, start, end, promotion, ep):
+    """Returns copies of board[i] with move i played on it, moving the Rook when castling and removing the pawn
+    taken En Passant
+    """
+    board = board.copy()
+    rows = np.arange(len(board))
+    piece = board[rows, start]
+    board[rows, end] = piece
+    board[rows, start] = 0
+    sign = np.sign(piece)
+    kinds = np.abs(piece)
+
+    passant = (kinds == PAWN) & (end == ep)
+    board[rows[passant], (end - 8 * sign)[passant]] = 0
+
+    promoted = promotion != 0
+    board[rows[promoted], end[promoted]] = promotion[promoted] * sign[promoted]
+
+    castles = (kinds == KING) & (np.abs(end - start) == 2)
+    rook_from = np.where(end > start, start + 3, start - 4)[castles]
+    rook_to = ((start + end) // 2)[castles]
+    board[rows[castles], rook_to] = board[rows[castles], rook_from]
+    board[rows[castles], rook_from] = 0
+    return board
+
+
+def random_policy(sim, game, start, end, promotion, rng):
+    """Scores every legal move at random, so each game plays a uniformly random legal move"""
+    return rng.random(len(game))
+
+
+def capture_policy(sim, game, start, end, promotion, rng):
+    """Prefers taking the most valuable piece and promoting, otherwise plays at random"""
+    values = np.array([0, 1, 3, 3, 5, 9, 0])
+    gain = values[np.abs(sim.board[game, end])] + values[promotion]
+    return gain + rng.random(len(game))
+
+
+class BatchSimulator:
+    """
+    Plays n games of self-play side by side.
+    Attributes:
+    board -- (n, 64) int8 boards, see the module docstring for the encoding
+    side -- (n,) side to move, 1 White or -1 Black
+    castling -- (n, 4) bool castling rights, White right and left then Black right and left
+    ep -- (n,) square of the ghost pawn left by a two square push, or -1
+    plies -- (n,) number of moves played in each game
+    result -- (n,) 1 White won, -1 Black won, 0 draw or still playing
+    reason -- (n,) why each game ended, an index into REASONS
+    history -- (max_plies, n, 3) start, end and promotion of every move played, -1 where no move was played
+    legal_counts -- (max_plies + 1, n) number of legal moves in each position reached, for verify()
+    """
+    def __init__(self, n_games, max_plies=200, policy=random_policy, seed=None):
+        self.n_games = n_games
+        self.max_plies = max_plies
+        self.policy = policy
+        self.rng = np.random.default_rng(seed)
+        self.board = np.tile(START_BOARD, (n_games, 1))
+        self.side = np.ones(n_games, np.int8)
+        self.castling = np.ones((n_games, 4), bool)
+        self.ep = np.full(n_games, -1, np.intp)
+        self.plies = np.zeros(n_games, np.int32)
+        self.result = np.zeros(n_games, np.int8)
+        self.reason = np.zeros(n_games, np.int8)
+        self.history = np.full((max_plies, n_games, 3), -1, np.int8)
+        self.legal_counts = np.zeros((max_plies + 1, n_games), np.int16)
+
+    @property
+    def boards(self):
+        """(n, 8, 8) view of the boards indexed [game, row, col]"""
+        return self.board.reshape(-1, 8, 8)
+
+    def active(self):
+        """Returns the indices of the games still being played"""
+        return np.nonzero(self.reason == PLAYING)[0]
+
+    def step(self):
+        """Plays one move in every unfinished game and returns how many games are still being played"""
+        ids = self.active()
+        if not len(ids):
+            return 0
+        board, side, ep = self.board[ids], self.side[ids], self.ep[ids]
+        game, start, end, promotion, after = legal_moves(board, side, self.castling[ids], ep)
+        counts = np.bincount(game, minlength=len(ids))
+        self.legal_counts[self.plies[ids], ids] = counts
+
+        # Games without a legal move are over
+        stuck = counts == 0
+        if stuck.any():
+            stuck_ids = ids[stuck]
+            in_check = attacked(board[stuck], king_squares(board[stuck], side[stuck]), -side[stuck])
+            self.reason[stuck_ids] = np.where(in_check, CHECKMATE, STALEMATE)
+            self.result[stuck_ids] = np.where(in_check, -side[stuck], 0)
+
+        # Pick the best scoring move of each game, the last one of its group once sorted by game then score
+        if len(game):
+            scores = self.policy(self, ids[game], start, end, promotion, self.rng)
+            order = np.lexsort((scores, game))
+            last = np.append(np.nonzero(np.diff(game[order]))[0], len(order) - 1)
+            chosen = order[last]
+            self._play(ids[game[chosen]], start[chosen], end[chosen], promotion[chosen], after[chosen])
+        return len(self.active())
+
+    def _play(self, ids, start, end, promotion, after):
+        moving = np.abs(self.board[ids, start])
+        self.history[self.plies[ids], ids] = np.stack([start, end, promotion], axis=1)
+        self.board[ids] = after
+        # Moving the King or a Rook, or taking a Rook, loses the castling rights for those squares
+        for right, squares in enumerate(((4, 7), (4, 0), (60, 63), (60, 56))):
+            for sq in squares:
+                self.castling[ids, right] &= (start != sq) & (end != sq)
+        self.ep[ids] = np.where((moving == PAWN) & (np.abs(end - start) == 16), (start + end) // 2, -1)
+        self.side[ids] = -self.side[ids]
+        self.plies[ids] += 1
+
+        bare = (self.board[ids] != 0).sum(axis=1) == 2
+        self.reason[ids[bare]] = BARE_KINGS
+        out_of_moves = (self.plies[ids] >= self.max_plies) & ~bare
+        self.reason[ids[out_of_moves]] = MAX_PLIES
+
+    def run(self):
+        """Plays every game to the end and returns summary()"""
+        start = time.perf_counter()
+        while self.step():
+            pass
+        summary = self.summary()
+        summary['seconds'] = round(time.perf_counter() - start, 3)
+        summary['plies_per_second'] = int(self.plies.sum() / summary['seconds']) if summary['seconds'] else 0
+        return summary
+
+    def summary(self):
+        """Returns a dict of the results so far"""
+        return {
+            'games': self.n_games,
+            'white_wins': int((self.result == 1).sum()),
+            'black_wins': int((self.result == -1).sum()),
+            'draws': int(((self.result == 0) & (self.reason != PLAYING)).sum()),
+            'playing': int((self.reason == PLAYING).sum()),
+            'reasons': {REASONS[i]: int((self.reason == i).sum()) for i in range(len(REASONS))},
+            'mean_length': float(self.plies.mean()),
+            'max_length': int(self.plies.max()),
+        }
+
+    def replay(self, i):
+        """Replays game i through ChessGame.move and returns the ChessGame
+        Raises AssertionError if the game disagrees with ChessGame at any point.
+        """
+        game = cg.ChessGame()
+        game.new_game()
+        player = game.playerWhite
+        for ply in range(self.plies[i]):
+            assert sum(1 for _ in game.legal_moves(player)) == self.legal_counts[ply, i], 'legal move count'
+            start, end, promotion = (int(x) for x in self.history[ply, i])
+            game.move(player, divmod(start, 8), divmod(end, 8), p.PIECE_CLASSES[promotion - 1] if promotion else None)
+            player = player.get_opponent()
+        assert (encode(game) == self.board[i]).all(), 'final position'
+        if self.reason[i] == CHECKMATE:
+            assert player.is_checkmate(), 'checkmate'
+        elif self.reason[i] == STALEMATE:
+            assert not player.is_checked() and not game.has_legal_move(player), 'stalemate'
+        return game
+
+    def verify(self, sample=10):
+        """Replays up to sample finished games through ChessGame.move and returns a dict of game index to the error
+        found, empty if they all agree
+        """
+        errors = {}
+        finished = np.nonzero(self.reason != PLAYING)[0]
+        for i in self.rng.choice(finished, min(sample, len(finished)), replace=False):
+            try:
+                self.replay(int(i))
+            except (AssertionError, p.MoveError) as err:
+                errors[int(i)] = repr(err)
+        return errors
+
+
+def encode(game):
+    """Returns a ChessGame's board as a 64 square int8 array in the simulator's encoding"""
+    out = np.zeros(64, np.int8)
+    for r, row in enumerate(game.board):
+        for c, cp in enumerate(row):
+            if cp is not None and cp.kind is not None:
+                out[r * 8 + c] = (cp.kind + 1) * (1 if cp.get_player().isWhite else -1)
+    return out
+
+
+if __name__ == '__main__':
+    import json
+
+    parser = argparse.ArgumentParser(description='Play a batch of self-play games.')
+    parser.add_argument('--games', type=int, default=1000, help='number of games (default: 1000)')
+    parser.add_argument('--max-plies', type=int, default=200, help='plies before a game is drawn (default: 200)')
+    parser.add_argument('--policy', choices=('random', 'capture'), default='random', help='move selection policy')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--verify', type=int, default=0, help='games to replay through ChessGame.move')
+    args = parser.parse_args()
+
+    sim = BatchSimulator(args.games, args.max_plies, random_policy if args.policy == 'random' else capture_policy,
+                         args.seed)
+    results = sim.run()
+    if args.verify:
+        results['verify_errors'] = sim.verify(args.verify)
+    print(json.dumps(results, indent=2))
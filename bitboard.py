@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Bitboard backend for the Chess Package
+
+Squares are numbered row * 8 + col, so bit 0 is (0, 0) and bit 63 is (7, 7), matching the (row, col) tuples used
+by ChessGame.board.  With the 'bitboard' backend ChessGame generates its legal moves, validates moves and tests for
+check from these sets with bit operations, and keeps no AttackMap.
+"""
+
+import pieces as p
+
+WHITE = 0
+BLACK = 1
+
+# Ray directions as (row step, col step).  The first four always increase the square index and the last four always
+# decrease it, which decides whether the nearest blocker on a ray is the lowest or the highest set bit.
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, -1), (-1, 1))
+ROOK_DIRECTIONS = (0, 1, 4, 5)
+BISHOP_DIRECTIONS = (2, 3, 6, 7)
+
+
+def square(pos):
+    """Returns the square index for a (row, col) position tuple"""
+    return pos[0] * 8 + pos[1]
+
+
+def position(sq):
+    """Returns the (row, col) position tuple for a square index"""
+    return sq >> 3, sq & 7
+
+
+# (row, col) position tuple of each square index
+POSITIONS = tuple(position(sq) for sq in range(64))
+
+
+def _leaper_table(offsets):
+    """Builds the attack table for a piece that jumps by the given (row, col) offsets"""
+    table = []
+    for sq in range(64):
+        r, c = position(sq)
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= 1 << square((r + dr, c + dc))
+        table.append(bb)
+    return table
+
+
+def _ray_table(dr, dc):
+    """Builds the table of squares reachable from each square along one direction on an empty board"""
+    table = []
+    for sq in range(64):
+        r, c = position(sq)
+        bb = 0
+        r, c = r + dr, c + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            bb |= 1 << square((r, c))
+            r, c = r + dr, c + dc
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_table(((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)))
+KING_ATTACKS = _leaper_table(((1, -1), (1, 0), (1, 1), (0, -1), (0, 1), (-1, -1), (-1, 0), (-1, 1)))
+PAWN_ATTACKS = (_leaper_table(((1, -1), (1, 1))), _leaper_table(((-1, -1), (-1, 1))))
+RAYS = tuple(_ray_table(dr, dc) for dr, dc in DIRECTIONS)
+
+
+# Squares a rook or a bishop on each square reaches on an empty board
+ROOK_LINES = tuple(RAYS[0][sq] | RAYS[1][sq] | RAYS[4][sq] | RAYS[5][sq] for sq in range(64))
+BISHOP_LINES = tuple(RAYS[2][sq] | RAYS[3][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64))
+# Squares each kind of piece other than a pawn reaches from each square on an empty board, indexed by Piece.kind
+REACH = (None, KNIGHT_ATTACKS, BISHOP_LINES, ROOK_LINES, tuple(r | b for r, b in zip(ROOK_LINES, BISHOP_LINES)),
+         KING_ATTACKS)
+# BETWEEN[a][b] is the set of squares strictly between a and b when they share a line, else 0
+BETWEEN = tuple(tuple(next((RAYS[d][a] & ~RAYS[d][b] & ~(1 << b) for d in range(8) if (RAYS[d][a] >> b) & 1), 0)
+                      for b in range(64)) for a in range(64))
+# LINE[a][b] is the whole line across the board through a and b when they share one, else 0
+LINE = tuple(tuple(next((RAYS[d][a] | RAYS[d ^ 4][a] | 1 << a for d in range(8) if (RAYS[d][a] >> b) & 1), 0)
+                   for b in range(64)) for a in range(64))
+# Row each color's pawns start on, where they can move two squares
+PAWN_HOME_ROWS = (1, 6)
+
+
+def squares(bits):
+    """Generator that yields the square index of every set bit, lowest first"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _slide(sq, occupied, directions):
+    """Returns the attack set of a sliding piece on sq, stopping each ray at (and including) the first blocker"""
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if d < 4:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[d][first]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    """Returns the squares attacked by a rook on sq given the occupied squares"""
+    return _slide(sq, occupied, ROOK_DIRECTIONS)
+
+
+def bishop_attacks(sq, occupied):
+    """Returns the squares attacked by a bishop on sq given the occupied squares"""
+    return _slide(sq, occupied, BISHOP_DIRECTIONS)
+
+
+def queen_attacks(sq, occupied):
+    """Returns the squares attacked by a queen on sq given the occupied squares"""
+    return _slide(sq, occupied, ROOK_DIRECTIONS) | _slide(sq, occupied, BISHOP_DIRECTIONS)
+
+
+class BitBoard:
+    """
+    Board state stored as one 64 bit integer per piece type and color.
+    Attributes:
+    pieces -- pieces[color][kind] is the set of squares holding that piece, kinds as defined in pieces.py
+    occupied -- occupied[color] is the union of all pieces of that color
+    ghost -- square set of the ghost pawn left by a two square pawn push, used for En Passant
+    unmoved -- square set of the pieces that have not moved yet, used for castling
+    _checkers -- [white, black] sets of the pieces giving check to each King, worked out when first asked for and
+        forgotten on every change, None while nothing has been worked out
+    _pinned -- [white, black] sets of the pieces pinned to their King, kept like _checkers
+    """
+    def __init__(self):
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        self.ghost = 0
+        self.unmoved = 0
+        self._checkers = None
+        self._pinned = None
+
+    def clear(self):
+        """Removes every piece from the bitboards"""
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        self.ghost = 0
+        self.unmoved = 0
+        self._checkers = None
+        self._pinned = None
+
+    def place(self, piece, pos):
+        """Adds piece to the bitboards at pos"""
+        bit = 1 << square(pos)
+        self._checkers = None
+        self._pinned = None
+        if isinstance(piece, p.GhostPawn):
+            self.ghost |= bit
+            return
+        color = WHITE if piece.get_player().isWhite else BLACK
+        self.pieces[color][piece.kind] |= bit
+        self.occupied[color] |= bit
+        if piece.has_moved():
+            self.unmoved &= ~bit
+        else:
+            self.unmoved |= bit
+        # A real piece landing on the ghost pawn's square replaces it
+        self.ghost &= ~bit
+
+    def remove(self, piece, pos):
+        """Removes piece from the bitboards at pos"""
+        mask = ~(1 << square(pos))
+        self._checkers = None
+        self._pinned = None
+        if isinstance(piece, p.GhostPawn):
+            self.ghost &= mask
+            return
+        color = WHITE if piece.get_player().isWhite else BLACK
+        self.pieces[color][piece.kind] &= mask
+        self.occupied[color] &= mask
+        self.unmoved &= mask
+
+    def attacks(self, color, kind, sq, occupied):
+        """Returns the squares attacked by a piece of color and kind standing on sq"""
+        if kind == p.PAWN:
+            return PAWN_ATTACKS[color][sq]
+        if kind == p.KNIGHT:
+            return KNIGHT_ATTACKS[sq]
+        if kind == p.BISHOP:
+            return bishop_attacks(sq, occupied)
+        if kind == p.ROOK:
+            return rook_attacks(sq, occupied)
+        if kind == p.QUEEN:
+            return queen_attacks(sq, occupied)
+        return KING_ATTACKS[sq]
+
+    def attackers(self, sq, by_color, occupied, removed=0):
+        """Returns the set of squares of the pieces of by_color attacking sq
+        Inputs:
+        sq -- square index to test
+        by_color -- color of the attacking side
+        occupied -- occupied squares the sliding pieces are blocked by, so a move can be tried without making it
+        removed -- squares whose pieces don't count, the pieces a tried move captures
+        """
+        theirs = self.pieces[by_color]
+        queens = theirs[p.QUEEN]
+        return ((KNIGHT_ATTACKS[sq] & theirs[p.KNIGHT]) | (KING_ATTACKS[sq] & theirs[p.KING])
+                | (PAWN_ATTACKS[by_color ^ 1][sq] & theirs[p.PAWN])
+                | (rook_attacks(sq, occupied) & (theirs[p.ROOK] | queens))
+                | (bishop_attacks(sq, occupied) & (theirs[p.BISHOP] | queens))) & ~removed
+
+    def checkers(self, color):
+        """Returns the set of squares of the pieces giving check to the King of color"""
+        cache = self._checkers
+        if cache is None:
+            cache = self._checkers = [None, None]
+        checkers = cache[color]
+        if checkers is None:
+            checkers = cache[color] = self.attackers(self.pieces[color][p.KING].bit_length() - 1, color ^ 1,
+                                                     self.occupied[WHITE] | self.occupied[BLACK])
+        return checkers
+
+    def pinned(self, color):
+        """Returns the set of squares of the pieces of color that are the only piece between their King and a rook,
+        bishop or queen attacking along that line
+        """
+        cache = self._pinned
+        if cache is None:
+            cache = self._pinned = [None, None]
+        pinned = cache[color]
+        if pinned is None:
+            pinned = 0
+            theirs = self.pieces[color ^ 1]
+            king_sq = self.pieces[color][p.KING].bit_length() - 1
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+            snipers = ((ROOK_LINES[king_sq] & (theirs[p.ROOK] | theirs[p.QUEEN]))
+                       | (BISHOP_LINES[king_sq] & (theirs[p.BISHOP] | theirs[p.QUEEN])))
+            for sq in squares(snipers):
+                blockers = BETWEEN[king_sq][sq] & occupied
+                if blockers & self.occupied[color] and not blockers & (blockers - 1):
+                    pinned |= blockers
+            cache[color] = pinned
+        return pinned
+
+    def exposes_king(self, color, start, end):
+        """Returns True if moving the piece of color on start to end would leave its own King attacked
+        The move is tried on copies of the occupied squares, the bitboards aren't changed.
+        """
+        start_bit, end_bit = 1 << start, 1 << end
+        king = self.pieces[color][p.KING]
+        king_sq = king.bit_length() - 1
+        # Any other piece, unless it is taking En Passant, has to deal with a check that is already there and can
+        # only leave the line it is pinned along
+        if king != start_bit and not self.ghost & end_bit:
+            checkers = self.checkers(color)
+            if checkers and (checkers & (checkers - 1)
+                             or not ((checkers | BETWEEN[king_sq][checkers.bit_length() - 1]) >> end) & 1):
+                return True
+            return bool((self.pinned(color) >> start) & 1) and not (LINE[king_sq][start] >> end) & 1
+        occupied = (self.occupied[WHITE] | self.occupied[BLACK]) & ~start_bit | end_bit
+        removed = end_bit
+        # En Passant also empties the square of the pawn it takes
+        if self.ghost & end_bit and self.pieces[color][p.PAWN] & start_bit:
+            captured_bit = 1 << (end - 8 if color == WHITE else end + 8)
+            occupied &= ~captured_bit
+            removed |= captured_bit
+        if king == start_bit:
+            king_sq = end
+        return self.attackers(king_sq, color ^ 1, occupied, removed) != 0
+
+    def legal_moves(self, color):
+        """Returns the list of every legal move of color as (start, end) square index pairs
+        A pawn move onto the last row is listed once, the caller picks the promotion.
+        """
+        them = color ^ 1
+        ours = self.occupied[color]
+        occupied = ours | self.occupied[them]
+        mine = self.pieces[color]
+        king_sq = mine[p.KING].bit_length() - 1
+        checkers = self.checkers(color)
+
+        moves = [(king_sq, end) for end in squares(KING_ATTACKS[king_sq] & ~ours)
+                 if not self.is_attacked(end, them, ignore=king_sq)]
+        if checkers & (checkers - 1):
+            # In double check only the King can move
+            return moves
+        if checkers:
+            # The move has to take the checking piece or block its line, En Passant is tried separately
+            targets = checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+        else:
+            targets = ~ours
+            if self.unmoved & mine[p.KING]:
+                for end in (king_sq + 2, king_sq - 2):
+                    if end >> 3 == king_sq >> 3 and self._castle_status(color, king_sq, end, occupied) == p.LEGAL:
+                        moves.append((king_sq, end))
+        # Only the moves of pinned pieces, En Passant and moves made in check can expose the King
+        pinned = self.pinned(color)
+
+        step = 8 if color == WHITE else -8
+        empty = ~occupied
+        captures = self.occupied[them] | self.ghost
+        for start in squares(mine[p.PAWN]):
+            ends = PAWN_ATTACKS[color][start] & captures
+            one = start + step
+            if 0 <= one < 64 and (empty >> one) & 1:
+                ends |= 1 << one
+                if start >> 3 == PAWN_HOME_ROWS[color] and (empty >> (one + step)) & 1:
+                    ends |= 1 << (one + step)
+            test = checkers or (pinned >> start) & 1
+            for end in squares(ends):
+                en_passant = (self.ghost >> end) & 1
+                if not en_passant and not (targets >> end) & 1:
+                    continue
+                if (test or en_passant) and self.exposes_king(color, start, end):
+                    continue
+                moves.append((start, end))
+
+        for kind in (p.KNIGHT, p.BISHOP, p.ROOK, p.QUEEN):
+            for start in squares(mine[kind]):
+                ends = self.attacks(color, kind, start, occupied) & targets
+                if checkers or (pinned >> start) & 1:
+                    moves.extend((start, end) for end in squares(ends) if not self.exposes_king(color, start, end))
+                else:
+                    moves.extend((start, end) for end in squares(ends))
+        return moves
+
+    def is_attacked(self, sq, by_color, ignore=None):
+        """Checks if square sq is attacked by any piece of by_color and returns True or False
+        Inputs:
+        sq -- square index to test
+        by_color -- color of the attacking side
+        ignore -- optional square index treated as empty, used when testing where a king may move to
+        """
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        if ignore is not None:
+            occupied &= ~(1 << ignore)
+        theirs = self.pieces[by_color]
+        if KNIGHT_ATTACKS[sq] & theirs[p.KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & theirs[p.KING]:
+            return True
+        # A pawn of by_color attacks sq if a pawn of the other color on sq would attack the pawn
+        if PAWN_ATTACKS[by_color ^ 1][sq] & theirs[p.PAWN]:
+            return True
+        if rook_attacks(sq, occupied) & (theirs[p.ROOK] | theirs[p.QUEEN]):
+            return True
+        if bishop_attacks(sq, occupied) & (theirs[p.BISHOP] | theirs[p.QUEEN]):
+            return True
+        return False
+
+    def move_status(self, color, kind, start, end):
+        """Checks a move against the piece movement rules without raising or building anything.
+        Returns pieces.LEGAL, or the status code of the first rule the move breaks, see Piece.move_status.  Like there,
+        capturing your own piece and leaving the King in check are left to ChessGame.is_legal.
+        Inputs:
+        color -- color of the moving piece
+        kind -- kind of the moving piece
+        start -- square index the piece moves from
+        end -- square index the piece moves to
+        """
+        if kind == p.PAWN:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+            one = start + 8 if color == WHITE else start - 8
+            # Straight moves are blocked by any piece in the way, like Pawn.move_status
+            if end == one:
+                return p.BLOCKED if (occupied >> one) & 1 else p.LEGAL
+            targets = self.occupied[color ^ 1] | self.ghost
+            if (PAWN_ATTACKS[color][start] >> end) & 1 and (targets >> end) & 1:
+                return p.LEGAL
+            if end == 2 * one - start and start >> 3 == PAWN_HOME_ROWS[color]:
+                return p.BLOCKED if (occupied >> one) & 1 or (occupied >> end) & 1 else p.LEGAL
+            if (0 <= one < 64 and not (occupied >> one) & 1) or PAWN_ATTACKS[color][start] & targets:
+                return p.INVALID_MOVE
+            return p.NO_VALID_MOVES
+
+        if not (REACH[kind][start] >> end) & 1:
+            if kind == p.KING and abs(end - start) == 2 and start >> 3 == end >> 3:
+                return self._castle_status(color, start, end, self.occupied[WHITE] | self.occupied[BLACK])
+            return p.INVALID_MOVE
+        # Only a sliding piece has squares in between, the one line to the end square is all that is looked at
+        if BETWEEN[start][end] & (self.occupied[WHITE] | self.occupied[BLACK]):
+            return p.BLOCKED
+        if kind == p.KING and self.is_attacked(end, color ^ 1, ignore=start):
+            return p.MOVING_INTO_CHECK
+        return p.LEGAL
+
+    def _castle_status(self, color, start, end, occupied):
+        """Checks a king moving two squares towards one of its rooks, see move_status"""
+        step = 1 if end > start else -1
+        rook_sq = (start & ~7) | (7 if step > 0 else 0)
+        castle_rooks = self.pieces[color][p.ROOK] & self.unmoved
+        if not (self.unmoved >> start) & 1 or not (castle_rooks >> rook_sq) & 1:
+            return p.INVALID_MOVE
+        sq = start + step
+        while sq != rook_sq:
+            if (occupied >> sq) & 1:
+                return p.BLOCKED
+            sq += step
+        # Can't castle out of, through or into check
+        them = color ^ 1
+        if (self.is_attacked(start, them, ignore=start) or self.is_attacked(start + step, them, ignore=start)
+                or self.is_attacked(end, them, ignore=start)):
+            return p.INVALID_MOVE
+        return p.LEGAL
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Opening book for the Chess Package
+
+An opening book is a binary file of fixed size records sorted by the Zobrist hash of a position (see zobrist.py),
+each giving one move played from that position and a weight, how often it was played.  The builder compiles PGN
+files or lists of moves into a book.  The reader memory-maps the file and binary searches it in place, so opening a
+book costs the same whatever its size, nothing is copied out of it but the records a lookup finds, and every process
+that opens the same book shares the same pages.
+
+File layout, all little-endian:
+    header -- 8 byte magic b'CHESSBK1' and the number of records as an unsigned 64 bit int
+    records -- key (unsigned 64 bit), move (unsigned 16 bit), weight (unsigned 16 bit), sorted by key then move
+A move packs the start square in bits 0-5, the end square in bits 6-11 and the kind of piece a pawn is promoted to
+in bits 12-14 (0 for none), squares are row * 8 + col.
+
+Usage:
+    python book.py build games.pgn book.bin --plies 16 --min-count 2
+    python book.py build lines.txt book.bin
+    python book.py probe book.bin --fen 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1'
+"""
+
+import argparse
+import collections
+import mmap
+import random
+import struct
+
+import chessgame as cg
+import engine as en
+import pgn
+import pieces as p
+import zobrist as zb
+
+MAGIC = b'CHESSBK1'
+HEADER = struct.Struct('<8sQ')
+RECORD = struct.Struct('<QHH')
+MAX_WEIGHT = 0xFFFF
+
+BookMove = collections.namedtuple('BookMove', 'move weight')
+BookMove.__doc__ = """One book move for a position
+move -- (start_pos, end_pos, promotion) tuple as ChessGame.move takes it
+weight -- how often the move was played when the book was built
+"""
+
+
+def encode_move(move):
+    """Packs a (start_pos, end_pos, promotion) move into 16 bits"""
+    (r, c), (x, y), promotion = move
+    return (r * 8 + c) | (x * 8 + y) << 6 | (0 if promotion is None else promotion.kind) << 12
+
+
+def decode_move(code):
+    """Unpacks a move packed by encode_move"""
+    start, end, kind = code & 63, code >> 6 & 63, code >> 12
+    return (start >> 3, start & 7), (end >> 3, end & 7), p.PIECE_CLASSES[kind] if kind else None
+
+
+class BookBuilder:
+    """
+    Collects the moves played from each position and writes them out as a book.
+    Attributes:
+    max_plies -- only the first max_plies moves of each game go in the book
+    games -- games added so far
+    rejected -- games that stopped early on a move that couldn't be read or wasn't legal
+    records -- records in the last book written
+    _game -- ChessGame the games are replayed in
+    _counts -- Counter of (hash, encoded move) to the number of times it was played
+    """
+    def __init__(self, max_plies=16, backend='list'):
+        self.max_plies = max_plies
+        self.games = 0
+        self.rejected = 0
+        self.records = 0
+        self._game = cg.ChessGame(backend)
+        self._counts = collections.Counter()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add_moves(self, moves, fen=None):
+        """Adds one game given as a list of (start_pos, end_pos, promotion) moves or coordinate notation strings
+        Returns False if a move wasn't legal, the moves before it are kept.
+        Inputs:
+        moves -- the moves of the game in order
+        fen -- FEN of the position the game starts from, None for the starting position
+        """
+        game = self._game
+        self._start(fen)
+        for ply, move in enumerate(moves):
+            if ply == self.max_plies:
+                break
+            try:
+                if isinstance(move, str):
+                    move = en.parse_move(move)
+                self._play(game.to_move, move)
+            except (ValueError, p.MoveError):
+                self.rejected += 1
+                return False
+        return True
+
+    def add_pgn_game(self, pgn_game):
+        """Adds a pgn.PgnGame, returns False if a move couldn't be read or wasn't legal"""
+        game = self._game
+        try:
+            self._start(pgn_game.tags.get('FEN'))
+        except ValueError:
+            self.rejected += 1
+            return False
+        for ply, san in enumerate(pgn.iter_san(pgn_game.movetext)):
+            if ply == self.max_plies:
+                break
+            try:
+                self._play(game.to_move, pgn.san_to_move(game, game.to_move, san))
+            except ValueError:
+                self.rejected += 1
+                return False
+        return True
+
+    def add_pgn(self, source):
+        """Adds every game in a PGN file or mmap, see pgn.iter_games"""
+        for pgn_game in pgn.iter_games(source):
+            self.add_pgn_game(pgn_game)
+
+    def _start(self, fen):
+        self.games += 1
+        if fen is None:
+            self._game.new_game()
+        else:
+            self._game.set_fen(fen)
+
+    def _play(self, player, move):
+        """Counts a move from the current position and plays it, move() checks it is legal"""
+        game = self._game
+        start_pos, end_pos, promotion = move
+        moving_piece = game.board[start_pos[0]][start_pos[1]]
+        # Store the promotion move() will make, it defaults to a Queen
+        if moving_piece is not None and moving_piece.kind == p.PAWN and end_pos[0] in (0, 7):
+            promotion = promotion or p.PROMOTION_PIECES[0]
+        key = game.hash
+        game.move(player, start_pos, end_pos, promotion)
+        self._counts[key, encode_move((start_pos, end_pos, promotion))] += 1
+
+    def write(self, path, min_count=1):
+        """Writes the book to path and returns the number of records written
+        Inputs:
+        path -- file to write
+        min_count -- leave out moves played fewer times than this
+        """
+        entries = sorted(item for item in self._counts.items() if item[1] >= min_count)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(entries)))
+            buf = bytearray(RECORD.size * 4096)
+            # Pack the records in blocks so a big book doesn't need one bytes object per record
+            for i in range(0, len(entries), 4096):
+                block = entries[i:i + 4096]
+                for j, ((key, code), count) in enumerate(block):
+                    RECORD.pack_into(buf, j * RECORD.size, key, code, min(count, MAX_WEIGHT))
+                f.write(memoryview(buf)[:len(block) * RECORD.size])
+        self.records = len(entries)
+        return self.records
+
+
+class OpeningBook:
+    """
+    Read only view of a book file through a memory map.
+    Attributes:
+    path -- the book file
+    size -- number of records
+    _file -- the open file
+    _map -- mmap of the whole file, shared with every other process that maps it
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can't be mapped
+            self._file.close()
+            raise ValueError('{} is not an opening book'.format(path))
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError('{} is not an opening book'.format(path))
+        magic, self.size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.size * RECORD.size:
+            self.close()
+            raise ValueError('{} is not an opening book or is truncated'.format(path))
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _key_at(self, i):
+        return struct.unpack_from('<Q', self._map, HEADER.size + i * RECORD.size)[0]
+
+    def lookup(self, key):
+        """Returns the list of (encoded move, weight) pairs stored for a hash, in O(log n) probes of the file"""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        offset = HEADER.size + lo * RECORD.size
+        end = len(self._map)
+        while offset < end:
+            record_key, code, weight = RECORD.unpack_from(self._map, offset)
+            if record_key != key:
+                break
+            found.append((code, weight))
+            offset += RECORD.size
+        return found
+
+    def moves(self, game, player=None):
+        """Returns the list of BookMoves for the position, heaviest first
+        Moves that aren't legal are left out, in case another position has the same hash.
+        Inputs:
+        game -- ChessGame to look up
+        player -- Player to move, defaults to game.to_move
+        """
+        if player is None:
+            player = game.to_move
+        key = game.hash
+        if player is not game.to_move:
+            # The hash includes the side to move
+            key ^= zb.SIDE_KEY
+        found = []
+        for code, weight in self.lookup(key):
+            move = decode_move(code)
+            if game.is_legal(player, move[0], move[1]) == p.LEGAL:
+                found.append(BookMove(move, weight))
+        found.sort(key=lambda book_move: -book_move.weight)
+        return found
+
+    def choose(self, game, player=None, rng=random, best=False):
+        """Returns a book move for the position picked at random in proportion to the weights, or None
+        Inputs:
+        game, player -- see moves
+        rng -- random.Random to pick with
+        best -- always pick the heaviest move instead
+        """
+        found = self.moves(game, player)
+        if not found:
+            return None
+        if best:
+            return found[0].move
+        return rng.choices([book_move.move for book_move in found], [book_move.weight for book_move in found])[0]
+
+
+def build(sources, path, max_plies=16, min_count=1, backend='list'):
+    """Builds a book from files and returns the BookBuilder used
+    Inputs:
+    sources -- paths of PGN files (.pgn), or text files with one game per line in coordinate notation
+    path -- book file to write
+    max_plies -- see BookBuilder
+    min_count -- see BookBuilder.write
+    backend -- board representation to replay the games with
+    """
+    builder = BookBuilder(max_plies, backend)
+    for source in sources:
+        if source.endswith('.pgn'):
+            with open(source, 'rb') as f:
+                builder.add_pgn(f)
+        else:
+            with open(source) as f:
+                for line in f:
+                    line = line.split('#', 1)[0].split()
+                    if line:
+                        builder.add_moves(line)
+    builder.write(path, min_count)
+    return builder
+
+
+if __name__ == '__main__':
+    import time
+
+    parser = argparse.ArgumentParser(description='Build or probe an opening book.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='compile games into a book')
+    build_parser.add_argument('sources', nargs='+', help='PGN files, or text files of coordinate notation games')
+    build_parser.add_argument('path', help='book file to write')
+    build_parser.add_argument('--plies', type=int, default=16, help='moves of each game to keep (default: 16)')
+    build_parser.add_argument('--min-count', type=int, default=1, help='leave out rarer moves (default: 1)')
+    build_parser.add_argument('--backend', choices=cg.BACKENDS, default='list', help='board representation to use')
+    probe_parser = commands.add_parser('probe', help='print the book moves for a position')
+    probe_parser.add_argument('path', help='book file to read')
+    probe_parser.add_argument('--fen', help='position to look up (default: the starting position)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        builder = build(args.sources, args.path, args.plies, args.min_count, args.backend)
+        print('{} games  {} rejected  {} records  {:.3f}s'.format(builder.games, builder.rejected, builder.records,
+                                                                 time.perf_counter() - start))
+    else:
+        game = cg.ChessGame.from_fen(args.fen) if args.fen else cg.ChessGame()
+        if not args.fen:
+            game.new_game()
+        with OpeningBook(args.path) as book:
+            found = book.moves(game)
+            total = sum(book_move.weight for book_move in found)
+            for book_move in found:
+                print('{:6}  {:6}  {:5.1f}%'.format(en.format_move(book_move.move), book_move.weight,
+                                                    100.0 * book_move.weight / total))
+            if not found:
+                print('no book moves')
@@ -4,166 +4,602 @@
 """Classes for the Chess Package
 """
 
+import attacks as am
+import bitboard as bb
+import codec as cd
+import evaluation as ev
+import fen as fn
 import pieces as p
 import player as pl
+import render as rd
+import zobrist as zb
+
+# Board representations that can be selected when creating a ChessGame
+BACKENDS = ('list', 'bitboard')
+# Piece classes along the back row from column 0 to 7 at the start of a game
+BACK_ROW = (p.Rook, p.Knight, p.Bishop, p.Queen, p.King, p.Bishop, p.Knight, p.Rook)
 
 
 class ChessGame:
-    def __init__(self):
+    """
+    Attributes:
+    board -- 8x8 list of lists holding the Piece objects, indexed board[row][col]
+    bitboard -- BitBoard mirror of the board when the 'bitboard' backend is selected, legal moves, move validation
+        and check tests are then worked out from it with bit operations.  None for the 'list' backend.
+    attack_map -- AttackMap of the squares each player attacks, kept up to date by every board change, for the
+        'list' backend.  None for the 'bitboard' backend.
+    to_move -- the Player whose turn it is, the opponent of whoever played the last move
+    hash -- Zobrist hash of the position, see zobrist.py
+    score -- packed evaluation score of the pieces on the board, see evaluation.py
+    row_versions -- row_versions[row] goes up every time a square in that row changes, see render.py
+    _castling -- castling rights bits included in the hash
+    _clocks -- (halfmove clock, fullmove number, White to move) of the position the game was set up from
+    _undo_stack -- undo records of the moves played, see make_move and unmake_move
+    """
+    def __init__(self, backend='list'):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown board backend {!r}, expected one of {}'.format(backend, BACKENDS))
+        self.backend = backend
+        self.bitboard = bb.BitBoard() if backend == 'bitboard' else None
         self.board = [[None] * 8 for i in range(8)]
+        self.attack_map = am.AttackMap(self.board) if self.bitboard is None else None
+        self.row_versions = [0] * 8
         self.capturedWhite = []
         self.capturedBlack = []
+        self._undo_stack = []
+        self.hash = 0
+        self.score = 0
+        self._castling = 0
+        self._clocks = (0, 1, True)
         self.playerWhite = pl.Player(is_white=True)
         self.playerBlack = pl.Player(False, self.playerWhite)
         self.playerWhite.set_opponent(self.playerBlack)
+        self.playerWhite.set_game(self)
+        self.playerBlack.set_game(self)
+        self.to_move = self.playerWhite
 
     def __str__(self):
         """
         Method to define how this class is cast to a string.  I used this to output the board state in a human
         readable way.
         """
-        ret_str = '+---' * 8 + '+\n'
-        for r in self.board[::-1]:
-            for cp in r:
-                ret_str += '| {} '.format(str(cp or ' '))
-            ret_str += '|\n' + '+---' * 8 + '+\n'
-        return ret_str
+        border = rd.BORDER + '\n'
+        return border + border.join([rd.row_text(row) + '\n' for row in self.board[::-1]]) + border
 
     def new_game(self):
         """Sets up a new game state by clearing off board and making all new pieces."""
         # Clear board and player states
         self.board = [[None] * 8 for i in range(8)]
+        # Every row of the new board is different from the old one
+        self.row_versions = [version + 1 for version in self.row_versions]
+        if self.bitboard is not None:
+            self.bitboard.clear()
+        else:
+            self.attack_map.clear(self.board)
+        self.capturedWhite = []
+        self.capturedBlack = []
+        self._undo_stack = []
+        self.hash = 0
+        self.score = 0
+        self._castling = 0
+        self._clocks = (0, 1, True)
+        self.to_move = self.playerWhite
+        self.playerWhite.clear()
+        self.playerBlack.clear()
+
+        # Create all the pieces for each player, reusing the ones from the last game, and put them on the board
+        for owner, back_row, pawn_row in ((self.playerWhite, 0, 1), (self.playerBlack, 7, 6)):
+            for col, piece_class in enumerate(BACK_ROW):
+                cp = owner.new_piece(piece_class, (back_row, col), self.board)
+                owner.add_piece(cp)
+                self._place(cp, cp.get_pos())
+                if piece_class is p.King:
+                    owner.set_king(cp)
+            for col in range(8):
+                cp = owner.new_piece(p.Pawn, (pawn_row, col), self.board)
+                owner.add_piece(cp)
+                self._place(cp, cp.get_pos())
+        self._update_castling()
+
+    def setup_position(self, placements, to_move=None, ghost_pos=None):
+        """Clears the board and puts pieces straight onto it, for starting from a position without replaying moves.
+        Inputs:
+        placements -- iterable of (Piece class, is_white, pos, has_moved) tuples, with one King for each player
+        to_move -- the Player whose turn it is, defaults to White
+        ghost_pos -- position of the ghost pawn left behind if the last move was a two square pawn push
+        Raises ValueError, leaving the game as it was, if ghost_pos isn't the empty square a pawn of the player that
+        just moved passed over: the pawn has to be in front of it and the square it came from empty.
+        """
+        placements = list(placements)
+        if ghost_pos is not None:
+            white_pushed = to_move is self.playerBlack
+            row, col = ghost_pos
+            step = 1 if white_pushed else -1
+            squares = {pos: (piece_class, is_white) for piece_class, is_white, pos, moved in placements}
+            if (row != (2 if white_pushed else 5) or not 0 <= col < 8 or ghost_pos in squares
+                    or (row - step, col) in squares or squares.get((row + step, col)) != (p.Pawn, white_pushed)):
+                raise ValueError('{} is not an En Passant square for the last move'.format(ghost_pos))
+
+        self.board = [[None] * 8 for i in range(8)]
+        # Every row of the new board is different from the old one
+        self.row_versions = [version + 1 for version in self.row_versions]
+        if self.bitboard is not None:
+            self.bitboard.clear()
+        else:
+            self.attack_map.clear(self.board)
         self.capturedWhite = []
         self.capturedBlack = []
+        self._undo_stack = []
+        self.hash = 0
+        self.score = 0
+        self._castling = 0
+        self._clocks = (0, 1, True)
+        self.to_move = self.playerWhite
         self.playerWhite.clear()
         self.playerBlack.clear()
 
-        # Create all the White pieces and put those objects on the board and add them to the White player
-        temp_pieces = [p.Rook(self.playerWhite, (0, 0)), p.Knight(self.playerWhite, (0, 1)),
-                       p.Bishop(self.playerWhite, (0, 2)), p.Queen(self.playerWhite, (0, 3)),
-                       p.King(self.playerWhite, (0, 4)), p.Bishop(self.playerWhite, (0, 5)),
-                       p.Knight(self.playerWhite, (0, 6)), p.Rook(self.playerWhite, (0, 7))]
-        temp_pieces += [p.Pawn(self.playerWhite, (1, i)) for i in range(8)]
-        for cp in temp_pieces:
-            cp.set_board(self.board)
-            self.playerWhite.add_piece(cp)
-            self.board[cp.get_row()][cp.get_col()] = cp
-        self.playerWhite.set_king(temp_pieces[4])
-
-        # Create all the Black pieces and put those objects on the board and add them to the Black player
-        temp_pieces = [p.Rook(self.playerBlack, (7, 0)), p.Knight(self.playerBlack, (7, 1)),
-                       p.Bishop(self.playerBlack, (7, 2)), p.Queen(self.playerBlack, (7, 3)),
-                       p.King(self.playerBlack, (7, 4)), p.Bishop(self.playerBlack, (7, 5)),
-                       p.Knight(self.playerBlack, (7, 6)), p.Rook(self.playerBlack, (7, 7))]
-        temp_pieces += [p.Pawn(self.playerBlack, (6, i)) for i in range(8)]
-        for cp in temp_pieces:
-            cp.set_board(self.board)
-            self.playerBlack.add_piece(cp)
-            self.board[cp.get_row()][cp.get_col()] = cp
-        self.playerBlack.set_king(temp_pieces[4])
-
-    def move(self, moving_player, start_pos, end_pos):
+        new_pieces = []
+        for piece_class, is_white, pos, moved in placements:
+            owner = self.playerWhite if is_white else self.playerBlack
+            cp = owner.new_piece(piece_class, pos, self.board)
+            cp.set_moved(moved)
+            owner.add_piece(cp)
+            if cp.kind == p.KING:
+                owner.set_king(cp)
+            new_pieces.append(cp)
+        self._place_all(new_pieces)
+        self._update_castling()
+        self.set_to_move(to_move or self.playerWhite)
+
+        if ghost_pos is not None:
+            # The ghost pawn belongs to the player that just pushed, one row behind its pawn
+            pusher = self.to_move.get_opponent()
+            ghost = pusher.new_ghost_pawn(ghost_pos, self.board)
+            pusher.ghost_pawn = ghost
+            self._place(ghost, ghost_pos)
+
+    @classmethod
+    def from_fen(cls, fen, backend='list'):
+        """Returns a new game set up from a FEN string, see set_fen"""
+        game = cls(backend)
+        game.set_fen(fen)
+        return game
+
+    def set_fen(self, fen):
+        """Sets the game up from a FEN string, reusing this game's objects.  Raises ValueError for a bad FEN."""
+        placements, white_to_move, ghost_pos, halfmove, fullmove = fn.parse(fen)
+        try:
+            self.setup_position(placements, self.playerWhite if white_to_move else self.playerBlack, ghost_pos)
+        except ValueError as err:
+            raise ValueError('Invalid FEN {!r}: {}'.format(fen, err))
+        self._clocks = (halfmove, fullmove, white_to_move)
+
+    def to_fen(self):
+        """Returns the FEN string of the current position"""
+        return fn.to_fen(self)
+
+    @classmethod
+    def from_bytes(cls, data, backend='list'):
+        """Returns a new game set up from a to_bytes() state, see set_bytes"""
+        game = cls(backend)
+        game.set_bytes(data)
+        return game
+
+    def set_bytes(self, data):
+        """Sets the game up from a to_bytes() state, reusing this game's objects.  Raises ValueError for a bad state."""
+        cd.decode(data, self)
+
+    def to_bytes(self):
+        """Returns the full state of the game as codec.SIZE bytes: board, moved flags, side to move, ghost pawn,
+        move counters and captured pieces, see codec.py
+        """
+        return cd.encode(self)
+
+    def halfmove_clock(self):
+        """Returns the number of moves since the last capture or pawn move"""
+        count = 0
+        for record in reversed(self._undo_stack):
+            # record[1] is the moving piece and record[5] the captured piece
+            if record[1].kind == p.PAWN or record[5] is not None:
+                return count
+            count += 1
+        return count + self._clocks[0]
+
+    def fullmove_number(self):
+        """Returns the number of the current full move, it goes up by one after each Black move"""
+        halfmove, fullmove, white_to_move = self._clocks
+        return fullmove + (len(self._undo_stack) + (0 if white_to_move else 1)) // 2
+
+    def move(self, moving_player, start_pos, end_pos, promotion=None):
         """Method used to perform a move action on a piece
         Inputs:
         startPos -- Tuple with integer coordinates (x,y) for Piece that is moving
         endPos -- Tuple with integer coordinates (x,y) for final position of move
+        promotion -- Piece class a pawn reaching the last row is promoted to, defaults to a Queen
         """
-        # Make sure the start and stop positions are on the board
-        if max(start_pos) > 7 or min(start_pos) < 0:
-            raise p.MoveError('Invalid Piece', 'Position of Piece not on the board', None, start_pos, end_pos)
-
-        # Get the piece that is being moved
+        status = self.is_legal(moving_player, start_pos, end_pos)
+        if status != p.LEGAL:
+            expression, message = p.MOVE_ERRORS[status]
+            # Errors about positions off the board have no piece to report
+            off_board = status == p.START_OFF_BOARD or status == p.END_OFF_BOARD
+            raise p.MoveError(expression, message, None if off_board else self.board[start_pos[0]][start_pos[1]],
+                              start_pos, end_pos)
         moving_piece = self.board[start_pos[0]][start_pos[1]]
 
-        # Make sure that there is a piece in that spot and make sure that it belongs to the correct player
-        if moving_piece is None:
-            raise p.MoveError('Invalid Piece', 'No Piece located on the selected position', moving_piece, start_pos,
-                              end_pos)
-        if moving_piece.get_player() != moving_player:
-            raise p.MoveError('Invalid Piece', "Cannot move the opponent's Piece", moving_piece, start_pos, end_pos)
+        # Make sure a pawn reaching the last row has something to be promoted to
+        if isinstance(moving_piece, p.Pawn) and end_pos[0] in (0, 7):
+            if promotion is None:
+                promotion = p.PROMOTION_PIECES[0]
+            if promotion not in p.PROMOTION_PIECES:
+                raise p.MoveError('Invalid Move', 'Not a valid Piece to promote to', moving_piece, start_pos,
+                                  end_pos)
+        else:
+            promotion = None
 
-        # Make sure the stop position is on the board
-        if max(end_pos) > 7 or min(end_pos) < 0:
-            raise p.MoveError('Invalid Move', 'Position of Move not on the board', None, start_pos, end_pos)
+        self.make_move(moving_player, start_pos, end_pos, promotion)
 
-        # Make sure that the piece is actually being moved
-        if start_pos == end_pos:
-            raise p.MoveError('MoveError', "Can't move a piece to it's own location.", moving_piece, start_pos,
-                              end_pos)
+    def is_legal(self, moving_player, start_pos, end_pos):
+        """Checks if moving_player can move the piece on start_pos to end_pos, without raising or building anything.
+        Returns pieces.LEGAL, or the status code of the first rule the move breaks; pieces.MOVE_ERRORS describes each
+        code.  Use this to probe many candidate moves, move() raises a MoveError instead.
+        Inputs:
+        startPos -- Tuple with integer coordinates (x,y) for Piece that is moving
+        endPos -- Tuple with integer coordinates (x,y) for final position of move
+        """
+        r, c = start_pos
+        if not (0 <= r < 8 and 0 <= c < 8):
+            return p.START_OFF_BOARD
+        moving_piece = self.board[r][c]
+        if moving_piece is None or moving_piece.kind is None:
+            return p.NO_PIECE
+        if moving_piece.get_player() is not moving_player:
+            return p.OPPONENTS_PIECE
+        x, y = end_pos
+        if not (0 <= x < 8 and 0 <= y < 8):
+            return p.END_OFF_BOARD
+        if r == x and c == y:
+            return p.NOT_MOVING
+        capped_piece = self.board[x][y]
+        if capped_piece is not None and capped_piece.kind is not None and capped_piece.get_player() is moving_player:
+            return p.OWN_CAPTURE
 
         # Check the piece's logic to see if the input move is valid
-        moving_piece.check_valid_move(end_pos)
+        bits = self.bitboard
+        if bits is not None:
+            color = bb.WHITE if moving_player.isWhite else bb.BLACK
+            start, end = r * 8 + c, x * 8 + y
+            status = bits.move_status(color, moving_piece.kind, start, end)
+            if status == p.LEGAL and moving_piece.kind != p.KING and bits.exposes_king(color, start, end):
+                return p.LEAVES_KING_IN_CHECK
+            return status
+        status = moving_piece.move_status(end_pos)
+        if status != p.LEGAL:
+            return status
+
+        # Make sure the move doesn't leave the player's own King in check, King moves already checked this
+        if moving_piece is not moving_player.get_king() and self._leaves_king_in_check(moving_player, start_pos,
+                                                                                        end_pos):
+            return p.LEAVES_KING_IN_CHECK
+        return p.LEGAL
+
+    def make_move(self, moving_player, start_pos, end_pos, promotion=None):
+        """Plays a move without validating it and pushes an undo record so unmake_move can take it back.
+        Use move() for moves that haven't been checked yet, legal_moves() only yields moves that are safe to make.
+        Inputs:
+        startPos -- Tuple with integer coordinates (x,y) for Piece that is moving
+        endPos -- Tuple with integer coordinates (x,y) for final position of move
+        promotion -- Piece class a pawn reaching the last row is promoted to, None for every other move
+        """
+        opponent = moving_player.get_opponent()
+        old_hash = self.hash
+        moving_piece = self._lift(start_pos)
 
         # Move logic
         # Check if there is a piece getting captured
-        # if no capture just move the piece
-        if self.board[end_pos[0]][end_pos[1]] is None:
-            moving_piece.set_pos(end_pos)
-            self.board[end_pos[0]][end_pos[1]] = moving_piece
-            self.board[start_pos[0]][start_pos[1]] = None
-        # if captured move captured piece to the appropriate captured list and move the piece
-        else:
-            capped_piece = self.board[end_pos[0]][end_pos[1]]
-            # Make sure they aren't capturing their own piece.
-            if capped_piece.player == moving_piece.get_player():
-                raise p.MoveError('Invalid Move' 'Cannot capture your own Piece', moving_piece, start_pos, end_pos)
-            # Cover En Passant by checking if the captured piece is a ghost pawn and switching capped piece to the
-            # parent pawn.
-            if isinstance(capped_piece, p.GhostPawn) and isinstance(moving_piece, p.Pawn):
+        capped_piece = self._lift(end_pos)
+        capped_pos = end_pos
+        # Cover En Passant by checking if the captured piece is a ghost pawn and switching capped piece to the
+        # parent pawn.  Any other piece moving onto a ghost pawn just replaces it.
+        if isinstance(capped_piece, p.GhostPawn):
+            if moving_piece.kind == p.PAWN:
                 capped_piece = capped_piece.get_parent()
+                capped_pos = capped_piece.get_pos()
+                self._lift(capped_pos)
+            else:
+                capped_piece = None
+        # if captured move captured piece to the appropriate captured list
+        if capped_piece is not None:
             capped_piece.set_pos(None)
-            if capped_piece.isWhite:
+            if capped_piece.get_player().isWhite:
                 self.capturedWhite.append(capped_piece)
             else:
                 self.capturedBlack.append(capped_piece)
-            moving_piece.set_pos(end_pos)
-            self.board[end_pos[0]][end_pos[1]] = moving_piece
-            self.board[start_pos[0]][start_pos[1]] = None
 
         # Save that the piece has moved, this affects castle logic and pawn move logic
+        was_moved = moving_piece.has_moved()
         moving_piece.set_moved()
+        self._place(moving_piece, end_pos)
+
+        # Castling is a King moving two squares, bring the Rook over to the other side of the King
+        rook = rook_was_moved = None
+        if moving_piece.kind == p.KING and abs(end_pos[1] - start_pos[1]) == 2:
+            rook_col, rook_end_col = (7, end_pos[1] - 1) if end_pos[1] > start_pos[1] else (0, end_pos[1] + 1)
+            rook = self._lift((end_pos[0], rook_col))
+            rook_was_moved = rook.has_moved()
+            rook.set_moved()
+            self._place(rook, (end_pos[0], rook_end_col))
+
+        # Promote a pawn that reached the last row by swapping it for a new piece
+        new_piece = None
+        if promotion is not None:
+            self._lift(end_pos)
+            moving_piece.set_pos(None)
+            new_piece = moving_player.new_piece(promotion, end_pos, self.board)
+            new_piece.set_moved()
+            moving_player.add_piece(new_piece)
+            self._place(new_piece, end_pos)
 
         # Manage Ghost Pawns
         # If opponent has a ghost pawn, remove it
-        opp_ghost_pawn = moving_player.get_opponent().ghost_pawn
+        opp_ghost_pawn = opponent.ghost_pawn
+        opp_ghost_pos = None
         if opp_ghost_pawn is not None:
-            gp_row = opp_ghost_pawn.get_row()
-            gp_col = opp_ghost_pawn.get_col()
-            self.board[gp_row][gp_col] = None
-            moving_player.get_opponent().ghost_pawn = None
-        # Check if a pawn moved 2 spaces this turn, them make a ghost pawn
-        if isinstance(moving_piece, p.Pawn):
-            diff_row = start_pos[0] - end_pos[0]
-            if abs(diff_row) == 2:
-                diff_row = diff_row / 2
-                new_gp = p.GhostPawn(moving_piece, (start_pos[0] - diff_row, start_pos[1]))
-                moving_player.ghost_pawn = new_gp
-                self.board[new_gp.get_row()][new_gp.get_col()]
+            opp_ghost_pos = opp_ghost_pawn.get_pos()
+            if self.board[opp_ghost_pos[0]][opp_ghost_pos[1]] is opp_ghost_pawn:
+                self._lift(opp_ghost_pos)
+            opponent.ghost_pawn = None
+        # Check if a pawn moved 2 spaces this turn, then put the player's ghost pawn behind it
+        old_ghost_pos = None
+        if moving_piece.kind == p.PAWN and abs(start_pos[0] - end_pos[0]) == 2:
+            # The player only has one ghost pawn, take it off the board first if it is still there
+            old_ghost_pawn = moving_player.ghost_pawn
+            if old_ghost_pawn is not None:
+                gp_row, gp_col = old_ghost_pawn.get_pos()
+                if self.board[gp_row][gp_col] is old_ghost_pawn:
+                    old_ghost_pos = gp_row, gp_col
+                    self._lift(old_ghost_pos)
+            new_gp = moving_player.new_ghost_pawn(((start_pos[0] + end_pos[0]) // 2, start_pos[1]), self.board)
+            moving_player.ghost_pawn = new_gp
+            self._place(new_gp, new_gp.get_pos())
+
+        self._undo_stack.append((moving_player, moving_piece, start_pos, end_pos, was_moved, capped_piece, capped_pos,
+                                 rook, rook_was_moved, new_piece, opp_ghost_pos, old_ghost_pos, self.to_move,
+                                 old_hash))
+        self.set_to_move(opponent)
+        self._update_castling()
+
+    def unmake_move(self):
+        """Takes back the last move played with make_move() or move()"""
+        (moving_player, moving_piece, start_pos, end_pos, was_moved, capped_piece, capped_pos,
+         rook, rook_was_moved, new_piece, opp_ghost_pos, old_ghost_pos, to_move, old_hash) = self._undo_stack.pop()
+
+        # Remove the ghost pawn this move made, putting back the one it replaced
+        if moving_piece.kind == p.PAWN and abs(start_pos[0] - end_pos[0]) == 2:
+            self._lift(moving_player.ghost_pawn.get_pos())
+            moving_player.ghost_pawn = None
+            if old_ghost_pos is not None:
+                moving_player.ghost_pawn = moving_player.new_ghost_pawn(old_ghost_pos, self.board)
+                self._place(moving_player.ghost_pawn, old_ghost_pos)
+
+        # Swap a promoted piece back for the pawn, it was the last piece added to the player
+        self._lift(end_pos)
+        if new_piece is not None:
+            moving_player.release_piece(moving_player.pieces.pop())
+
+        if rook is not None:
+            rook_col, rook_end_col = (7, end_pos[1] - 1) if end_pos[1] > start_pos[1] else (0, end_pos[1] + 1)
+            self._lift((end_pos[0], rook_end_col))
+            rook.set_moved(rook_was_moved)
+            self._place(rook, (end_pos[0], rook_col))
+
+        moving_piece.set_moved(was_moved)
+        self._place(moving_piece, start_pos)
+
+        if capped_piece is not None:
+            if capped_piece.get_player().isWhite:
+                self.capturedWhite.pop()
+            else:
+                self.capturedBlack.pop()
+            self._place(capped_piece, capped_pos)
+
+        if opp_ghost_pos is not None:
+            opponent = moving_player.get_opponent()
+            opponent.ghost_pawn = opponent.new_ghost_pawn(opp_ghost_pos, self.board)
+            self._place(opponent.ghost_pawn, opp_ghost_pos)
+
+        self.to_move = to_move
+        self._castling = zb.castling_rights(self.board)
+        self.hash = old_hash
+
+    def set_to_move(self, player):
+        """Sets whose turn it is, keeping the hash in sync"""
+        if player is not self.to_move:
+            self.hash ^= zb.SIDE_KEY
+            self.to_move = player
+
+    def repetition_count(self):
+        """Returns how many times the current position has been reached before in this game"""
+        # Any capture, pawn move or loss of castling rights can't be undone, but comparing every earlier position is
+        # cheap enough since each comparison is a single integer test
+        return sum(1 for record in self._undo_stack if record[-1] == self.hash)
+
+    def _update_castling(self):
+        """Recomputes the castling rights after the King or a Rook moved or was taken, keeping the hash in sync"""
+        rights = zb.castling_rights(self.board)
+        if rights != self._castling:
+            self.hash ^= zb.CASTLING_KEYS[self._castling] ^ zb.CASTLING_KEYS[rights]
+            self._castling = rights
+
+    def legal_moves(self, player):
+        """Generator that yields every legal move for player as (start_pos, end_pos, promotion) tuples.
+        promotion is None unless a pawn reaches the last row, then one move is yielded for each Piece class in
+        pieces.PROMOTION_PIECES.  Each tuple can be passed straight to move().
+        """
+        last_row = 7 if player.isWhite else 0
+        if self.bitboard is not None:
+            color = bb.WHITE if player.isWhite else bb.BLACK
+            pawns = self.bitboard.pieces[color][p.PAWN]
+            for start, end in self.bitboard.legal_moves(color):
+                start_pos, end_pos = bb.POSITIONS[start], bb.POSITIONS[end]
+                if end_pos[0] == last_row and (pawns >> start) & 1:
+                    for promotion in p.PROMOTION_PIECES:
+                        yield start_pos, end_pos, promotion
+                else:
+                    yield start_pos, end_pos, None
+            return
+        king = player.get_king()
+        for piece in player.pieces:
+            start_pos = piece.get_pos()
+            if start_pos is None:
+                continue
+            for end_pos in piece.gen_all_valid_moves():
+                # The King's own generator already keeps it out of check
+                if piece is not king and self._leaves_king_in_check(player, start_pos, end_pos):
+                    continue
+                if piece.kind == p.PAWN and end_pos[0] == last_row:
+                    for promotion in p.PROMOTION_PIECES:
+                        yield start_pos, end_pos, promotion
+                else:
+                    yield start_pos, end_pos, None
+
+    def is_attacked(self, pos, by_player, ignore=None):
+        """Checks if any piece of by_player attacks pos and returns True or False
+        Inputs:
+        pos -- Tuple with integer coordinates (x,y) of the square to test
+        by_player -- Player whose pieces are attacking
+        ignore -- optional position treated as empty, so a King can't shield the square it is moving to
+        """
+        if self.bitboard is not None:
+            return self.bitboard.is_attacked(pos[0] * 8 + pos[1], bb.WHITE if by_player.isWhite else bb.BLACK,
+                                             None if ignore is None else ignore[0] * 8 + ignore[1])
+        return self.attack_map.is_attacked(pos, by_player.isWhite, ignore)
+
+    def has_legal_move(self, player):
+        """Returns True if player has at least one legal move.
+        Stops at the first legal move found, and when player is in check only the moves that could get out of it are
+        tried.
+        """
+        if self.bitboard is not None:
+            return bool(self.bitboard.legal_moves(bb.WHITE if player.isWhite else bb.BLACK))
+        king = player.get_king()
+        for _ in king.gen_all_valid_moves():
+            return True
+        king_pos = king.get_pos()
+        checkers = self.attack_map.get_attackers(king_pos, not player.isWhite)
+        # In double check only the King can move
+        if len(checkers) > 1:
+            return False
+        # In check the move has to capture the checking piece or block its line
+        escapes = None
+        if checkers:
+            checker = checkers[0]
+            r, c = checker_pos = checker.get_pos()
+            escapes = {checker_pos}
+            if checker.kind in am.SLIDER_RAYS:
+                dr, dc = am._sign(king_pos[0] - r), am._sign(king_pos[1] - c)
+                x, y = r + dr, c + dc
+                while (x, y) != king_pos:
+                    escapes.add((x, y))
+                    x, y = x + dr, y + dc
+            # A checking pawn that just moved two squares can also be taken En Passant
+            ghost = player.get_opponent().ghost_pawn
+            if ghost is not None and ghost.get_parent() is checker:
+                escapes.add(ghost.get_pos())
+        for piece in player.pieces:
+            start_pos = piece.get_pos()
+            if piece is king or start_pos is None:
+                continue
+            for end_pos in piece.gen_all_valid_moves():
+                if escapes is not None and end_pos not in escapes:
+                    continue
+                if not self._leaves_king_in_check(player, start_pos, end_pos):
+                    return True
+        return False
+
+    def _leaves_king_in_check(self, player, start_pos, end_pos):
+        """Tries a move on the board and returns True if it leaves player's King in check.
+        The move is taken back before returning.
+        """
+        if self.bitboard is not None:
+            return self.bitboard.exposes_king(bb.WHITE if player.isWhite else bb.BLACK, start_pos[0] * 8 + start_pos[1],
+                                              end_pos[0] * 8 + end_pos[1])
+        # Unless the King is already in check, moving a piece can only expose the King along a line through the
+        # square it leaves.  En Passant also empties the captured pawn's square so that is tried on the board.
+        by_white = not player.isWhite
+        king_pos = player.get_king().get_pos()
+        if (not self.attack_map.is_attacked(king_pos, by_white)
+                and not isinstance(self.board[end_pos[0]][end_pos[1]], p.GhostPawn)):
+            return self.attack_map.opens_line(start_pos, king_pos, by_white, end_pos)
+        self.make_move(player, start_pos, end_pos)
+        in_check = self.is_attacked(player.get_king().get_pos(), player.get_opponent())
+        self.unmake_move()
+        return in_check
+
+    def _place(self, piece, pos):
+        """Puts piece on the board at pos and keeps the backend state in sync.
+        Every change to the board goes through _place, _place_all and _lift.
+        """
+        self.board[pos[0]][pos[1]] = piece
+        self.row_versions[pos[0]] += 1
+        piece.set_pos(pos)
+        self.hash ^= zb.piece_key(piece, pos)
+        self.score += ev.piece_score(piece, pos)
+        if self.bitboard is not None:
+            self.bitboard.place(piece, pos)
+        else:
+            self.attack_map.place(piece, pos)
+
+    def _place_all(self, pieces):
+        """Puts a list of pieces on an empty board at their positions, the same as calling _place for each one but
+        the attack map is built once at the end instead of being updated as every piece blocks the ones before it.
+        """
+        board = self.board
+        for piece in pieces:
+            r, c = pos = piece.get_pos()
+            board[r][c] = piece
+            self.row_versions[r] += 1
+            self.hash ^= zb.piece_key(piece, pos)
+            self.score += ev.piece_score(piece, pos)
+            if self.bitboard is not None:
+                self.bitboard.place(piece, pos)
+        if self.bitboard is None:
+            self.attack_map.add_all(pieces)
+
+    def _lift(self, pos):
+        """Takes the piece at pos off the board, keeps the backend state in sync and returns the piece"""
+        piece = self.board[pos[0]][pos[1]]
+        self.board[pos[0]][pos[1]] = None
+        if piece is not None:
+            self.row_versions[pos[0]] += 1
+            self.hash ^= zb.piece_key(piece, pos)
+            self.score -= ev.piece_score(piece, pos)
+            if self.bitboard is not None:
+                self.bitboard.remove(piece, pos)
+            else:
+                self.attack_map.remove(piece, pos)
+        return piece
 
     def castle_right(self, moving_player):
-        # TODO: Implement castle logic
-        # -Test if valid move
-        # --Move King and Rook
-        pass
+        """Castle moving_player's King towards the Rook in column 7"""
+        r, c = moving_player.get_king().get_pos()
+        self.move(moving_player, (r, c), (r, c + 2))
 
     def castle_left(self, moving_player):
-        # TODO: Implement castle logic
-        # -Test if valid move
-        # --Move King and Rook
-        pass
+        """Castle moving_player's King towards the Rook in column 0"""
+        r, c = moving_player.get_king().get_pos()
+        self.move(moving_player, (r, c), (r, c - 2))
 
 
 if __name__ == '__main__':
-    import os
-
-    def cls():
-        os.system('cls' if os.name == 'nt' else 'clear')
+    import sys
 
     a = ChessGame()
     a.new_game()
+    # Draw the board once, then only redraw the squares each move changes
+    view = rd.TerminalView(a)
+    sys.stdout.write(view.frame())
     moving_player = a.playerWhite
     while 1:
-        print(a)
         while 1:
             try:
                 piece_row = int(input("Select Piece Row: "))
@@ -183,7 +619,7 @@ if __name__ == '__main__':
                     print('Not a valid input, Try Again.')
             except p.MoveError as err:
                 print('{}: {}'.format(err.expression, err.message))
-        cls()
+        sys.stdout.write(view.update() + view.below())
         if moving_player.get_opponent().is_checkmate():
             print('Checkmate!')
             print('{} Wins!'.format('White' if moving_player.isWhite else 'Black'))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Fixed size binary game states for the Chess Package
+
+Encodes the full state of a ChessGame in SIZE (60) bytes, for checkpointing games and moving them between
+processes and hosts without pickling the game's object graph.  Every state is the same size, so many games pack
+into one contiguous buffer and the i-th game is found at i * SIZE.
+
+Layout, all little-endian:
+    board -- 32 bytes, a 4 bit code for each square row * 8 + col, the even square in the low half of each byte.
+        0 is empty, Piece.kind + 1 a White piece and Piece.kind + 9 a Black piece
+    moved -- unsigned 64 bit int with bit row * 8 + col set for every piece that has moved
+    side -- 1 byte, 1 if White is to move
+    ghost -- 1 byte, the square of the ghost pawn left by a two square push, or 255 for none
+    halfmove, fullmove -- unsigned 16 bit ints, the halfmove clock and the fullmove number
+    captured -- 7 bytes for White then 7 for Black, each the number of captured pieces in the low 4 bits followed by
+        the kind of each piece in capture order, 3 bits each
+The undo stack isn't kept, so a decoded game starts its move history (and repetition count) afresh.
+
+Usage:
+    python codec.py --games 1000 --plies 40
+"""
+
+import argparse
+import struct
+
+import fen as fn
+import pieces as p
+
+STATE = struct.Struct('<32sQBBHH7s7s')
+SIZE = STATE.size
+NO_GHOST = 255
+# At most 15 pieces of a side can be captured, its King never is
+MAX_CAPTURED = 15
+
+
+def _pack_captured(captured):
+    value = len(captured)
+    for i, cp in enumerate(captured):
+        value |= cp.kind << (4 + 3 * i)
+    return value.to_bytes(7, 'little')
+
+
+def _unpack_captured(data):
+    value = int.from_bytes(data, 'little')
+    return [value >> (4 + 3 * i) & 7 for i in range(value & 15)]
+
+
+def pack_into(buffer, offset, game):
+    """Writes the state of a game into buffer at offset, SIZE bytes"""
+    board = bytearray(32)
+    moved = 0
+    for r, row in enumerate(game.board):
+        for c, cp in enumerate(row):
+            if cp is None or cp.kind is None:
+                continue
+            sq = r * 8 + c
+            code = cp.kind + (1 if cp.get_player().isWhite else 9)
+            board[sq >> 1] |= code << 4 if sq & 1 else code
+            if cp.has_moved():
+                moved |= 1 << sq
+    ghost = game.to_move.get_opponent().ghost_pawn
+    STATE.pack_into(buffer, offset, bytes(board), moved, 1 if game.to_move.isWhite else 0,
+                    NO_GHOST if ghost is None else ghost.get_row() * 8 + ghost.get_col(),
+                    min(game.halfmove_clock(), 0xFFFF), min(game.fullmove_number(), 0xFFFF),
+                    _pack_captured(game.capturedWhite), _pack_captured(game.capturedBlack))
+
+
+def encode(game):
+    """Returns the SIZE byte state of a game"""
+    buffer = bytearray(SIZE)
+    pack_into(buffer, 0, game)
+    return bytes(buffer)
+
+
+def unpack_from(buffer, offset, game):
+    """Sets game up from the state at offset in buffer and returns it
+    Raises ValueError if the state doesn't hold one King for each player, has an unknown piece code or ghost square, or
+    is a position that can't come up in a game (see fen.check_position and ChessGame.setup_position).
+    """
+    board, moved, side, ghost, halfmove, fullmove, white_captured, black_captured = STATE.unpack_from(buffer, offset)
+    placements = []
+    kings = [0, 0]
+    for i, byte in enumerate(board):
+        for sq, code in ((2 * i, byte & 15), (2 * i + 1, byte >> 4)):
+            if not code:
+                continue
+            is_white = code < 9
+            kind = code - 1 if is_white else code - 9
+            if not 0 <= kind < 6:
+                raise ValueError('Invalid game state: unknown piece code {}'.format(code))
+            if kind == p.KING:
+                kings[not is_white] += 1
+            placements.append((p.PIECE_CLASSES[kind], is_white, (sq >> 3, sq & 7), bool(moved >> sq & 1)))
+    if kings != [1, 1]:
+        raise ValueError('Invalid game state: each side needs exactly one King')
+    try:
+        fn.check_position(placements, bool(side))
+    except ValueError as err:
+        raise ValueError('Invalid game state: {}'.format(err))
+    if ghost != NO_GHOST and ghost >= 64:
+        raise ValueError('Invalid game state: ghost square {} is off the board'.format(ghost))
+    to_move = game.playerWhite if side else game.playerBlack
+    try:
+        game.setup_position(placements, to_move, None if ghost == NO_GHOST else (ghost >> 3, ghost & 7))
+    except ValueError as err:
+        raise ValueError('Invalid game state: {}'.format(err))
+    game._clocks = (halfmove, fullmove, bool(side))
+
+    # Captured pieces stay in their owner's piece list with no position, like in a game that was played
+    for owner, captured, data in ((game.playerWhite, game.capturedWhite, white_captured),
+                                  (game.playerBlack, game.capturedBlack, black_captured)):
+        for kind in _unpack_captured(data):
+            cp = owner.new_piece(p.PIECE_CLASSES[kind], None, game.board)
+            cp.set_moved()
+            owner.add_piece(cp)
+            captured.append(cp)
+    return game
+
+
+def decode(data, game=None, backend='list'):
+    """Returns a game set up from a SIZE byte state, reusing game if one is given"""
+    if len(data) != SIZE:
+        raise ValueError('Invalid game state: expected {} bytes, got {}'.format(SIZE, len(data)))
+    if game is None:
+        import chessgame as cg
+        game = cg.ChessGame(backend)
+    return unpack_from(data, 0, game)
+
+
+def encode_batch(games):
+    """Returns the states of a list of games packed one after another in a single bytearray"""
+    buffer = bytearray(SIZE * len(games))
+    for i, game in enumerate(games):
+        pack_into(buffer, i * SIZE, game)
+    return buffer
+
+
+def decode_batch(buffer, game):
+    """Generator that sets game up from each state in a buffer made by encode_batch and yields it
+    The same game object is yielded every time, so use each position before asking for the next one.
+    """
+    if len(buffer) % SIZE:
+        raise ValueError('Invalid batch: {} bytes is not a whole number of states'.format(len(buffer)))
+    for offset in range(0, len(buffer), SIZE):
+        yield unpack_from(buffer, offset, game)
+
+
+if __name__ == '__main__':
+    import pickle
+    import random
+    import time
+
+    import chessgame as cg
+    from membench import play_random
+
+    parser = argparse.ArgumentParser(description='Compare the binary game states with pickle.')
+    parser.add_argument('--games', type=int, default=1000, help='games to encode (default: 1000)')
+    parser.add_argument('--plies', type=int, default=40, help='random moves played in each game (default: 40)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    games = []
+    for _ in range(args.games):
+        game = cg.ChessGame()
+        game.new_game()
+        play_random(game, args.plies, rng)
+        games.append(game)
+
+    def timed(fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - start
+
+    rows = []
+    pickled, seconds = timed(lambda: [pickle.dumps(game, pickle.HIGHEST_PROTOCOL) for game in games])
+    _, load_seconds = timed(lambda: [pickle.loads(data) for data in pickled])
+    rows.append(('pickle', sum(map(len, pickled)), seconds, load_seconds))
+    states, seconds = timed(lambda: [encode(game) for game in games])
+    target = cg.ChessGame()
+    _, load_seconds = timed(lambda: [decode(data, target) for data in states])
+    rows.append(('to_bytes', sum(map(len, states)), seconds, load_seconds))
+    buffer, seconds = timed(lambda: encode_batch(games))
+    _, load_seconds = timed(lambda: sum(1 for _ in decode_batch(buffer, target)))
+    rows.append(('batch', len(buffer), seconds, load_seconds))
+
+    # Check every game comes back the same
+    for game, data in zip(games, states):
+        if decode(data, target).to_fen() != game.to_fen() or encode(target) != data:
+            raise SystemExit('state did not round trip: {}'.format(game.to_fen()))
+
+    for name, size, dump, load in rows:
+        print('{:>8}  {:7.0f} bytes/game  {:9.0f} games/s encode  {:9.0f} games/s decode'.format(
+            name, size / args.games, args.games / dump, args.games / load))
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Search engine for the Chess Package
+
+Picks a move for a Player in a ChessGame with a negamax alpha-beta search.  The search deepens one ply at a time
+until it runs out of depth or time, finishes each line with a quiescence search over captures, and orders moves by
+the transposition table move, MVV-LVA for captures, killer moves and the history heuristic.
+
+Usage:
+    python engine.py --depth 4
+    python engine.py --time 2.5
+"""
+
+import argparse
+import collections
+import time
+
+import evaluation as ev
+import pieces as p
+import transposition as tt
+
+# Piece values in centipawns indexed by Piece.kind, used to order captures
+PIECE_VALUES = (100, 320, 330, 500, 900, 0)
+MATE = 100000
+INFINITY = MATE + 1
+# Scores beyond this are mate in some number of plies
+MATE_BOUND = MATE - 1000
+MAX_PLY = 128
+
+SearchResult = collections.namedtuple('SearchResult', 'move score depth nodes seconds nps pv')
+SearchResult.__doc__ = """Result of Engine.search
+move -- best move found as a (start_pos, end_pos, promotion) tuple, None if there are no legal moves
+score -- score of the move in centipawns for the searching player, MATE - n for mate in n plies
+depth -- depth of the last completed iteration
+nodes -- positions searched, including the quiescence search
+seconds -- time the search took
+nps -- nodes per second
+pv -- principal variation, the list of moves the search expects to be played
+"""
+
+
+def _captured_kind(game, move):
+    """Returns the kind of piece a move captures, or None"""
+    start_pos, end_pos, promotion = move
+    target = game.board[end_pos[0]][end_pos[1]]
+    if target is None:
+        return None
+    if target.kind is None:
+        # Only a pawn moving onto a ghost pawn captures, the pawn behind it
+        return p.PAWN if game.board[start_pos[0]][start_pos[1]].kind == p.PAWN else None
+    return target.kind
+
+
+class _SearchTimeout(Exception):
+    """Raised inside the search to unwind it when the time runs out"""
+
+
+class Engine:
+    """
+    Alpha-beta search engine, keeps its transposition table and history between searches.
+    Attributes:
+    tt -- TranspositionTable of search results
+    book -- optional book.OpeningBook, a position found in it is answered with a book move instead of a search
+    tablebases -- optional tablebase.Tablebases, a position with a table is answered from it instead of a search
+    nodes -- positions searched by the current or last search
+    _killers -- _killers[ply] holds the last two quiet moves that caused a beta cutoff at that ply
+    _history -- dict of move to a score of how often it caused a beta cutoff, weighted by depth
+    _pv -- triangular principal variation table, _pv[ply] is the best line found from ply
+    _deadline -- perf_counter time the search has to stop by, None for no limit
+    _can_stop -- False while the first iteration runs, it always finishes
+    _root_moves -- moves the root of the current search is restricted to, None for all legal moves
+    """
+    def __init__(self, tt_size=1 << 16, book=None, tablebases=None):
+        self.tt = tt.TranspositionTable(tt_size)
+        self.book = book
+        self.tablebases = tablebases
+        self.nodes = 0
+        self._killers = [[None, None] for _ in range(MAX_PLY)]
+        self._history = {}
+        self._pv = [[] for _ in range(MAX_PLY + 1)]
+        self._deadline = None
+        self._can_stop = False
+        self._root_moves = None
+
+    def search(self, game, player, max_depth=None, time_limit=None, root_moves=None):
+        """Searches for the best move for player and returns a SearchResult
+        Inputs:
+        game -- ChessGame to search, it is put back the way it was before returning
+        player -- Player to find a move for
+        max_depth -- deepest iteration to search in plies
+        time_limit -- seconds to search for, the last unfinished iteration is thrown away
+        root_moves -- optional list of legal moves to restrict the search to, used to split the root between
+            processes
+        Raises ValueError if max_depth is less than 1.
+        """
+        if max_depth is None:
+            max_depth = 4 if time_limit is None else MAX_PLY - 1
+        elif max_depth < 1:
+            raise ValueError('max_depth must be at least 1, got {}'.format(max_depth))
+        start = time.perf_counter()
+        if self.book is not None and root_moves is None:
+            move = self.book.choose(game, player)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0, time.perf_counter() - start, 0, [move])
+        if self.tablebases is not None and root_moves is None:
+            found = self.tablebases.best_move(game, player)
+            if found is not None and found[0] is not None:
+                move, res = found
+                score = res.wdl * (MATE - res.plies) if res.wdl else 0
+                return SearchResult(move, score, 0, 0, time.perf_counter() - start, 0, [move])
+        self._deadline = None if time_limit is None else start + time_limit
+        self.nodes = 0
+        self.tt.new_search()
+        self._killers = [[None, None] for _ in range(MAX_PLY)]
+        self._history = {}
+        self._root_moves = root_moves
+
+        previous_to_move = game.to_move
+        game.set_to_move(player)
+        result = None
+        try:
+            for depth in range(1, max_depth + 1):
+                # The first iteration always finishes so there is a move to play
+                self._can_stop = result is not None
+                try:
+                    score = self._negamax(game, player, depth, -INFINITY, INFINITY, 0)
+                except _SearchTimeout:
+                    break
+                seconds = time.perf_counter() - start
+                pv = list(self._pv[0])
+                result = SearchResult(pv[0] if pv else None, score, depth, self.nodes, seconds,
+                                      int(self.nodes / seconds) if seconds else 0, pv)
+                # Stop on a forced mate, or if the next iteration can't finish in time
+                if not pv or abs(score) >= MATE_BOUND:
+                    break
+                if self._deadline is not None and time.perf_counter() + seconds > self._deadline:
+                    break
+        finally:
+            game.set_to_move(previous_to_move)
+        return result
+
+    def _check_time(self):
+        if self._can_stop and self._deadline is not None and time.perf_counter() > self._deadline:
+            raise _SearchTimeout()
+
+    def _negamax(self, game, player, depth, alpha, beta, ply):
+        """Returns the score of the position for player searched depth plies deep"""
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self._check_time()
+        self._pv[ply] = []
+        if ply and game.repetition_count():
+            return 0
+
+        in_check = player.is_checked()
+        if depth <= 0 and not in_check:
+            return self._quiesce(game, player, alpha, beta, ply)
+
+        # Use a stored result if it was searched at least as deep
+        key = game.hash
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, bound, tt_move = entry
+            if ply and entry_depth >= depth:
+                entry_score = _score_from_tt(entry_score, ply)
+                if (bound == tt.EXACT or (bound == tt.LOWER and entry_score >= beta)
+                        or (bound == tt.UPPER and entry_score <= alpha)):
+                    return entry_score
+
+        if ply == 0 and self._root_moves is not None:
+            moves = list(self._root_moves)
+        else:
+            moves = list(game.legal_moves(player))
+        if not moves:
+            return -MATE + ply if in_check else 0
+        self._order_moves(game, moves, tt_move, ply)
+
+        opponent = player.get_opponent()
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            game.make_move(player, *move)
+            try:
+                score = -self._negamax(game, opponent, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                game.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self._pv[ply] = [move] + self._pv[ply + 1]
+                    if alpha >= beta:
+                        if _captured_kind(game, move) is None and move[2] is None:
+                            self._store_killer(move, ply)
+                            self._history[move] = self._history.get(move, 0) + depth * depth
+                        break
+
+        if best_score <= original_alpha:
+            bound = tt.UPPER
+        elif best_score >= beta:
+            bound = tt.LOWER
+        else:
+            bound = tt.EXACT
+        self.tt.store(key, depth, _score_to_tt(best_score, ply), bound, best_move)
+        return best_score
+
+    def _quiesce(self, game, player, alpha, beta, ply):
+        """Returns the score of the position for player after playing out the captures"""
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self._check_time()
+        stand_pat = ev.evaluate(game, player)
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        moves = [move for move in game.legal_moves(player)
+                 if move[2] is not None or _captured_kind(game, move) is not None]
+        self._order_moves(game, moves, None, ply)
+        opponent = player.get_opponent()
+        for move in moves:
+            game.make_move(player, *move)
+            try:
+                score = -self._quiesce(game, opponent, -beta, -alpha, ply + 1)
+            finally:
+                game.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _order_moves(self, game, moves, tt_move, ply):
+        """Sorts moves best first: the table move, captures by MVV-LVA, promotions, killers, then history"""
+        board = game.board
+        killers = self._killers[ply] if ply < MAX_PLY else (None, None)
+        history = self._history
+
+        def order(move):
+            if move == tt_move:
+                return 1 << 30
+            victim = _captured_kind(game, move)
+            if victim is not None:
+                # Most valuable victim first, least valuable attacker breaks ties
+                attacker = board[move[0][0]][move[0][1]].kind
+                return (1 << 24) + PIECE_VALUES[victim] * 16 - PIECE_VALUES[attacker] // 16
+            if move[2] is not None:
+                return (1 << 23) + PIECE_VALUES[move[2].kind]
+            if move == killers[0]:
+                return (1 << 22) + 1
+            if move == killers[1]:
+                return 1 << 22
+            return history.get(move, 0)
+
+        moves.sort(key=order, reverse=True)
+
+    def _store_killer(self, move, ply):
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+def _score_to_tt(score, ply):
+    """Mate scores are stored as distance from the stored position rather than from the root"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def format_move(move):
+    """Returns a move tuple in coordinate notation, e.g. 'e2e4' or 'a7a8q'"""
+    start_pos, end_pos, promotion = move
+    text = '{}{}{}{}'.format('abcdefgh'[start_pos[1]], start_pos[0] + 1, 'abcdefgh'[end_pos[1]], end_pos[0] + 1)
+    if promotion is not None:
+        text += 'pnbrqk'[promotion.kind]
+    return text
+
+
+def parse_move(text):
+    """Returns the (start_pos, end_pos, promotion) move tuple for a move in coordinate notation, see format_move
+    Raises ValueError if text isn't a move in coordinate notation.
+    """
+    text = text.strip().lower()
+    files = 'abcdefgh'
+    if (len(text) not in (4, 5) or text[0] not in files or text[2] not in files or text[1] not in '12345678'
+            or text[3] not in '12345678' or (len(text) == 5 and text[4] not in 'nbrq')):
+        raise ValueError('Not a move in coordinate notation: {!r}'.format(text))
+    promotion = p.PIECE_CLASSES['pnbrqk'.index(text[4])] if len(text) == 5 else None
+    return (int(text[1]) - 1, files.index(text[0])), (int(text[3]) - 1, files.index(text[2])), promotion
+
+
+def find_best_move(game, player, max_depth=None, time_limit=None, book=None, tablebases=None):
+    """Searches with a fresh Engine and returns the best move for player, see Engine.search"""
+    return Engine(book=book, tablebases=tablebases).search(game, player, max_depth, time_limit).move
+
+
+if __name__ == '__main__':
+    import chessgame as cg
+
+    parser = argparse.ArgumentParser(description='Search the starting position and print the result.')
+    parser.add_argument('--depth', type=int, help='deepest iteration in plies (default: 4 without --time)')
+    parser.add_argument('--time', type=float, help='time limit in seconds')
+    parser.add_argument('--book', help='opening book to play from before searching, see book.py')
+    args = parser.parse_args()
+
+    game = cg.ChessGame()
+    game.new_game()
+    opening_book = None
+    if args.book:
+        import book as bk
+        opening_book = bk.OpeningBook(args.book)
+    res = Engine(book=opening_book).search(game, game.playerWhite, args.depth, args.time)
+    print('depth {}  score {}  nodes {}  {:.2f}s  {} nps'.format(res.depth, res.score, res.nodes, res.seconds,
+                                                                res.nps))
+    print('pv ' + ' '.join(format_move(move) for move in res.pv))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Static evaluation for the Chess Package
+
+A position is scored by material and piece-square tables, with separate middlegame and endgame values tapered by
+how much material is left.  Each piece on a square is worth a fixed packed score (middlegame value, endgame value
+and game phase weight in one integer, see pack), so ChessGame keeps the total of the pieces on the board as it
+changes, adding and subtracting the scores in _place, _place_all and _lift the same way it keeps its Zobrist hash.
+Evaluating a position is then a few arithmetic operations instead of a walk over the board.
+
+evaluate_batch scores many boards at once with NumPy, in the encoding batch.py uses.
+
+Usage:
+    python evaluation.py --games 200 --plies 40
+"""
+
+import argparse
+
+# Material values in centipawns indexed by Piece.kind
+MIDDLEGAME_VALUES = (82, 337, 365, 477, 1025, 0)
+ENDGAME_VALUES = (94, 281, 297, 512, 936, 0)
+# How much each kind of piece counts towards the middlegame, the starting position adds up to MAX_PHASE
+PHASE_WEIGHTS = (0, 1, 1, 2, 4, 0)
+MAX_PHASE = 24
+
+# Piece-square tables from White's point of view, written as the board is seen from White's side: the first row of
+# each table is row 7 of ChessGame.board and the last is row 0.  Black uses the same tables turned over.
+_PAWN_MG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+)
+_PAWN_EG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    20, 20, 20, 20, 20, 20, 20, 20,
+    10, 10, 10, 10, 10, 10, 10, 10,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+)
+_KNIGHT = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+_BISHOP = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+_ROOK_MG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+)
+_ROOK_EG = (
+    5, 5, 5, 5, 5, 5, 5, 5,
+    10, 10, 10, 10, 10, 10, 10, 10,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+)
+_QUEEN = (
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+)
+_KING_MG = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+)
+_KING_EG = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+# (middlegame, endgame) tables indexed by Piece.kind
+TABLES = ((_PAWN_MG, _PAWN_EG), (_KNIGHT, _KNIGHT), (_BISHOP, _BISHOP), (_ROOK_MG, _ROOK_EG), (_QUEEN, _QUEEN),
+          (_KING_MG, _KING_EG))
+
+# Bits each part of a packed score is shifted by, the middlegame and endgame parts are signed
+_SHIFT = 20
+_HALF = 1 << (_SHIFT - 1)
+_MASK = (1 << _SHIFT) - 1
+
+
+def pack(mg, eg, phase):
+    """Packs a middlegame score, an endgame score and a phase weight into one integer
+    Packed scores add and subtract like plain numbers, so a running total of them stays a valid packed score.
+    """
+    return mg + (eg << _SHIFT) + (phase << (2 * _SHIFT))
+
+
+def unpack(score):
+    """Returns the (mg, eg, phase) a packed score holds"""
+    mg = ((score + _HALF) & _MASK) - _HALF
+    score = (score - mg) >> _SHIFT
+    eg = ((score + _HALF) & _MASK) - _HALF
+    return mg, eg, (score - eg) >> _SHIFT
+
+
+def _square_scores():
+    """Builds SQUARE_SCORES, Black's scores are negative and read from the tables turned over"""
+    scores = [[[0] * 64 for _ in range(6)] for _ in range(2)]
+    for kind, (mg_table, eg_table) in enumerate(TABLES):
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            white = (7 - r) * 8 + c
+            black = r * 8 + c
+            scores[0][kind][sq] = pack(MIDDLEGAME_VALUES[kind] + mg_table[white],
+                                       ENDGAME_VALUES[kind] + eg_table[white], PHASE_WEIGHTS[kind])
+            # The phase counts the material of both players so it isn't negated
+            scores[1][kind][sq] = pack(-MIDDLEGAME_VALUES[kind] - mg_table[black],
+                                       -ENDGAME_VALUES[kind] - eg_table[black], PHASE_WEIGHTS[kind])
+    return scores
+
+
+# SQUARE_SCORES[color][kind][square] is the packed score of a piece on that square, color 0 is White and 1 is
+# Black, square is row * 8 + col
+SQUARE_SCORES = _square_scores()
+
+
+def piece_score(piece, pos):
+    """Returns the packed score for piece standing on pos, a ghost pawn scores 0"""
+    if piece.kind is None:
+        return 0
+    return SQUARE_SCORES[0 if piece.get_player().isWhite else 1][piece.kind][pos[0] * 8 + pos[1]]
+
+
+def taper(score):
+    """Returns the centipawn score from White's point of view for a packed score, blending the middlegame and
+    endgame parts by the phase
+    """
+    mg, eg, phase = unpack(score)
+    # Promotions can push the phase past the starting material
+    if phase > MAX_PHASE:
+        phase = MAX_PHASE
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+def evaluate(game, player):
+    """Returns the static score of the position in centipawns from player's point of view"""
+    score = taper(game.score)
+    return score if player.isWhite else -score
+
+
+def compute_score(game):
+    """Computes the packed score of a game's position from scratch, ChessGame.score should always be equal to this"""
+    score = 0
+    for r, row in enumerate(game.board):
+        for c, cp in enumerate(row):
+            if cp is not None:
+                score += piece_score(cp, (r, c))
+    return score
+
+
+# NumPy tables for evaluate_batch, built the first time it is called
+_batch_tables = None
+
+
+def evaluate_batch(boards, white_to_move=None):
+    """Scores many positions at once and returns an int array of centipawn scores
+    Inputs:
+    boards -- (N, 64) int8 array of boards in batch.py's encoding, 0 for empty, Piece.kind + 1 for White pieces and
+        the negative of that for Black pieces
+    white_to_move -- optional (N,) bool array, the scores are from the side to move's point of view when given and
+        from White's otherwise
+    """
+    import numpy as np
+
+    global _batch_tables
+    if _batch_tables is None:
+        # Rows indexed by code + 6, so code -6 (a Black King) is row 0 and code 0 (empty) scores nothing
+        mg, eg, phase = (np.zeros((13, 64), np.int32) for _ in range(3))
+        for color, sign in ((0, 1), (1, -1)):
+            for kind in range(6):
+                for sq in range(64):
+                    mg[sign * (kind + 1) + 6, sq], eg[sign * (kind + 1) + 6, sq], phase[sign * (kind + 1) + 6, sq] = \
+                        unpack(SQUARE_SCORES[color][kind][sq])
+        _batch_tables = mg, eg, phase
+
+    mg_table, eg_table, phase_table = _batch_tables
+    codes = np.asarray(boards).astype(np.intp) + 6
+    squares = np.arange(64)
+    mg = mg_table[codes, squares].sum(axis=1)
+    eg = eg_table[codes, squares].sum(axis=1)
+    phase = np.minimum(phase_table[codes, squares].sum(axis=1), MAX_PHASE)
+    scores = (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+    if white_to_move is not None:
+        scores = np.where(white_to_move, scores, -scores)
+    return scores
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    import numpy as np
+
+    import batch
+    import chessgame as cg
+    from membench import play_random
+
+    parser = argparse.ArgumentParser(description='Time the incremental, from scratch and batch evaluations.')
+    parser.add_argument('--games', type=int, default=200, help='positions to evaluate (default: 200)')
+    parser.add_argument('--plies', type=int, default=40, help='random moves played to reach each one (default: 40)')
+    parser.add_argument('--repeat', type=int, default=50, help='times each position is evaluated (default: 50)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    games = []
+    for _ in range(args.games):
+        game = cg.ChessGame()
+        game.new_game()
+        play_random(game, args.plies, rng)
+        games.append(game)
+    for game in games:
+        if game.score != compute_score(game):
+            raise SystemExit('running score out of sync: {}'.format(game.to_fen()))
+
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for game in games:
+            evaluate(game, game.to_move)
+    timings['incremental'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for game in games:
+            taper(compute_score(game))
+    timings['from scratch'] = time.perf_counter() - start
+    boards = np.stack([batch.encode(game) for game in games])
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        scores = evaluate_batch(boards)
+    timings['batch'] = time.perf_counter() - start
+    if list(scores) != [taper(game.score) for game in games]:
+        raise SystemExit('batch scores differ from the incremental ones')
+
+    count = args.games * args.repeat
+    for name, seconds in timings.items():
+        print('{:>12}  {:10.0f} positions/s'.format(name, count / seconds))
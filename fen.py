@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""FEN (Forsyth-Edwards Notation) support for the Chess Package
+
+Converts between FEN strings and the placements ChessGame.setup_position takes, and streams files of FEN strings
+(or EPD lines, only the first four fields are required) into a reused ChessGame so millions of positions can be
+loaded without replaying moves or building a new game for each one.
+
+Usage:
+    python fen.py positions.fen
+    python fen.py positions.fen --check
+"""
+
+import argparse
+import time
+
+import pieces as p
+import zobrist as zb
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+_PIECES = {cls.letter: cls for cls in p.PIECE_CLASSES}
+_PIECES.update({cls.letter.lower(): cls for cls in p.PIECE_CLASSES})
+_FILES = 'abcdefgh'
+
+
+def parse(fen):
+    """Parses a FEN string and returns (placements, white_to_move, ghost_pos, halfmove, fullmove)
+    placements is a list of (Piece class, is_white, pos, has_moved) tuples for ChessGame.setup_position.  A FEN only
+    has castling rights, so a King and a corner Rook on their starting squares with a right between them are unmoved,
+    pawns on their starting row are unmoved and every other piece counts as moved.  The move counters default to 0
+    and 1 when they are missing.
+    Raises ValueError for a string that isn't a valid FEN.
+    """
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError('Invalid FEN {!r}: expected at least 4 fields'.format(fen))
+    placement, side, castling, en_passant = fields[:4]
+    ranks = placement.split('/')
+    if len(ranks) != 8 or side not in ('w', 'b'):
+        raise ValueError('Invalid FEN {!r}: bad piece placement or side to move'.format(fen))
+
+    placements = []
+    kings = [0, 0]
+    for i, rank in enumerate(ranks):
+        row, col = 7 - i, 0
+        for ch in rank:
+            if ch.isdigit():
+                col += int(ch)
+                continue
+            piece_class = _PIECES.get(ch)
+            if piece_class is None or col > 7:
+                raise ValueError('Invalid FEN {!r}: bad rank {!r}'.format(fen, rank))
+            is_white = ch.isupper()
+            if piece_class is p.Pawn:
+                if row in (0, 7):
+                    raise ValueError('Invalid FEN {!r}: pawn on the first or last rank'.format(fen))
+                moved = row != (1 if is_white else 6)
+            else:
+                # Kings and Rooks keeping a castling right are marked unmoved below
+                moved = True
+                if piece_class is p.King:
+                    kings[not is_white] += 1
+            placements.append((piece_class, is_white, (row, col), moved))
+            col += 1
+        if col != 8:
+            raise ValueError('Invalid FEN {!r}: rank {!r} is not 8 squares'.format(fen, rank))
+    if kings != [1, 1]:
+        raise ValueError('Invalid FEN {!r}: each side needs exactly one King'.format(fen))
+
+    # A castling right only counts while the King and that Rook are still on their starting squares
+    squares = {(pos, is_white): piece_class for piece_class, is_white, pos, moved in placements}
+    unmoved = set()
+    for flag in castling:
+        if flag not in 'KQkq':
+            continue
+        row = 0 if flag.isupper() else 7
+        rook_pos = (row, 7 if flag in 'Kk' else 0)
+        if squares.get(((row, 4), flag.isupper())) is p.King and squares.get((rook_pos, flag.isupper())) is p.Rook:
+            unmoved.update(((row, 4), rook_pos))
+    if unmoved:
+        placements = [(piece_class, is_white, pos, moved and pos not in unmoved)
+                      for piece_class, is_white, pos, moved in placements]
+    try:
+        check_position(placements, side == 'w')
+    except ValueError as err:
+        raise ValueError('Invalid FEN {!r}: {}'.format(fen, err))
+
+    ghost_pos = None
+    if en_passant != '-':
+        # The ghost pawn sits behind a pawn of the side that just moved
+        ghost_row = 5 if side == 'w' else 2
+        if len(en_passant) != 2 or en_passant[0] not in _FILES or en_passant[1] != str(ghost_row + 1):
+            raise ValueError('Invalid FEN {!r}: bad En Passant square {!r}'.format(fen, en_passant))
+        # ChessGame.setup_position checks the pawn that was pushed past it
+        ghost_pos = (ghost_row, _FILES.index(en_passant[0]))
+
+    halfmove = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+    fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+    return placements, side == 'w', ghost_pos, halfmove, fullmove
+
+
+def _is_attacked(pieces, pos, by_white):
+    """Returns True if a piece of by_white in pieces, a dict of pos to (Piece class, is_white), attacks pos"""
+    r, c = pos
+    # A White pawn attacks from the row below, a Black one from the row above
+    pawn_row = r - 1 if by_white else r + 1
+    for steps, attackers in ((((pawn_row, c - 1), (pawn_row, c + 1)), (p.Pawn,)),
+                             ([(r + dr, c + dc) for dr, dc in p.KNIGHT_OFFSETS], (p.Knight,)),
+                             ([(r + dr, c + dc) for dr, dc in p.KING_OFFSETS], (p.King,))):
+        for square in steps:
+            piece = pieces.get(square)
+            if piece is not None and piece[1] == by_white and piece[0] in attackers:
+                return True
+    for directions, attackers in ((p.ROOK_DIRECTIONS, (p.Rook, p.Queen)), (p.BISHOP_DIRECTIONS, (p.Bishop, p.Queen))):
+        for dr, dc in directions:
+            x, y = r + dr, c + dc
+            while 0 <= x < 8 and 0 <= y < 8:
+                piece = pieces.get((x, y))
+                if piece is not None:
+                    if piece[1] == by_white and piece[0] in attackers:
+                        return True
+                    break
+                x, y = x + dr, y + dc
+    return False
+
+
+def check_position(placements, white_to_move):
+    """Checks that a position with one King for each player could come up in a game
+    Raises ValueError if the Kings are next to each other or the player who just moved has been left in check, a
+    position the move rules can't handle since the King could be taken.
+    Inputs:
+    placements -- list of (Piece class, is_white, pos, has_moved) tuples, see parse
+    white_to_move -- True if White is to move
+    """
+    pieces = {pos: (piece_class, is_white) for piece_class, is_white, pos, moved in placements}
+    kings = {is_white: pos for piece_class, is_white, pos, moved in placements if piece_class is p.King}
+    (wr, wc), (br, bc) = kings[True], kings[False]
+    if abs(wr - br) <= 1 and abs(wc - bc) <= 1:
+        raise ValueError('the Kings are next to each other')
+    if _is_attacked(pieces, kings[not white_to_move], white_to_move):
+        raise ValueError('the player not to move is in check')
+
+
+def to_fen(game):
+    """Returns the FEN string of a ChessGame's position"""
+    ranks = []
+    for row in game.board[::-1]:
+        rank = ''
+        empty = 0
+        for cp in row:
+            if cp is None or cp.kind is None:
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += cp.letter if cp.get_player().isWhite else cp.letter.lower()
+        ranks.append(rank + str(empty) if empty else rank)
+
+    rights = zb.castling_rights(game.board)
+    castling = ''.join(flag for bit, flag in ((zb.WHITE_RIGHT, 'K'), (zb.WHITE_LEFT, 'Q'), (zb.BLACK_RIGHT, 'k'),
+                                              (zb.BLACK_LEFT, 'q')) if rights & bit) or '-'
+    ghost = game.to_move.get_opponent().ghost_pawn
+    en_passant = '-' if ghost is None else _FILES[ghost.get_col()] + str(ghost.get_row() + 1)
+    return '{} {} {} {} {} {}'.format('/'.join(ranks), 'w' if game.to_move.isWhite else 'b', castling, en_passant,
+                                      game.halfmove_clock(), game.fullmove_number())
+
+
+def read_fens(lines):
+    """Generator that yields the FEN strings from an iterable of lines, skipping blank lines and # comments"""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def load_all(lines, game):
+    """Generator that sets game up from each FEN in lines and yields it
+    The same game object is yielded every time, so use each position before asking for the next one.
+    Inputs:
+    lines -- iterable of FEN strings, such as an open file
+    game -- ChessGame to load the positions into
+    """
+    for fen in read_fens(lines):
+        game.set_fen(fen)
+        yield game
+
+
+if __name__ == '__main__':
+    import chessgame as cg
+
+    parser = argparse.ArgumentParser(description='Load every position in a file of FEN strings.')
+    parser.add_argument('path', help='file with one FEN string per line')
+    parser.add_argument('--backend', choices=cg.BACKENDS, default='list', help='board representation to use')
+    parser.add_argument('--check', action='store_true', help="check each position's FEN comes back unchanged")
+    args = parser.parse_args()
+
+    game = cg.ChessGame(args.backend)
+    count = 0
+    mismatches = 0
+    start = time.perf_counter()
+    with open(args.path) as f:
+        for fen in read_fens(f):
+            game.set_fen(fen)
+            count += 1
+            # Compare as many fields as the file gave
+            fields = fen.split()[:6]
+            if args.check and game.to_fen().split()[:len(fields)] != fields:
+                mismatches += 1
+                print('mismatch: {} -> {}'.format(fen, game.to_fen()))
+    seconds = time.perf_counter() - start
+    print('{} positions  {:.3f}s  {} positions/s'.format(count, seconds, int(count / seconds) if seconds else 0))
+    if mismatches:
+        raise SystemExit(1)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Instrumentation for the Chess Package
+
+Counts calls and records latency histograms for ChessGame.move, split by the kind of piece and by the reason of any
+MoveError raised, for the move checks it runs, ChessGame.is_legal and the move_status of each piece class or of the
+BitBoard, split by the kind of piece and the status code returned, and for Player.check_for_check, along with the
+nodes per second of Engine.search.  enable() swaps timing wrappers in for those methods on their classes and
+disable() puts the originals back, so while instrumentation is off the game runs its own methods untouched and pays
+nothing for it.
+
+The collected Metrics export as a dict, JSON or Prometheus text, and profile() runs a block of code under cProfile
+and writes out the functions that took the most time.
+
+Usage:
+    python instrumentation.py --games 20 --plies 60 --prometheus
+    python instrumentation.py --profile --depth 3
+"""
+
+import argparse
+import bisect
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import pstats
+import sys
+import time
+
+import bitboard as bb
+import chessgame as cg
+import engine as en
+import pieces as p
+import player as pl
+
+# Label of each pieces move status code, e.g. STATUS_NAMES[pieces.BLOCKED] is 'blocked'
+STATUS_NAMES = ('legal', 'start_off_board', 'no_piece', 'opponents_piece', 'end_off_board', 'not_moving',
+                'own_capture', 'no_valid_moves', 'invalid_move', 'blocked', 'moving_into_check',
+                'leaves_king_in_check')
+# Upper bounds of the latency histogram buckets in seconds, the last bucket takes everything slower
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2, 1e-1, 1.0)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets.
+    Attributes:
+    counts -- counts[i] is the number of observations no slower than BUCKETS[i], the last one counts the rest
+    total -- sum of the observed seconds
+    count -- number of observations
+    """
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def as_dict(self):
+        """Returns the histogram as a dict with cumulative bucket counts, like Prometheus reports them"""
+        cumulative = []
+        running = 0
+        for n in self.counts:
+            running += n
+            cumulative.append(running)
+        return {'count': self.count, 'sum': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], cumulative))}
+
+
+class Metrics:
+    """
+    Everything the instrumentation records.
+    Attributes:
+    histograms -- dict of (metric name, labels) to a Histogram, labels is a tuple of (label, value) pairs
+    counters -- dict of (metric name, labels) to a number
+    gauges -- dict of (metric name, labels) to the last value set
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, labels, seconds):
+        """Adds an observation to the histogram for name and labels, creating it the first time"""
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        self.gauges[name, labels] = value
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.gauges.clear()
+
+    def snapshot(self):
+        """Returns the metrics as a dict of plain values that json can dump"""
+        def entries(metrics, convert):
+            return [{'name': name, 'labels': dict(labels), 'value': convert(value)}
+                    for (name, labels), value in sorted(metrics.items(), key=lambda item: item[0])]
+
+        return {'counters': entries(self.counters, lambda value: value),
+                'gauges': entries(self.gauges, lambda value: value),
+                'histograms': entries(self.histograms, Histogram.as_dict)}
+
+    def to_json(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = []
+        for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted({name for name, labels in metrics}):
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for (metric, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+                    if metric == name:
+                        lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+        for name in sorted({name for name, labels in self.histograms}):
+            lines.append('# TYPE {} histogram'.format(name))
+            for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                for bound, count in histogram.as_dict()['buckets'].items():
+                    lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', bound),)), count))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), histogram.total))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for label, value in labels) + '}'
+
+
+def _piece_label(piece):
+    return piece.letter if piece is not None and piece.letter is not None else 'none'
+
+
+def _wrap_move(method, metrics):
+    @functools.wraps(method)
+    def move(self, moving_player, start_pos, end_pos, promotion=None):
+        r, c = start_pos
+        piece = self.board[r][c] if 0 <= r < 8 and 0 <= c < 8 else None
+        start = time.perf_counter()
+        try:
+            method(self, moving_player, start_pos, end_pos, promotion)
+        except p.MoveError as err:
+            seconds = time.perf_counter() - start
+            metrics.observe('chess_move_seconds', (('piece', _piece_label(piece)), ('result', 'error')), seconds)
+            metrics.observe('chess_move_error_seconds', (('reason', err.message),), seconds)
+            metrics.inc('chess_move_errors_total', (('reason', err.message),))
+            raise
+        metrics.observe('chess_move_seconds', (('piece', _piece_label(piece)), ('result', 'ok')),
+                        time.perf_counter() - start)
+    return move
+
+
+def _wrap_is_legal(method, metrics):
+    @functools.wraps(method)
+    def is_legal(self, moving_player, start_pos, end_pos):
+        start = time.perf_counter()
+        status = method(self, moving_player, start_pos, end_pos)
+        seconds = time.perf_counter() - start
+        r, c = start_pos
+        piece = self.board[r][c] if 0 <= r < 8 and 0 <= c < 8 else None
+        metrics.observe('chess_is_legal_seconds', (('piece', _piece_label(piece)), ('status', STATUS_NAMES[status])),
+                        seconds)
+        return status
+    return is_legal
+
+
+def _wrap_piece_move_status(method, metrics):
+    @functools.wraps(method)
+    def move_status(self, end_pos):
+        start = time.perf_counter()
+        status = method(self, end_pos)
+        metrics.observe('chess_move_status_seconds', (('backend', 'list'), ('piece', self.letter),
+                                                      ('status', STATUS_NAMES[status])), time.perf_counter() - start)
+        return status
+    return move_status
+
+
+def _wrap_bitboard_move_status(method, metrics):
+    @functools.wraps(method)
+    def move_status(self, color, kind, start, end):
+        started = time.perf_counter()
+        status = method(self, color, kind, start, end)
+        metrics.observe('chess_move_status_seconds', (('backend', 'bitboard'), ('piece', p.PIECE_CLASSES[kind].letter),
+                                                      ('status', STATUS_NAMES[status])), time.perf_counter() - started)
+        return status
+    return move_status
+
+
+def _wrap_check_for_check(method, metrics):
+    @functools.wraps(method)
+    def check_for_check(self, king_pos=None):
+        start = time.perf_counter()
+        checked = method(self, king_pos)
+        metrics.observe('chess_check_for_check_seconds', (('player', 'white' if self.isWhite else 'black'),),
+                        time.perf_counter() - start)
+        return checked
+    return check_for_check
+
+
+def _wrap_search(method, metrics):
+    @functools.wraps(method)
+    def search(self, game, player, max_depth=None, time_limit=None, root_moves=None):
+        result = method(self, game, player, max_depth, time_limit, root_moves)
+        if result is not None:
+            metrics.inc('chess_search_total')
+            metrics.inc('chess_search_nodes_total', amount=result.nodes)
+            metrics.inc('chess_search_seconds_total', amount=result.seconds)
+            metrics.set('chess_search_nodes_per_second', (), result.nps)
+        return result
+    return search
+
+
+# (class, method name, wrapper factory) for every instrumented method
+_TARGETS = ((cg.ChessGame, 'move', _wrap_move), (cg.ChessGame, 'is_legal', _wrap_is_legal),
+            (bb.BitBoard, 'move_status', _wrap_bitboard_move_status),
+            (pl.Player, 'check_for_check', _wrap_check_for_check), (en.Engine, 'search', _wrap_search))
+# Every piece class checks its own moves, so each one's move_status is wrapped
+_TARGETS += tuple((cls, 'move_status', _wrap_piece_move_status) for cls in p.PIECE_CLASSES)
+# The original methods while instrumentation is on, and the Metrics they record into
+_originals = []
+_metrics = None
+
+
+def enable(metrics=None):
+    """Turns instrumentation on and returns the Metrics it records into, a new one unless metrics is given
+    Calling it again while it is on keeps the current Metrics.
+    """
+    global _metrics
+    if _originals:
+        return _metrics
+    _metrics = metrics if metrics is not None else Metrics()
+    for cls, name, wrap in _TARGETS:
+        method = cls.__dict__[name]
+        _originals.append((cls, name, method))
+        setattr(cls, name, wrap(method, _metrics))
+    return _metrics
+
+
+def disable():
+    """Turns instrumentation off and returns the Metrics it recorded, or None if it wasn't on"""
+    global _metrics
+    while _originals:
+        cls, name, method = _originals.pop()
+        setattr(cls, name, method)
+    metrics, _metrics = _metrics, None
+    return metrics
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+@contextlib.contextmanager
+def instrumented(metrics=None):
+    """Context manager that turns instrumentation on for a block and yields the Metrics"""
+    was_enabled = is_enabled()
+    metrics = enable(metrics)
+    try:
+        yield metrics
+    finally:
+        if not was_enabled:
+            disable()
+
+
+@contextlib.contextmanager
+def profile(out=None, top=20, sort='cumulative'):
+    """Context manager that runs a block under cProfile and writes the top functions when it ends
+    Inputs:
+    out -- file name or stream to write the report to, defaults to stderr.  A name ending in .prof gets the raw
+        profile instead, for loading into pstats or a viewer.
+    top -- number of functions to list
+    sort -- pstats sort key, such as 'cumulative' or 'tottime'
+    Yields the cProfile.Profile, so its stats can also be read after the block.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if isinstance(out, str) and out.endswith('.prof'):
+            profiler.dump_stats(out)
+        else:
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats(sort).print_stats(top)
+            if isinstance(out, str):
+                with open(out, 'w') as f:
+                    f.write(report.getvalue())
+            else:
+                (out or sys.stderr).write(report.getvalue())
+
+
+if __name__ == '__main__':
+    import random
+
+    parser = argparse.ArgumentParser(description='Play random games and a search with instrumentation on.')
+    parser.add_argument('--games', type=int, default=20, help='random games to play (default: 20)')
+    parser.add_argument('--plies', type=int, default=60, help='moves in each game (default: 60)')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the search at the end (default: 3)')
+    parser.add_argument('--prometheus', action='store_true', help='print Prometheus text instead of JSON')
+    parser.add_argument('--profile', action='store_true', help='also profile the run with cProfile')
+    args = parser.parse_args()
+
+    def run():
+        rng = random.Random(0)
+        game = cg.ChessGame()
+        for _ in range(args.games):
+            game.new_game()
+            player = game.to_move
+            for _ in range(args.plies):
+                moves = list(game.legal_moves(player))
+                if not moves:
+                    break
+                # Try a random move of a random piece first, so moves that break the rules show up too
+                piece = rng.choice([cp for cp in player.pieces if cp.get_pos() is not None])
+                try:
+                    game.move(player, piece.get_pos(), (rng.randrange(8), rng.randrange(8)))
+                except p.MoveError:
+                    game.move(player, *rng.choice(moves))
+                player = player.get_opponent()
+        game.new_game()
+        en.Engine().search(game, game.to_move, args.depth)
+
+    with instrumented() as metrics:
+        if args.profile:
+            with profile(top=15):
+                run()
+        else:
+            run()
+    print(metrics.to_prometheus() if args.prometheus else metrics.to_json(indent=2))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Multi-process search for the Chess Package
+
+The root moves are split between a pool of worker processes, each of which runs the normal Engine search over its
+share and keeps its own transposition table between searches.  Positions are sent to the workers as fixed size
+binary states (see codec.py) instead of pickled ChessGame object graphs.
+
+Usage:
+    python parallel.py --depth 4 --workers 4
+    python parallel.py --bench --depth 3
+"""
+
+import argparse
+import concurrent.futures
+import os
+import time
+
+import chessgame as cg
+import engine as eng
+
+
+def snapshot(game):
+    """Returns a compact, picklable snapshot of a game's position, its ChessGame.to_bytes() state"""
+    return game.to_bytes()
+
+
+def from_snapshot(snap, game=None):
+    """Sets up a game from a snapshot() state and returns it, reusing game if one is given"""
+    if game is None:
+        return cg.ChessGame.from_bytes(snap)
+    game.set_bytes(snap)
+    return game
+
+
+# Per process state of the workers, set up once by _init_worker
+_worker_engine = None
+_worker_game = None
+
+
+def _init_worker(tt_size):
+    global _worker_engine, _worker_game
+    _worker_engine = eng.Engine(tt_size)
+    _worker_game = cg.ChessGame()
+
+
+def _search_share(snap, root_moves, max_depth, time_limit):
+    """Runs in a worker: searches the snapshot position with the root restricted to root_moves"""
+    game = from_snapshot(snap, _worker_game)
+    return _worker_engine.search(game, game.to_move, max_depth, time_limit, root_moves)
+
+
+def search_move(snap, max_depth=None, time_limit=None):
+    """Runs in a worker of a worker_pool(): searches the snapshot position and returns the best move, None if there
+    isn't a legal one
+    """
+    game = from_snapshot(snap, _worker_game)
+    return _worker_engine.search(game, game.to_move, max_depth, time_limit).move
+
+
+def worker_pool(workers=None, tt_size=1 << 16):
+    """Returns a ProcessPoolExecutor whose workers each keep an Engine with a tt_size transposition table and a
+    ChessGame to load snapshots into, for running search_move and the shares of a ParallelSearch
+    """
+    return concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(tt_size,))
+
+
+class ParallelSearch:
+    """
+    Searches positions with a pool of worker processes, each taking a share of the root moves.
+    Use as a context manager or call close() to shut the pool down.
+    Attributes:
+    workers -- number of worker processes
+    _pool -- ProcessPoolExecutor running the workers
+    """
+    def __init__(self, workers=None, tt_size=1 << 16):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = worker_pool(self.workers, tt_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shuts down the worker processes"""
+        self._pool.shutdown()
+
+    def search(self, game, player, max_depth=None, time_limit=None):
+        """Searches for the best move for player and returns an engine.SearchResult
+        The arguments are the same as Engine.search.  nodes adds up the work done by every worker and depth is the
+        shallowest depth any worker completed.
+        """
+        start = time.perf_counter()
+        previous_to_move = game.to_move
+        game.set_to_move(player)
+        try:
+            snap = snapshot(game)
+            moves = list(game.legal_moves(player))
+        finally:
+            game.set_to_move(previous_to_move)
+        if not moves:
+            return eng.SearchResult(None, -eng.MATE if player.is_checked() else 0, 0, 0, 0.0, 0, [])
+
+        # Deal the moves out in turn, so each worker gets a mix of the promising and the unpromising ones
+        shares = [moves[i::self.workers] for i in range(min(self.workers, len(moves)))]
+        futures = [self._pool.submit(_search_share, snap, share, max_depth, time_limit) for share in shares]
+        results = [future.result() for future in futures]
+
+        best = max(results, key=lambda res: (res.score, res.depth))
+        nodes = sum(res.nodes for res in results)
+        seconds = time.perf_counter() - start
+        return eng.SearchResult(best.move, best.score, min(res.depth for res in results), nodes, seconds,
+                                int(nodes / seconds) if seconds else 0, best.pv)
+
+
+# Middle game positions for the benchmark, a single opening position splits poorly
+BENCH_POSITIONS = (
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq -',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+)
+
+
+def benchmark(max_workers, depth):
+    """Times the BENCH_POSITIONS searches with 1 to max_workers workers and returns a list of result dicts"""
+    import perft
+
+    games = [perft.load_position(fen) for fen in BENCH_POSITIONS]
+    results = []
+    base = None
+    for workers in range(1, max_workers + 1):
+        with ParallelSearch(workers) as search:
+            # Start the workers before timing
+            search.search(*games[0], max_depth=1)
+            start = time.perf_counter()
+            nodes = sum(search.search(game, player, max_depth=depth).nodes for game, player in games)
+            seconds = time.perf_counter() - start
+        base = base or seconds
+        results.append({'workers': workers, 'seconds': round(seconds, 3), 'nodes': nodes,
+                        'nps': int(nodes / seconds), 'speedup': round(base / seconds, 2)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search with a pool of worker processes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--depth', type=int, default=4, help='search depth in plies (default: 4)')
+    parser.add_argument('--time', type=float, help='time limit in seconds')
+    parser.add_argument('--bench', action='store_true', help='measure the speedup from 1 to --workers workers')
+    args = parser.parse_args()
+
+    if args.bench:
+        for row in benchmark(args.workers, args.depth):
+            print('{workers:>3} workers  {seconds:>8.3f}s  {nodes:>9} nodes  {nps:>8} nps  {speedup:.2f}x'
+                  .format(**row))
+    else:
+        a = cg.ChessGame()
+        a.new_game()
+        with ParallelSearch(args.workers) as search:
+            res = search.search(a, a.playerWhite, args.depth, args.time)
+        print('depth {}  score {}  nodes {}  {:.2f}s  {} nps'.format(res.depth, res.score, res.nodes, res.seconds,
+                                                                    res.nps))
+        print('pv ' + ' '.join(eng.format_move(move) for move in res.pv))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Perft (performance test) runner for the Chess Package
+
+Counts the leaf nodes of the legal move tree to a fixed depth and checks the totals against the published perft
+counts, which catches move generation bugs and gives a nodes/second figure to measure changes against.  The
+'bitboard' backend generates the moves and tests for check with bit operations (see bitboard.py) instead of
+walking the board list and keeping an AttackMap, so the two backends check and time different code.
+
+Usage:
+    python perft.py --depth 3
+    python perft.py --depth 2 --position kiwipete --backend bitboard --json
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import chessgame as cg
+
+# Published perft results, see https://www.chessprogramming.org/Perft_Results
+# name -- (FEN of the position or None for the ChessGame.new_game() setup, node counts for depth 1, 2, ...)
+POSITIONS = {
+    'start': (None, (20, 400, 8902, 197281, 4865609, 119060324)),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq -',
+                 (48, 2039, 97862, 4085603, 193690690)),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -', (14, 191, 2812, 43238, 674624, 11030083)),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  (6, 264, 9467, 422333, 15833292)),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', (44, 1486, 62379, 2103487, 89941194)),
+    'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                  (46, 2079, 89890, 3894594, 164075551)),
+}
+
+
+def load_position(fen, backend='list'):
+    """Builds a game from a FEN string and returns (game, player to move)
+    Inputs:
+    fen -- FEN string, or None for the new_game() setup
+    backend -- board backend passed to ChessGame
+    """
+    if fen is None:
+        game = cg.ChessGame(backend)
+        game.new_game()
+    else:
+        game = cg.ChessGame.from_fen(fen, backend)
+    return game, game.to_move
+
+
+def perft(game, player, depth):
+    """Returns the number of leaf nodes of the legal move tree depth moves deep, player moving first"""
+    if depth <= 0:
+        return 1
+    # Bulk count the last level, the moves themselves don't need to be played
+    if depth == 1:
+        return sum(1 for _ in game.legal_moves(player))
+    nodes = 0
+    opponent = player.get_opponent()
+    for move in game.legal_moves(player):
+        game.make_move(player, *move)
+        nodes += perft(game, opponent, depth - 1)
+        game.unmake_move()
+    return nodes
+
+
+def divide(game, player, depth):
+    """Returns a dict of the perft node count below each legal root move, useful for tracking down a bad count"""
+    counts = {}
+    for move in game.legal_moves(player):
+        game.make_move(player, *move)
+        counts[move] = perft(game, player.get_opponent(), depth - 1)
+        game.unmake_move()
+    return counts
+
+
+def run(names, depth, backend='list'):
+    """Runs perft for each named position in POSITIONS and returns a list of result dicts"""
+    results = []
+    for name in names:
+        fen, expected = POSITIONS[name]
+        game, player = load_position(fen, backend)
+        start = time.perf_counter()
+        nodes = perft(game, player, depth)
+        seconds = time.perf_counter() - start
+        target = expected[depth - 1] if depth <= len(expected) else None
+        results.append({
+            'position': name,
+            'backend': backend,
+            'depth': depth,
+            'nodes': nodes,
+            'expected': target,
+            'ok': None if target is None else nodes == target,
+            'seconds': round(seconds, 4),
+            'nps': round(nodes / seconds) if seconds else None,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count perft leaf nodes and check them against published results.')
+    parser.add_argument('--depth', type=int, default=3, help='search depth in plies (default: 3)')
+    parser.add_argument('--position', action='append', choices=sorted(POSITIONS),
+                        help='position to test, may be repeated (default: all)')
+    parser.add_argument('--backend', default='list', choices=cg.BACKENDS, help='ChessGame board backend')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.position or list(POSITIONS), args.depth, args.backend)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for res in results:
+            status = {True: 'ok', False: 'FAIL', None: 'unchecked'}[res['ok']]
+            print('{position:<10} depth {depth}  {nodes:>10} nodes  {seconds:>8.3f}s  {nps:>8} nps  '.format(**res)
+                  + status)
+    return 1 if any(res['ok'] is False for res in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
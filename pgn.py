@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""PGN (Portable Game Notation) reading and replay validation for the Chess Package
+
+Games are read lazily one at a time from a text or binary file, or a memory-mapped file, so memory stays flat however
+big the archive is.  Each game's SAN moves are turned into the (start_pos, end_pos, promotion) moves ChessGame.move
+takes and replayed through it, optionally spread over a pool of worker processes, reporting for every game whether it
+passed or the first move that was rejected.
+
+Usage:
+    python pgn.py games.pgn
+    python pgn.py games.pgn --workers 4 --mmap --json
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import re
+import time
+
+import chessgame as cg
+import pieces as p
+
+PgnGame = collections.namedtuple('PgnGame', 'index tags movetext')
+PgnGame.__doc__ = """One game read from a PGN file
+index -- position of the game in the file, counting from 0
+tags -- dict of the tag pairs, such as 'White' or 'FEN'
+movetext -- the move text, still holding comments, variations and move numbers
+"""
+
+ReplayResult = collections.namedtuple('ReplayResult', 'index ok plies move error')
+ReplayResult.__doc__ = """Result of replaying one game
+index -- position of the game in the file
+ok -- True if every move was accepted
+plies -- number of moves played before the game ended or a move was rejected
+move -- the rejected move with its move number, e.g. '12... Nf3', None if the game passed
+error -- why the move was rejected, None if the game passed
+"""
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# Comments, NAGs, variation brackets and everything else split on whitespace
+_TOKEN = re.compile(r'\{[^}]*\}?|;[^\n]*|\$\d+|[()]|[^\s(){};]+')
+_MOVE_NUMBER = re.compile(r'^\d+\.*')
+_SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h])([1-8])(?:=?([NBRQ]))?$')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+_FILES = 'abcdefgh'
+_PIECE_LETTERS = {cls.letter: cls for cls in p.PIECE_CLASSES}
+
+
+def iter_games(source):
+    """Generator that yields a PgnGame for each game in source, reading one line at a time
+    Inputs:
+    source -- anything with a readline method returning str or bytes, such as an open file or an mmap
+    """
+    index = 0
+    tags = {}
+    lines = []
+    depth = 0
+    while True:
+        line = source.readline()
+        if not line:
+            break
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        stripped = line.strip()
+        # A tag line outside a comment after some move text starts the next game
+        if stripped.startswith('[') and not depth:
+            if lines:
+                yield PgnGame(index, tags, '\n'.join(lines))
+                index += 1
+                tags = {}
+                lines = []
+            match = _TAG.match(stripped)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif stripped and not stripped.startswith('%'):
+            lines.append(stripped)
+            depth = max(depth + stripped.count('{') - stripped.count('}'), 0)
+    if lines or tags:
+        yield PgnGame(index, tags, '\n'.join(lines))
+
+
+def iter_san(movetext):
+    """Generator that yields the SAN moves of the main line, skipping comments, variations, NAGs, move numbers and
+    the result
+    """
+    depth = 0
+    for token in _TOKEN.findall(movetext):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth = max(depth - 1, 0)
+        elif depth or first in '{;$':
+            continue
+        elif token in RESULTS:
+            return
+        else:
+            token = _MOVE_NUMBER.sub('', token)
+            if token:
+                yield token
+
+
+def san_to_move(game, player, san):
+    """Returns the legal (start_pos, end_pos, promotion) move for player that a SAN move describes
+    Raises ValueError if no legal move matches it, or more than one does.
+    """
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        r, c = start_pos = player.get_king().get_pos()
+        end_pos = (r, c + 2) if len(text) == 3 else (r, c - 2)
+        status = game.is_legal(player, start_pos, end_pos)
+        if status != p.LEGAL:
+            raise ValueError(p.MOVE_ERRORS[status][1])
+        return start_pos, end_pos, None
+
+    match = _SAN.match(text)
+    if match is None:
+        raise ValueError('Not a SAN move')
+    letter, from_file, from_rank, to_file, to_rank, promoted = match.groups()
+    kind = _PIECE_LETTERS[letter].kind if letter else p.PAWN
+    end_pos = (int(to_rank) - 1, _FILES.index(to_file))
+    from_col = None if from_file is None else _FILES.index(from_file)
+    from_row = None if from_rank is None else int(from_rank) - 1
+
+    found = None
+    candidates = 0
+    status = p.INVALID_MOVE
+    for piece in player.pieces:
+        start_pos = piece.get_pos()
+        if (piece.kind != kind or start_pos is None or (from_col is not None and start_pos[1] != from_col)
+                or (from_row is not None and start_pos[0] != from_row)):
+            continue
+        piece_status = game.is_legal(player, start_pos, end_pos)
+        if piece_status == p.LEGAL:
+            if found is not None:
+                raise ValueError('Ambiguous move')
+            found = start_pos
+        else:
+            candidates += 1
+            status = piece_status
+    if found is None:
+        # With a single candidate piece its reason is the useful one
+        raise ValueError(p.MOVE_ERRORS[status][1] if candidates == 1 else 'No piece can make this move')
+
+    promotion = None
+    if kind == p.PAWN and end_pos[0] in (0, 7):
+        promotion = _PIECE_LETTERS[promoted] if promoted else p.PROMOTION_PIECES[0]
+    elif promoted:
+        raise ValueError('Only a pawn reaching the last row can be promoted')
+    return found, end_pos, promotion
+
+
+def move_to_san(game, player, move):
+    """Returns the SAN of a legal (start_pos, end_pos, promotion) move for player, e.g. 'Nbd7', 'exd6' or 'e8=Q+'"""
+    start_pos, end_pos, promotion = move
+    piece = game.board[start_pos[0]][start_pos[1]]
+    target = game.board[end_pos[0]][end_pos[1]]
+    square = _FILES[end_pos[1]] + str(end_pos[0] + 1)
+    if piece.kind == p.KING and abs(end_pos[1] - start_pos[1]) == 2:
+        san = 'O-O' if end_pos[1] > start_pos[1] else 'O-O-O'
+    elif piece.kind == p.PAWN:
+        san = square if start_pos[1] == end_pos[1] else _FILES[start_pos[1]] + 'x' + square
+        if promotion is not None:
+            san += '=' + promotion.letter
+    else:
+        # Name the file, the rank or both when another piece of the same kind can also move there
+        others = [cp.get_pos() for cp in player.pieces if cp is not piece and cp.kind == piece.kind
+                  and cp.get_pos() is not None and game.is_legal(player, cp.get_pos(), end_pos) == p.LEGAL]
+        prefix = ''
+        if others:
+            if all(pos[1] != start_pos[1] for pos in others):
+                prefix = _FILES[start_pos[1]]
+            elif all(pos[0] != start_pos[0] for pos in others):
+                prefix = str(start_pos[0] + 1)
+            else:
+                prefix = _FILES[start_pos[1]] + str(start_pos[0] + 1)
+        capture = 'x' if target is not None and target.kind is not None else ''
+        san = piece.letter + prefix + capture + square
+
+    game.make_move(player, *move)
+    opponent = player.get_opponent()
+    if opponent.is_checked():
+        san += '#' if not game.has_legal_move(opponent) else '+'
+    game.unmake_move()
+    return san
+
+
+def _describe(err):
+    """Returns the error of a game that raised something other than a ValueError or MoveError, e.g. 'KeyError: 3'"""
+    return '{}: {}'.format(type(err).__name__, err)
+
+
+def replay(game, pgn_game, check_marks=False):
+    """Replays a PgnGame through game.move and returns a ReplayResult
+    Inputs:
+    game -- ChessGame to replay the game in, it is set up from the FEN tag or as a new game
+    pgn_game -- PgnGame to replay
+    check_marks -- also reject a move marked with + or # that doesn't give check or checkmate, or the other way round.
+        Off by default since plenty of archives leave the marks out or get them wrong in otherwise legal games.
+    """
+    try:
+        if 'FEN' in pgn_game.tags:
+            game.set_fen(pgn_game.tags['FEN'])
+        else:
+            game.new_game()
+    except ValueError as err:
+        return ReplayResult(pgn_game.index, False, 0, None, str(err))
+    except Exception as err:
+        return ReplayResult(pgn_game.index, False, 0, None, _describe(err))
+
+    player = game.to_move
+    plies = 0
+    for san in iter_san(pgn_game.movetext):
+        label = '{}{} {}'.format(game.fullmove_number(), '.' if player.isWhite else '...', san)
+        try:
+            move = san_to_move(game, player, san)
+            game.move(player, *move)
+            player = player.get_opponent()
+            plies += 1
+            if check_marks:
+                mark = san.rstrip('!?')[-1]
+                checked = player.is_checked()
+                mated = checked and not game.has_legal_move(player)
+                if mated != (mark == '#') or (checked and not mated) != (mark == '+'):
+                    return ReplayResult(pgn_game.index, False, plies, label, 'Check or checkmate mark is wrong')
+        except ValueError as err:
+            return ReplayResult(pgn_game.index, False, plies, label, str(err))
+        except p.MoveError as err:
+            return ReplayResult(pgn_game.index, False, plies, label, err.message)
+        except Exception as err:
+            # Whatever went wrong is this game's error, the rest of the file is still validated
+            return ReplayResult(pgn_game.index, False, plies, label, _describe(err))
+    return ReplayResult(pgn_game.index, True, plies, None, None)
+
+
+# Per process state of the workers, set up once by _init_worker
+_worker_game = None
+
+
+def _init_worker():
+    global _worker_game
+    _worker_game = cg.ChessGame()
+
+
+def _replay_chunk(chunk, check_marks):
+    """Runs in a worker: replays a list of PgnGames and returns their ReplayResults"""
+    return [replay(_worker_game, pgn_game, check_marks) for pgn_game in chunk]
+
+
+def validate(source, workers=1, chunk_size=64, check_marks=False):
+    """Generator that replays every game in source and yields their ReplayResults in file order
+    Inputs:
+    source -- file or mmap to read the games from, see iter_games
+    workers -- number of worker processes, 1 replays the games in this process
+    chunk_size -- games sent to a worker at a time
+    check_marks -- see replay
+    """
+    games = iter_games(source)
+    if workers <= 1:
+        game = cg.ChessGame()
+        for pgn_game in games:
+            yield replay(game, pgn_game, check_marks)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        pending = collections.deque()
+        while True:
+            chunk = list(itertools.islice(games, chunk_size))
+            if chunk:
+                pending.append(pool.submit(_replay_chunk, chunk, check_marks))
+            # Only read ahead a couple of chunks per worker so memory stays flat however big the archive is
+            while pending and (len(pending) >= 2 * workers or not chunk):
+                yield from pending.popleft().result()
+            if not chunk:
+                break
+
+
+if __name__ == '__main__':
+    import json
+    import mmap
+    import os
+
+    parser = argparse.ArgumentParser(description='Replay every game in a PGN file and report the illegal ones.')
+    parser.add_argument('path', help='PGN file to validate')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=64, help='games sent to a worker at a time (default: 64)')
+    parser.add_argument('--mmap', action='store_true', help='read the file through a memory map')
+    parser.add_argument('--check-marks', action='store_true', help='also fail moves with wrong + and # marks')
+    parser.add_argument('--json', action='store_true', help='print one JSON line per game')
+    parser.add_argument('--all', action='store_true', help='print the games that pass too')
+    args = parser.parse_args()
+
+    counts = collections.Counter()
+    start = time.perf_counter()
+    with open(args.path, 'rb') as f:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if args.mmap else f
+        results = validate(source, args.workers, args.chunk_size, args.check_marks)
+        for res in results:
+            counts['games'] += 1
+            counts['plies'] += res.plies
+            counts['passed' if res.ok else 'failed'] += 1
+            if args.json:
+                print(json.dumps(res._asdict()))
+            elif args.all or not res.ok:
+                print('game {}: {}'.format(res.index, 'ok' if res.ok else 'FAIL at {}: {}'.format(res.move, res.error)))
+    seconds = time.perf_counter() - start
+    summary = {'games': counts['games'], 'passed': counts['passed'], 'failed': counts['failed'],
+               'plies': counts['plies'], 'seconds': round(seconds, 3),
+               'games_per_second': round(counts['games'] / seconds, 1) if seconds else 0}
+    print(json.dumps(summary) if args.json else
+          '{games} games  {passed} passed  {failed} failed  {plies} plies  {seconds}s  {games_per_second} games/s'
+          .format(**summary))
+    raise SystemExit(1 if counts['failed'] else 0)
@@ -3,22 +3,30 @@
 
 """Piece classes for the Chess Package
 """
-# TODO: Possibly rework check_valid_move methods by making and using a gen_all_valid_moves methods
-# This will make the logic for the check_valid_move methods cleaner and would also give access to a generator
-# method that would be useful for checking for checkmate
 
-import itertools as it
+# Piece kinds, used to index per piece type tables such as the bitboards
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+# (row, col) steps used to generate moves
+KNIGHT_OFFSETS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_OFFSETS = ((1, -1), (1, 0), (1, 1), (0, -1), (0, 1), (-1, -1), (-1, 0), (-1, 1))
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
 
 
 class Piece:
     """
     Base Class for the chess pieces, contains all the logic for interfacing with the pieces.
+    The kind, letter and move rules belong to the class and the color comes from the player, so each instance only
+    holds the four slots below.
     Attributes:
     _player -- the player object that owns this piece
     _pos -- the position of the piece on the board
     _board -- board object os the piece has access to the current game state
     _moved -- boolean that stores if the piece has been moved before
     """
+    __slots__ = ('_player', '_pos', '_board', '_moved')
+
     def __init__(self, player, pos, board=None):
         self._player = player
         self._pos = pos
@@ -49,209 +57,337 @@ class Piece:
         """Set the board object for the piece"""
         self._board = board
 
-    def set_moved(self):
-        """Set that this piece has been moved"""
-        self._moved = True
+    def set_moved(self, moved=True):
+        """Set that this piece has been moved, or clear it again when taking a move back"""
+        self._moved = moved
 
     def has_moved(self):
         """Return if the peice has moved yet this game"""
         return self._moved
 
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the piece movement rules without raising or building anything.
+        Returns LEGAL or the status code of the first rule the move breaks.  Capturing your own piece and leaving the
+        King in check are left to ChessGame.is_legal.
+        """
+        return INVALID_MOVE
+
+    def check_valid_move(self, end_pos):
+        """Method to check if the passed move argument is a valid move, raises a MoveError if it is not
+        Inputs:
+        endPos -- Tuple of final board coordinates for move
+        """
+        status = self.move_status(end_pos)
+        if status != LEGAL:
+            expression, message = MOVE_ERRORS[status]
+            raise MoveError(expression, message, self, self._pos, end_pos)
+
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this piece can make.
+        Moves are checked against the piece movement rules but not against leaving the player's own King in check,
+        use ChessGame.legal_moves for that.
+        """
+        return iter(())
+
+    def _gen_step_moves(self, offsets):
+        """Generator for pieces that jump straight to a square by one of the (row, col) offsets"""
+        r, c = self._pos
+        for dr, dc in offsets:
+            x, y = r + dr, c + dc
+            if 0 <= x < 8 and 0 <= y < 8:
+                check_piece = self._board[x][y]
+                if check_piece is None or check_piece._player is not self._player or isinstance(check_piece, GhostPawn):
+                    yield x, y
+
+    def _gen_line_moves(self, directions):
+        """Generator for pieces that slide along the (row, col) directions until blocked"""
+        r, c = self._pos
+        for dr, dc in directions:
+            x, y = r + dr, c + dc
+            while 0 <= x < 8 and 0 <= y < 8:
+                check_piece = self._board[x][y]
+                # Ghost pawns don't block movement
+                if check_piece is None or isinstance(check_piece, GhostPawn):
+                    yield x, y
+                else:
+                    if check_piece._player is not self._player:
+                        yield x, y
+                    break
+                x, y = x + dr, y + dc
+
+    def _line_status(self, end_pos, straight, diagonal):
+        """move_status for pieces that slide along rows and columns (straight) and/or diagonals"""
+        r, c = self._pos
+        x, y = end_pos
+        dr = x - r
+        dc = y - c
+        if dr == 0 or dc == 0:
+            if not straight:
+                return INVALID_MOVE
+        elif not diagonal or abs(dr) != abs(dc):
+            return INVALID_MOVE
+        # Every square between start and end has to be empty, ghost pawns don't block
+        dr = (dr > 0) - (dr < 0)
+        dc = (dc > 0) - (dc < 0)
+        r += dr
+        c += dc
+        board = self._board
+        while r != x or c != y:
+            check_piece = board[r][c]
+            if check_piece is not None and check_piece.kind is not None:
+                return BLOCKED
+            r += dr
+            c += dc
+        return LEGAL
+
 
 class Pawn(Piece):
+    __slots__ = ()
+    kind = PAWN
+    letter = 'P'
+
     def __str__(self):
         return '\u2659' if self._player.isWhite else '\u265f'
 
-    def check_valid_move(self, end_pos):
-        """Method to check if the passed move argument is a valid move.abs
-        Inputs:
-        endPos -- Tuple of final board coordinates for move
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this pawn can make, including En Passant captures
+        of a ghost pawn.
         """
-        all_valid_moves = []
         r, c = self._pos
-        if self._player.isWhite:
-            # Straight Moves
-            if self._board[r + 1][c] is None:
-                all_valid_moves.append((r + 1, c))
-                # Starting Move
-                if not self._moved and self._board[r + 2][c] is None:
-                    all_valid_moves.append((r + 2, c))
-            # Capture Moves
-            if c < 7 and self._board[r + 1][c + 1] is not None:
-                if self._board[r + 1][c + 1].player.isWhite != self._player.isWhite:
-                    all_valid_moves.append((r + 1, c + 1))
-            if c > 0 and self._board[r + 1][c - 1] is not None:
-                if self._board[r + 1][c - 1].player.isWhite != self._player.isWhite:
-                    all_valid_moves.append((r + 1, c - 1))
-        else:
+        step = 1 if self._player.isWhite else -1
+        x = r + step
+        if not 0 <= x < 8:
+            return
+        # Straight Moves
+        check_piece = self._board[x][c]
+        if check_piece is None or isinstance(check_piece, GhostPawn):
+            yield x, c
+            # Starting Move
+            if not self._moved and 0 <= x + step < 8:
+                check_piece = self._board[x + step][c]
+                if check_piece is None or isinstance(check_piece, GhostPawn):
+                    yield x + step, c
+        # Capture Moves, a ghost pawn belongs to the opponent so En Passant is covered here too
+        if c < 7:
+            check_piece = self._board[x][c + 1]
+            if check_piece is not None and check_piece._player is not self._player:
+                yield x, c + 1
+        if c > 0:
+            check_piece = self._board[x][c - 1]
+            if check_piece is not None and check_piece._player is not self._player:
+                yield x, c - 1
+
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the pawn movement rules, see Piece.move_status"""
+        r, c = self._pos
+        x, y = end_pos
+        board = self._board
+        step = 1 if self._player.isWhite else -1
+        if x == r + step:
+            check_piece = board[x][y]
             # Straight Moves
-            if self._board[r - 1][c] is None:
-                all_valid_moves.append((r - 1, c))
-                # Starting Move
-                if not self._moved and self._board[r - 2][c] is None:
-                    all_valid_moves.append((r - 2, c))
-            # Capture Moves
-            if c < 7 and self._board[r - 1][c + 1] is not None:
-                if self._board[r - 1][c + 1].player.isWhite != self._player.isWhite:
-                    all_valid_moves.append((r - 1, c + 1))
-            if c > 0 and self._board[r - 1][c - 1] is not None:
-                if self._board[r - 1][c - 1].player.isWhite != self._player.isWhite:
-                    all_valid_moves.append((r - 1, c - 1))
-        # Check if there is any valid moves for this piece
-        if not all_valid_moves:
-            raise MoveError('Invalid Piece', 'No Valid Moves for Piece', self, self._pos, end_pos)
-        # Check if the input move is part of this piece's valid move set
-        if end_pos not in all_valid_moves:
-            raise MoveError('Invalid Move', 'Not a Valid Move for Selected Piece', self, self._pos, end_pos)
+            if y == c:
+                if check_piece is None or check_piece.kind is None:
+                    return LEGAL
+                return BLOCKED
+            # Capture Moves, a ghost pawn belongs to the opponent so En Passant is covered here too
+            if (y == c + 1 or y == c - 1) and check_piece is not None and check_piece._player is not self._player:
+                return LEGAL
+        elif x == r + 2 * step and y == c and not self._moved:
+            # Starting Move
+            check_piece = board[r + step][c]
+            if check_piece is not None and check_piece.kind is not None:
+                return BLOCKED
+            check_piece = board[x][y]
+            if check_piece is not None and check_piece.kind is not None:
+                return BLOCKED
+            return LEGAL
+        # Check if there is any valid moves for this piece, a pawn that can't move one square can't move two
+        x = r + step
+        if 0 <= x < 8:
+            check_piece = board[x][c]
+            if check_piece is None or check_piece.kind is None:
+                return INVALID_MOVE
+            check_piece = board[x][c - 1] if c > 0 else None
+            if check_piece is not None and check_piece._player is not self._player:
+                return INVALID_MOVE
+            check_piece = board[x][c + 1] if c < 7 else None
+            if check_piece is not None and check_piece._player is not self._player:
+                return INVALID_MOVE
+        return NO_VALID_MOVES
 
 
 class Rook(Piece):
+    __slots__ = ()
+    kind = ROOK
+    letter = 'R'
+
     def __str__(self):
         return '\u2656' if self._player.isWhite else '\u265c'
 
-    def check_valid_move(self, end_pos):
-        """Method to check if the passed move argument is a valid move.abs
-        Inputs:
-        endPos -- Tuple of final board coordinates for move
-        """
-        # Check if moving along row or column
-        # -Loop through all board positions between start and end
-        # --Check to make sure no piece is there blocking movement
-        if end_pos[0] == self._pos[0]:
-            for i in range(self._pos[1], end_pos[1], 1 if end_pos[1] > self._pos[1] else -1)[1:]:
-                check_piece = self._board[self._pos[0]][i]
-                if check_piece is not None and not isinstance(check_piece, GhostPawn):
-                    raise MoveError('Invalid Move', 'Another piece is in the way', self, self._pos, end_pos)
-        elif end_pos[1] == self._pos[1]:
-            for i in range(self._pos[0], end_pos[0], 1 if end_pos[0] > self._pos[0] else -1)[1:]:
-                check_piece = self._board[i][self._pos[1]]
-                if check_piece is not None and not isinstance(check_piece, GhostPawn):
-                    raise MoveError('Invalid Move', 'Another piece is in the way', self, self._pos, end_pos)
-        # If the row or column does not stay the same then it is an invalid move for a Rook
-        else:
-            raise MoveError('Invalid Move', 'Not a valid method to move this piece type', self, self._pos, end_pos)
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this rook can make"""
+        return self._gen_line_moves(ROOK_DIRECTIONS)
+
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the rook movement rules, see Piece.move_status"""
+        return self._line_status(end_pos, True, False)
 
 
 class Knight(Piece):
+    __slots__ = ()
+    kind = KNIGHT
+    letter = 'N'
+
     def __str__(self):
         return '\u2658' if self._player.isWhite else '\u265e'
 
-    def check_valid_move(self, end_pos):
-        """Method to check if the passed move argument is a valid move.abs
-        Inputs:
-        endPos -- Tuple of final board coordinates for move
-        """
-        r, c = self._pos
-        moves = list(it.product((r - 1, r + 1), (c - 2, c + 2))) + list(it.product((r - 2, r + 2), (c - 1, c + 1)))
-        # Build a list of all valid moves, 
-        # with redundant bound check since that is scrubbed before this method is called
-        all_valid_moves = [(x, y) for x, y in moves if 0 <= x < 8 and 0 <= y < 8]
-        if end_pos not in all_valid_moves:
-            raise MoveError('Invalid Move', 'Not a Valid Move for Selected Piece', self, self._pos, end_pos)
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this knight can make"""
+        return self._gen_step_moves(KNIGHT_OFFSETS)
+
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the knight movement rules, see Piece.move_status"""
+        dr = abs(end_pos[0] - self._pos[0])
+        dc = abs(end_pos[1] - self._pos[1])
+        if dr * dc == 2:
+            return LEGAL
+        return INVALID_MOVE
 
 
 class Bishop(Piece):
+    __slots__ = ()
+    kind = BISHOP
+    letter = 'B'
+
     def __str__(self):
         return '\u2657' if self._player.isWhite else '\u265d'
 
-    def check_valid_move(self, end_pos):
-        """Method to check if the passed move argument is a valid move.abs
-        Inputs:
-        endPos -- Tuple of final board coordinates for move
-        """
-        # Calc diffs for row & col
-        diff_r = self._pos[0] - end_pos[0]
-        diff_c = self._pos[1] - end_pos[1]
-
-        # If the diffs are not equal then this is not a valid bishop move
-        if diff_r != diff_c:
-            raise MoveError('Invalid Move', 'Not a Valid Move for Selected Piece', self, self._pos, end_pos)
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this bishop can make"""
+        return self._gen_line_moves(BISHOP_DIRECTIONS)
 
-        # Check if any positions between start and end have any pieces in it
-        # TODO: Need to figure out how best to ignore ghost pawns
-        #  I don't like checking here in every piece that moves along lines
-        for i in range(0, diff_r, 1 if diff_r > 0 else -1)[1:]:
-            check_piece = self._board[self._pos[0] + i][self._pos[1] + i]
-            if check_piece is not None and not isinstance(check_piece, GhostPawn):
-                raise MoveError('Invalid Move', 'Another piece is in the way', self, self._pos, end_pos)
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the bishop movement rules, see Piece.move_status"""
+        return self._line_status(end_pos, False, True)
 
 
 class Queen(Piece):
+    __slots__ = ()
+    kind = QUEEN
+    letter = 'Q'
+
     def __str__(self):
         return '\u2655' if self._player.isWhite else '\u265b'
 
-    def check_valid_move(self, end_pos):
-        """Method to check if the passed move argument is a valid move.abs
-        Inputs:
-        endPos -- Tuple of final board coordinates for move
-        """
-        # Calc diffs for row & col
-        diff_r = self._pos[0] - end_pos[0]
-        diff_c = self._pos[1] - end_pos[1]
-
-        # Check if moving along row or column or diagonal
-        # -Loop through all board positions between start and end
-        # --Check to make sure no piece is there blocking movement
-        if end_pos[0] == self._pos[0]:
-            for i in range(self._pos[1], end_pos[1], 1 if end_pos[1] > self._pos[1] else -1)[1:]:
-                check_piece = self._board[self._pos[0]][i]
-                if check_piece is not None and not isinstance(check_piece, GhostPawn):
-                    raise MoveError('Invalid Move', 'Another piece is in the way', self, self._pos, end_pos)
-        elif end_pos[1] == self._pos[1]:
-            for i in range(self._pos[0], end_pos[0], 1 if end_pos[0] > self._pos[0] else -1)[1:]:
-                check_piece = self._board[i][self._pos[1]]
-                if check_piece is not None and not isinstance(check_piece, GhostPawn):
-                    raise MoveError('Invalid Move', 'Another piece is in the way', self, self._pos, end_pos)
-        elif diff_r == diff_c:
-            for i in range(0, diff_r, 1 if diff_r > 0 else -1)[1:]:
-                check_piece = self._board[self._pos[0] + i][self._pos[1] + i]
-                if check_piece is not None and not isinstance(check_piece, GhostPawn):
-                    raise MoveError('Invalid Move', 'Another piece is in the way', self, self._pos, end_pos)
-        else:
-            raise MoveError('Invalid Move', 'Not a Valid Move for Selected Piece', self, self._pos, end_pos)
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this queen can make"""
+        return self._gen_line_moves(ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the queen movement rules, see Piece.move_status"""
+        return self._line_status(end_pos, True, True)
 
 
 class King(Piece):
+    __slots__ = ()
+    kind = KING
+    letter = 'K'
+
     def __str__(self):
         return '\u2654' if self._player.isWhite else '\u265a'
 
-    def check_valid_move(self, end_pos):
-        """Method to check if the passed move argument is a valid move.abs
-        Inputs:
-        endPos -- Tuple of final board coordinates for move
+    def gen_all_valid_moves(self):
+        """Generator that yields the end position of every move this king can make without moving into check.
+        Castling is a move of the king two squares towards the rook.
         """
-        if end_pos[0] == 'CR':
-            pass
-        elif end_pos[1] == 'CL':
-            pass
-        else:
-            r, c = self._pos
-            moves = list(it.product((r - 1, r, r + 1), (c - 1, c, c + 1)))
-            moves.remove((r, c))
-            # Build a list of all valid moves,
-            # with redundant bound check since that is scrubbed before this method is called
-            all_valid_moves = [(x, y) for x, y in moves if 0 <= x < 8 and 0 <= y < 8]
-            if end_pos not in all_valid_moves:
-                raise MoveError('Invalid Move', 'Not a Valid Move for Selected Piece', self, self._pos, end_pos)
+        for end_pos in self._gen_step_moves(KING_OFFSETS):
+            if not self._player.check_for_check(end_pos):
+                yield end_pos
+        if self._moved:
+            return
+        r, c = self._pos
+        board = self._board
+        # Castle to the right (towards column 7) and to the left (towards column 0)
+        for rook_col, step in ((7, 1), (0, -1)):
+            rook = board[r][rook_col]
+            if not isinstance(rook, Rook) or rook._player is not self._player or rook._moved:
+                continue
+            if any(board[r][i] is not None for i in range(c + step, rook_col, step)):
+                continue
+            # Can't castle out of, through or into check
+            if (self._player.check_for_check(self._pos) or self._player.check_for_check((r, c + step))
+                    or self._player.check_for_check((r, c + 2 * step))):
+                continue
+            yield r, c + 2 * step
+
+    def move_status(self, end_pos):
+        """Checks a move to end_pos against the king movement rules, see Piece.move_status"""
+        r, c = self._pos
+        x, y = end_pos
+        if abs(x - r) <= 1 and abs(y - c) <= 1:
             if self._player.check_for_check(end_pos):
-                raise MoveError('Invalid Move', 'Moving into check', self, self._pos, end_pos)
+                return MOVING_INTO_CHECK
+            return LEGAL
+        if x != r or abs(y - c) != 2 or self._moved:
+            return INVALID_MOVE
+        # Castle towards the rook in column 7 or column 0
+        step = 1 if y > c else -1
+        rook = self._board[r][7 if step > 0 else 0]
+        if not isinstance(rook, Rook) or rook._player is not self._player or rook._moved:
+            return INVALID_MOVE
+        i = c + step
+        while 0 < i < 7:
+            if self._board[r][i] is not None:
+                return BLOCKED
+            i += step
+        # Can't castle out of, through or into check
+        player = self._player
+        if (player.check_for_check(self._pos) or player.check_for_check((r, c + step))
+                or player.check_for_check(end_pos)):
+            return INVALID_MOVE
+        return LEGAL
 
 
 class GhostPawn(Piece):
     """
     Piece class used to enable En Passant rule when a pawn is moved by 2 spaces at the start.
     Puts a piece on the board that doesn't print or valid to move so attacking pawns can capture the
-    jumping.
-    Attributes:
-    _parent_pawn -- The pawn that moved that caused this object to be made.
+    jumping.  Each player has a single GhostPawn that is moved to wherever it is needed, the pawn that
+    made it is always the one just beyond it.
     """
-    def __init__(self, parent_pawn, pos):
-        Piece.__init__(self, None, pos)
-        self._parent_pawn = parent_pawn
+    __slots__ = ()
+    kind = None
+    letter = None
 
     def __str__(self):
         return ' '
 
+    def get_parent(self):
+        """Returns the pawn that left this ghost pawn behind"""
+        r, c = self._pos
+        return self._board[r + 1 if self._player.isWhite else r - 1][c]
+
+
+# Move status codes returned by ChessGame.is_legal and Piece.move_status, LEGAL or the first rule a move breaks
+(LEGAL, START_OFF_BOARD, NO_PIECE, OPPONENTS_PIECE, END_OFF_BOARD, NOT_MOVING, OWN_CAPTURE, NO_VALID_MOVES,
+ INVALID_MOVE, BLOCKED, MOVING_INTO_CHECK, LEAVES_KING_IN_CHECK) = range(12)
+# (expression, message) of the MoveError raised for each status code
+MOVE_ERRORS = (
+    None,
+    ('Invalid Piece', 'Position of Piece not on the board'),
+    ('Invalid Piece', 'No Piece located on the selected position'),
+    ('Invalid Piece', "Cannot move the opponent's Piece"),
+    ('Invalid Move', 'Position of Move not on the board'),
+    ('MoveError', "Can't move a piece to it's own location."),
+    ('Invalid Move', 'Cannot capture your own Piece'),
+    ('Invalid Piece', 'No Valid Moves for Piece'),
+    ('Invalid Move', 'Not a Valid Move for Selected Piece'),
+    ('Invalid Move', 'Another piece is in the way'),
+    ('Invalid Move', 'Moving into check'),
+    ('Invalid Move', 'Move would leave your King in check'),
+)
+
 
 class MoveError(Exception):
     """Exception raised for errors moving a piece.
@@ -270,3 +406,9 @@ class MoveError(Exception):
         self.piece = piece
         self.startPos = startPos
         self.endPos = endPos
+
+
+# Piece classes indexed by kind
+PIECE_CLASSES = (Pawn, Knight, Bishop, Rook, Queen, King)
+# Piece classes a pawn can be promoted to, the first is used when no choice is given
+PROMOTION_PIECES = (Queen, Rook, Bishop, Knight)
@@ -8,12 +8,23 @@ import pieces as p
 
 
 class Player:
+    """
+    Attributes:
+    pieces -- list of every piece the player has had this game, captured pieces stay with their position set to None
+    ghost_pawn -- the player's GhostPawn while it is on the board, otherwise None
+    isWhite -- True for the White player
+    _spares -- _spares[kind] is a list of pieces from earlier games that new_piece hands out again
+    _ghost -- the one GhostPawn object the player uses for every two square pawn push
+    """
     def __init__(self, is_white, opponent=None, king=None):
         self.pieces = []
         self.ghost_pawn = None
+        self._spares = [[] for _ in range(6)]
+        self._ghost = p.GhostPawn(self, None)
         self.isWhite = is_white
         self._opponent = opponent
         self._king = king
+        self._game = None
 
     def set_opponent(self, op):
         """Set the opponent attribute for the player to op"""
@@ -23,8 +34,18 @@ class Player:
         """Return the player object stored as the opponent"""
         return self._opponent
 
+    def set_game(self, game):
+        """Set the game that this player is taking part in"""
+        self._game = game
+
+    def get_game(self):
+        """Return the game object this player is taking part in"""
+        return self._game
+
     def clear(self):
-        """Clears the attributes to start a new game"""
+        """Clears the attributes to start a new game, keeping the old pieces to be handed out again by new_piece"""
+        for piece in self.pieces:
+            self._spares[piece.kind].append(piece)
         self.pieces = []
         self.ghost_pawn = None
 
@@ -32,21 +53,41 @@ class Player:
         """Adds a piece to the piece list for the calling player"""
         self.pieces.append(piece)
 
+    def new_piece(self, piece_class, pos, board):
+        """Returns an unmoved piece of piece_class for this player at pos, reusing a spare one if there is one"""
+        spares = self._spares[piece_class.kind]
+        if not spares:
+            return piece_class(self, pos, board)
+        piece = spares.pop()
+        piece.set_pos(pos)
+        piece.set_board(board)
+        piece.set_moved(False)
+        return piece
+
+    def release_piece(self, piece):
+        """Keeps a piece that has been taken out of the game, such as an undone promotion, for new_piece"""
+        self._spares[piece.kind].append(piece)
+
+    def new_ghost_pawn(self, pos, board):
+        """Returns the player's GhostPawn moved to pos, there is only one so it must be off the board"""
+        self._ghost.set_pos(pos)
+        self._ghost.set_board(board)
+        return self._ghost
+
     def is_checked(self):
         """Checks if player is checked and returns True or False"""
         return self.check_for_check(self._king.get_pos())
 
     def is_checkmate(self):
         """Checks if player is checkmated and returns True or False"""
-        pass
+        return self.is_checked() and not self._game.has_legal_move(self)
 
     def check_for_check(self, king_pos=None):
-        # TODO: Possibly change so it accepts an entire board state to cover moving other pieces when wanting to
-        # check for a checkmate position.
-        """Checks if player is checked based on passed king position"""
+        """Checks if player is checked based on passed king position, see ChessGame.is_attacked"""
         if king_pos is None:
             king_pos = self._king.get_pos()
-        # TODO: Logic to check if the king would be in check if in the location king_pos
+        # The king's own square is treated as empty so it can't block an attack on the square it moves to
+        return self._game.is_attacked(king_pos, self._opponent, ignore=self._king.get_pos())
 
     def set_king(self, king):
         """Sets the king object for the player object"""
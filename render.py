@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Board rendering for the Chess Package
+
+ChessGame counts the changes to each row of the board in row_versions (every _place, _place_all and _lift bumps the
+row it touches), so a Renderer only rebuilds the rows that changed since it last looked and keeps the rest cached.
+TerminalView turns those changes into ANSI cursor-addressed updates of just the squares that changed, instead of
+clearing the screen and drawing the whole board again, and SpectatorHub works the update out once and sends the same
+bytes to every spectator watching the game.
+
+Usage:
+    python render.py --spectators 500 --plies 100
+"""
+
+import argparse
+
+BORDER = '+---' * 8 + '+'
+# Screen position of the board drawn at the top left: row 7 is on line 2 and each row takes two lines, the symbol
+# of column c is in column 3 + 4 * c
+_TOP_LINE = 2
+_LEFT_COLUMN = 3
+BOARD_LINES = 17
+
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+CLEAR_BELOW = '\x1b[J'
+
+
+def symbol(cp):
+    """Returns the character shown for a square holding cp, a space for an empty square or a ghost pawn"""
+    return ' ' if cp is None else str(cp)
+
+
+def row_text(row):
+    """Returns the text line for one row of the board, e.g. '| ♖ | ♘ | ... |'"""
+    return '| ' + ' | '.join([symbol(cp) for cp in row]) + ' |'
+
+
+def move_to(line, column):
+    """Returns the ANSI sequence that moves the cursor to a 1 based screen line and column"""
+    return '\x1b[{};{}H'.format(line, column)
+
+
+class Renderer:
+    """
+    Cached text of a game's board, rebuilding only the rows that changed.
+    Attributes:
+    game -- ChessGame being drawn
+    _versions -- game.row_versions of each row when it was last drawn, None before the first time
+    _symbols -- _symbols[row] is the list of the 8 symbols last drawn in that row
+    _rows -- _rows[row] is the cached text line of that row
+    """
+    def __init__(self, game):
+        self.game = game
+        self._versions = [None] * 8
+        self._symbols = [[' '] * 8 for _ in range(8)]
+        self._rows = [row_text([None] * 8)] * 8
+
+    def refresh(self):
+        """Brings the cache up to date and returns the list of (row, col, symbol) of the squares that changed"""
+        changed = []
+        versions = self.game.row_versions
+        board = self.game.board
+        for r in range(8):
+            if versions[r] == self._versions[r]:
+                continue
+            self._versions[r] = versions[r]
+            old = self._symbols[r]
+            new = [symbol(cp) for cp in board[r]]
+            if new == old:
+                continue
+            changed.extend((r, c, new[c]) for c in range(8) if new[c] != old[c])
+            self._symbols[r] = new
+            self._rows[r] = '| ' + ' | '.join(new) + ' |'
+        return changed
+
+    def text(self):
+        """Returns the whole board as text, the same as str(game)"""
+        self.refresh()
+        return BORDER + '\n' + ('\n' + BORDER + '\n').join(self._rows[::-1]) + '\n' + BORDER + '\n'
+
+
+class TerminalView:
+    """
+    Draws a game on an ANSI terminal, the whole board once and then only the squares that change.
+    Attributes:
+    renderer -- Renderer holding the cached board
+    _drawn -- False until the first full frame has been made
+    """
+    def __init__(self, game):
+        self.renderer = Renderer(game)
+        self._drawn = False
+
+    def frame(self):
+        """Returns the output that clears the screen and draws the whole board at the top left"""
+        self._drawn = True
+        return CLEAR_SCREEN + self.renderer.text()
+
+    def update(self):
+        """Returns the output that brings the screen up to date, a full frame the first time and afterwards just the
+        changed squares, an empty string if nothing changed
+        """
+        if not self._drawn:
+            return self.frame()
+        return ''.join([move_to(_TOP_LINE + 2 * (7 - r), _LEFT_COLUMN + 4 * c) + sym
+                        for r, c, sym in self.renderer.refresh()])
+
+    @staticmethod
+    def below():
+        """Returns the output that moves the cursor under the board and clears everything after it"""
+        return move_to(BOARD_LINES + 1, 1) + CLEAR_BELOW
+
+
+class SpectatorHub:
+    """
+    Sends one game to many spectators, working each update out once for all of them.
+    Attributes:
+    view -- TerminalView the updates come from
+    encoding -- the updates are encoded once to bytes with this before sending, None sends str
+    spectators -- list of the objects with a write method that are watching
+    _pending -- spectators added since the last publish, they get a full frame
+    """
+    def __init__(self, game, encoding='utf-8'):
+        self.view = TerminalView(game)
+        self.encoding = encoding
+        self.spectators = []
+        self._pending = []
+
+    def add(self, out):
+        """Adds a spectator, it is sent the whole board on the next publish"""
+        self._pending.append(out)
+
+    def remove(self, out):
+        if out in self._pending:
+            self._pending.remove(out)
+        elif out in self.spectators:
+            self.spectators.remove(out)
+
+    def _encode(self, text):
+        return text.encode(self.encoding) if self.encoding else text
+
+    def publish(self):
+        """Sends the changes since the last publish to every spectator and returns the number of bytes or characters
+        each existing spectator was sent
+        """
+        update = self._encode(self.view.update())
+        if update:
+            for out in self.spectators:
+                out.write(update)
+        if self._pending:
+            # The board is already up to date after update(), so the newcomers get it drawn whole
+            frame = self._encode(CLEAR_SCREEN + self.view.renderer.text())
+            for out in self._pending:
+                out.write(frame)
+            self.spectators.extend(self._pending)
+            self._pending = []
+        return len(update)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    import chessgame as cg
+    from membench import play_random
+
+    class _Sink:
+        """Spectator that counts what it is sent"""
+        def __init__(self):
+            self.sent = 0
+
+        def write(self, data):
+            self.sent += len(data)
+
+    parser = argparse.ArgumentParser(description='Time full redraws against diffs fanned out to spectators.')
+    parser.add_argument('--spectators', type=int, default=500, help='spectators watching the game (default: 500)')
+    parser.add_argument('--plies', type=int, default=100, help='random moves to play (default: 100)')
+    args = parser.parse_args()
+
+    results = []
+    for mode in ('redraw', 'diff'):
+        rng = random.Random(0)
+        game = cg.ChessGame()
+        game.new_game()
+        sinks = [_Sink() for _ in range(args.spectators)]
+        hub = SpectatorHub(game)
+        for sink in sinks:
+            hub.add(sink)
+        hub.publish()
+        start = time.perf_counter()
+        for _ in range(args.plies):
+            play_random(game, 1, rng)
+            if mode == 'redraw':
+                # What the old loop did for each watcher: build the board string and send it whole
+                for sink in sinks:
+                    sink.write((CLEAR_SCREEN + str(game)).encode('utf-8'))
+            else:
+                hub.publish()
+        seconds = time.perf_counter() - start
+        results.append((mode, seconds, sum(sink.sent for sink in sinks)))
+
+    for mode, seconds, sent in results:
+        print('{:>6}  {:8.3f}s  {:8.0f} updates/s  {:10} bytes sent'.format(
+            mode, seconds, args.plies * args.spectators / seconds, sent))
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Multi-game asyncio server for the Chess Package
+
+Hosts any number of ChessGames over TCP with a line protocol, one command per line and one reply line per command.
+Moves are checked and played on the event loop since they take microseconds, while engine searches run in a pool of
+worker processes so a long search never holds up the other games.  Each game has its own lock so commands for one
+game are handled in order, and games left idle are evicted.
+
+Commands (moves in coordinate notation, e.g. e2e4 or a7a8q):
+    NEW [fen]            start a game, optionally from a FEN           -> OK <game id>
+    MOVE <id> <move>     play a move for the side to move              -> OK <fen> [check|checkmate|stalemate]
+    GO <id> [depth]      play the engine's move for the side to move   -> OK <move> <fen> [check|checkmate|stalemate]
+    FEN <id>             get the position                              -> OK <fen>
+    LEGAL <id>           get the legal moves                           -> OK <move> <move> ...
+    CLOSE <id>           end a game                                    -> OK
+    PING                                                               -> OK PONG
+    STATS                                                              -> OK <json>
+    QUIT                 close the connection
+Errors reply ERR <message>.
+
+Usage:
+    python server.py serve --port 8765
+    python server.py load --clients 100 --games 2 --moves 40
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import chessgame as cg
+import engine as eng
+import parallel
+import pieces as p
+
+
+class _Session:
+    """
+    A game hosted by the server.
+    Attributes:
+    game -- the ChessGame
+    lock -- asyncio.Lock held while a command for this game runs
+    last_used -- loop time of the last command for this game
+    """
+    __slots__ = ('game', 'lock', 'last_used')
+
+    def __init__(self, game, now):
+        self.game = game
+        self.lock = asyncio.Lock()
+        self.last_used = now
+
+
+def _status(game):
+    """Returns ' check', ' checkmate', ' stalemate' or '' for the side to move"""
+    player = game.to_move
+    checked = player.is_checked()
+    if not game.has_legal_move(player):
+        return ' checkmate' if checked else ' stalemate'
+    return ' check' if checked else ''
+
+
+class GameServer:
+    """
+    Line protocol server hosting many games, see the module docstring for the commands.
+    Attributes:
+    idle_timeout -- seconds a game can go without a command before it is evicted
+    max_games -- games that can be hosted at once, NEW is refused beyond this
+    max_depth -- deepest engine search GO may ask for
+    games -- dict of game id to _Session
+    stats -- dict of counters: commands, errors, games_created, games_evicted, connections
+    _pool -- ProcessPoolExecutor running the engine searches
+    _connections -- set of the tasks handling the open connections
+    """
+    def __init__(self, idle_timeout=300.0, max_games=10000, workers=None, max_depth=4, tt_size=1 << 16):
+        self.idle_timeout = idle_timeout
+        self.max_games = max_games
+        self.max_depth = max_depth
+        self.games = {}
+        self.stats = dict.fromkeys(('commands', 'errors', 'games_created', 'games_evicted', 'connections'), 0)
+        self._ids = itertools.count(1)
+        self._pool = parallel.worker_pool(workers, tt_size)
+        self._server = None
+        self._evictor = None
+        self._connections = set()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """Starts listening and returns the port, pass port 0 to pick a free one"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._evictor = asyncio.ensure_future(self._evict_idle())
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """Stops listening, stops evicting and shuts down the engine workers"""
+        if self._evictor is not None:
+            self._evictor.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections)
+        self._pool.shutdown()
+
+    async def _handle_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').strip()
+                if command.upper() == 'QUIT':
+                    break
+                writer.write((await self.handle_command(command) + '\n').encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # The client went away or the server is closing
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def handle_command(self, command):
+        """Runs one protocol command and returns the reply line, usable without a socket"""
+        self.stats['commands'] += 1
+        words = command.split()
+        name = words[0].upper() if words else ''
+        try:
+            if name == 'PING':
+                return 'OK PONG'
+            if name == 'STATS':
+                return 'OK ' + json.dumps(dict(self.stats, games=len(self.games)))
+            if name == 'NEW':
+                return self._new(' '.join(words[1:]))
+            if name in ('MOVE', 'GO', 'FEN', 'LEGAL', 'CLOSE') and len(words) > 1:
+                session = self.games.get(words[1])
+                if session is None:
+                    raise ValueError('Unknown game {}'.format(words[1]))
+                async with session.lock:
+                    # A CLOSE or an eviction may have removed the game while this command waited for the lock
+                    if self.games.get(words[1]) is not session:
+                        raise ValueError('Unknown game {}'.format(words[1]))
+                    session.last_used = asyncio.get_running_loop().time()
+                    return await self._game_command(name, words[1], session.game, words[2:])
+            raise ValueError('Unknown command {!r}'.format(command))
+        except ValueError as err:
+            self.stats['errors'] += 1
+            return 'ERR {}'.format(err)
+        except p.MoveError as err:
+            self.stats['errors'] += 1
+            return 'ERR {}: {}'.format(err.expression, err.message)
+        except Exception as err:
+            # Anything else, such as a broken engine pool, fails just this command and keeps the connection open
+            self.stats['errors'] += 1
+            return 'ERR {}: {}'.format(type(err).__name__, err)
+
+    def _new(self, fen):
+        if len(self.games) >= self.max_games:
+            raise ValueError('Server is full')
+        if fen:
+            game = cg.ChessGame.from_fen(fen)
+        else:
+            game = cg.ChessGame()
+            game.new_game()
+        game_id = str(next(self._ids))
+        self.games[game_id] = _Session(game, asyncio.get_running_loop().time())
+        self.stats['games_created'] += 1
+        return 'OK ' + game_id
+
+    async def _game_command(self, name, game_id, game, args):
+        if name == 'FEN':
+            return 'OK ' + game.to_fen()
+        if name == 'LEGAL':
+            return ' '.join(['OK'] + [eng.format_move(move) for move in game.legal_moves(game.to_move)])
+        if name == 'CLOSE':
+            self.games.pop(game_id, None)
+            return 'OK'
+        if name == 'MOVE':
+            if len(args) != 1:
+                raise ValueError('MOVE needs a game id and a move')
+            game.move(game.to_move, *eng.parse_move(args[0]))
+            return 'OK ' + game.to_fen() + _status(game)
+        # GO, the search runs in a worker process so the other games carry on meanwhile
+        depth = max(1, min(int(args[0]), self.max_depth) if args and args[0].isdigit() else self.max_depth)
+        loop = asyncio.get_running_loop()
+        move = await loop.run_in_executor(self._pool, parallel.search_move, parallel.snapshot(game), depth, None)
+        if move is None:
+            raise ValueError('No legal moves')
+        game.move(game.to_move, *move)
+        return 'OK {} {}{}'.format(eng.format_move(move), game.to_fen(), _status(game))
+
+    async def _evict_idle(self):
+        """Background task that removes games nobody has sent a command for in idle_timeout seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60.0) / 2)
+            cutoff = loop.time() - self.idle_timeout
+            for game_id, session in list(self.games.items()):
+                if session.last_used < cutoff and not session.lock.locked():
+                    self.games.pop(game_id, None)
+                    self.stats['games_evicted'] += 1
+
+
+class Client:
+    """
+    Client for GameServer, one request in flight at a time.
+    Use as an async context manager or call close() when done.
+    """
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.write(b'QUIT\n')
+            self._writer.close()
+            self._writer = None
+
+    async def request(self, command):
+        """Sends a command and returns the reply line, raises ValueError for an ERR reply"""
+        self._writer.write((command + '\n').encode())
+        await self._writer.drain()
+        reply = (await self._reader.readline()).decode().rstrip('\n')
+        if not reply.startswith('OK'):
+            raise ValueError(reply)
+        return reply[3:]
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Returns a dict of the given percentiles (nearest rank) and the max of a list of samples"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    result = {'p{}'.format(pt): ordered[min(len(ordered) - 1, len(ordered) * pt // 100)] for pt in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+async def _load_client(host, port, games, moves, rng, latencies):
+    """Plays games random games over one connection, timing every request"""
+    async with Client(host, port) as client:
+
+        async def timed(command):
+            start = time.perf_counter()
+            try:
+                return await client.request(command)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        for _ in range(games):
+            game_id = await timed('NEW')
+            for _ in range(moves):
+                legal = (await timed('LEGAL ' + game_id)).split()
+                if not legal:
+                    break
+                reply = await timed('MOVE {} {}'.format(game_id, rng.choice(legal)))
+                if reply.endswith('mate'):
+                    break
+            await timed('CLOSE ' + game_id)
+
+
+async def load_test(host, port, clients=50, games=2, moves=40, seed=0):
+    """Runs clients concurrent connections each playing random games against a server and returns a result dict
+    with the request count, requests per second and latency percentiles in milliseconds
+    """
+    rng = random.Random(seed)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_load_client(host, port, games, moves, random.Random(rng.random()), latencies)
+                           for _ in range(clients)))
+    seconds = time.perf_counter() - start
+    result = {'clients': clients, 'requests': len(latencies), 'seconds': round(seconds, 3),
+              'requests_per_second': round(len(latencies) / seconds, 1)}
+    result.update({key: round(value * 1000, 3) for key, value in percentiles(latencies).items()})
+    return result
+
+
+async def _serve(args):
+    server = GameServer(args.idle_timeout, args.max_games, args.workers, args.max_depth)
+    port = await server.start(args.host, args.port)
+    print('serving on {}:{}'.format(args.host, port))
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+async def _load(args):
+    server = None
+    port = args.port
+    # Without a port to connect to, run a server in this process
+    if port is None:
+        server = GameServer(workers=1)
+        port = await server.start(args.host, 0)
+    try:
+        result = await load_test(args.host, port, args.clients, args.games, args.moves, args.seed)
+    finally:
+        if server is not None:
+            await server.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host chess games over a line protocol, or load test a server.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the server')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--idle-timeout', type=float, default=300.0, help='seconds before an idle game is evicted')
+    serve.add_argument('--max-games', type=int, default=10000, help='games that can be hosted at once')
+    serve.add_argument('--workers', type=int, help='engine worker processes (default: all cores)')
+    serve.add_argument('--max-depth', type=int, default=4, help='deepest engine search GO may ask for')
+    load = commands.add_parser('load', help='run the load generator')
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int, help='server to load, by default one is started in this process')
+    load.add_argument('--clients', type=int, default=50, help='concurrent connections (default: 50)')
+    load.add_argument('--games', type=int, default=2, help='games each client plays (default: 2)')
+    load.add_argument('--moves', type=int, default=40, help='moves played in each game (default: 40)')
+    load.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_serve(args) if args.command == 'serve' else _load(args))
+    except KeyboardInterrupt:
+        pass
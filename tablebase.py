@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Endgame tablebases for the Chess Package
+
+A tablebase holds the exact result of every position with a given material signature, such as 'KQK' (White King
+and Queen against a lone Black King), 'KRK' or 'KPK'.  The generator enumerates every placement of the pieces with
+either side to move, finds each one's legal moves with the ChessGame move rules, then works backwards from the
+checkmates (retrograde analysis) one ply at a time until no more results change.  Positions still open are draws.
+
+Each table is a file with one byte per position, so a lookup is a single read from a memory map:
+    header -- 8 byte magic b'CHESSTB1' and the signature padded with spaces to 8 bytes
+    values -- one byte for each index, 0 for a draw, ILLEGAL for a position that can't happen, otherwise the
+        distance to mate in plies plus one; an odd distance is a win for the side to move and an even one a loss
+The index of a position is ((side * 64 + square_0) * 64 + square_1) * 64 ... with side 0 when White is to move and
+the pieces in signature order, squares are row * 8 + col.  The same table answers the colour swapped signature
+('KKQ') by mirroring the board.  Castling and En Passant rights aren't part of a position.
+
+Usage:
+    python tablebase.py generate KQK KRK KPK --dir tables --workers 4
+    python tablebase.py probe --dir tables --fen '8/8/8/4k3/8/8/8/4K2R w - - 0 1'
+"""
+
+import argparse
+import array
+import collections
+import concurrent.futures
+import mmap
+import os
+import time
+
+import chessgame as cg
+import pieces as p
+
+MAGIC = b'CHESSTB1'
+HEADER_SIZE = 16
+ILLEGAL = 255
+DRAW = 0
+# Order of the pieces in a signature for each side
+ORDER = 'KQRBNP'
+_CLASSES = {cls.letter: cls for cls in p.PIECE_CLASSES}
+
+TablebaseResult = collections.namedtuple('TablebaseResult', 'wdl plies')
+TablebaseResult.__doc__ = """Result of a tablebase probe, for the side to move
+wdl -- 1 for a win, 0 for a draw and -1 for a loss
+plies -- plies to checkmate with best play from both sides, None for a draw
+"""
+
+
+def split_signature(signature):
+    """Returns the (white, black) piece letters of a signature in canonical order, e.g. 'KQK' gives ('KQ', 'K')
+    Raises ValueError for a signature without exactly one King for each side.
+    """
+    signature = signature.upper()
+    second = signature.find('K', 1)
+    white, black = signature[:second], signature[second:]
+    if (not signature.startswith('K') or second < 0 or white.count('K') != 1 or black.count('K') != 1
+            or any(letter not in ORDER for letter in signature)):
+        raise ValueError('Invalid material signature {!r}'.format(signature))
+    return ''.join(sorted(white, key=ORDER.index)), ''.join(sorted(black, key=ORDER.index))
+
+
+def canonical(signature):
+    """Returns a signature with its pieces in canonical order"""
+    return ''.join(split_signature(signature))
+
+
+def is_insufficient(white, black):
+    """Returns True if neither side can ever checkmate, bare Kings with at most one Bishop or Knight between them"""
+    others = (white + black).replace('K', '')
+    return others in ('', 'B', 'N')
+
+
+def _dependencies(signature):
+    """Returns the signatures a table's captures and promotions lead to, that need their own tables"""
+    white, black = split_signature(signature)
+    found = set()
+    for side, other, swap in ((white, black, False), (black, white, True)):
+        for i, letter in enumerate(side):
+            if letter == 'K':
+                continue
+            # This piece is captured
+            smaller = side[:i] + side[i + 1:]
+            subs = [(smaller, other)]
+            if letter == 'P':
+                subs += [(smaller + promoted, other) for promoted in 'QRBN']
+            for sub_side, sub_other in subs:
+                sub_white, sub_black = (sub_other, sub_side) if swap else (sub_side, sub_other)
+                if not is_insufficient(sub_white, sub_black):
+                    found.add(canonical(sub_white + sub_black))
+    # The same piece can be captured after promoting
+    for sub in list(found):
+        found.update(_dependencies(sub))
+    found.discard(canonical(signature))
+    return found
+
+
+def table_path(directory, signature):
+    """Returns the path of a signature's table in directory"""
+    return os.path.join(directory, canonical(signature) + '.tb')
+
+
+def _decode(value):
+    """Returns the TablebaseResult for a stored value"""
+    if value == DRAW:
+        return TablebaseResult(0, None)
+    plies = value - 1
+    return TablebaseResult(1 if plies & 1 else -1, plies)
+
+
+class Table:
+    """
+    One tablebase file read through a memory map.
+    Attributes:
+    signature -- the material signature, such as 'KQK'
+    white, black -- the piece letters of each side, the order of the squares in an index
+    _file -- the open file
+    _map -- mmap of the whole file, shared with every other process that maps it
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError('{} is not a tablebase'.format(path))
+        header = self._map[:HEADER_SIZE]
+        signature = header[8:].decode('ascii', 'replace').strip()
+        try:
+            self.white, self.black = split_signature(signature)
+        except ValueError:
+            self.white = self.black = ''
+        self.signature = self.white + self.black
+        if header[:8] != MAGIC or len(self._map) != HEADER_SIZE + 2 * 64 ** len(self.signature):
+            self.close()
+            raise ValueError('{} is not a tablebase or is truncated'.format(path))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def value(self, index):
+        """Returns the stored value of the position with an index"""
+        return self._map[HEADER_SIZE + index]
+
+
+class Tablebases:
+    """
+    The tables found in a directory, opened the first time they are needed.
+    Attributes:
+    directory -- where the table files are
+    _tables -- dict of canonical signature to the open Table, or None if there is no file for it
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for table in self._tables.values():
+            if table is not None:
+                table.close()
+        self._tables = {}
+
+    def _table(self, signature):
+        if signature not in self._tables:
+            path = table_path(self.directory, signature)
+            self._tables[signature] = Table(path) if os.path.exists(path) else None
+        return self._tables[signature]
+
+    def probe_pieces(self, white, black, white_to_move):
+        """Returns the stored value for a position given as piece lists, or None if there is no table for it
+        Inputs:
+        white, black -- lists of (piece letter, square) for each side, squares are row * 8 + col
+        white_to_move -- True if White is to move
+        """
+        white_letters = ''.join(sorted((letter for letter, sq in white), key=ORDER.index))
+        black_letters = ''.join(sorted((letter for letter, sq in black), key=ORDER.index))
+        if is_insufficient(white_letters, black_letters):
+            return DRAW
+        table = self._table(white_letters + black_letters)
+        if table is None or table.white != white_letters:
+            # Look the colour swapped position up in the table for the other signature, turning the board over
+            table = self._table(black_letters + white_letters)
+            if table is None:
+                return None
+            white, black = [(letter, sq ^ 56) for letter, sq in black], [(letter, sq ^ 56) for letter, sq in white]
+            white_to_move = not white_to_move
+        index = 0 if white_to_move else 1
+        for letter, sq in sorted(white, key=lambda piece: ORDER.index(piece[0])):
+            index = index * 64 + sq
+        for letter, sq in sorted(black, key=lambda piece: ORDER.index(piece[0])):
+            index = index * 64 + sq
+        return table.value(index)
+
+    def probe(self, game, player=None):
+        """Returns the TablebaseResult of a game's position, or None if there is no table for its material
+        Inputs:
+        game -- ChessGame to look up
+        player -- Player to move, defaults to game.to_move
+        """
+        if player is None:
+            player = game.to_move
+        value = self.probe_pieces(_piece_list(game.playerWhite), _piece_list(game.playerBlack), player.isWhite)
+        if value is None or value == ILLEGAL:
+            return None
+        return _decode(value)
+
+    def best_move(self, game, player=None):
+        """Returns (move, TablebaseResult) for the move that keeps the best result, or None if there is no table
+        A won position is played towards the quickest mate and a lost one towards the slowest.
+        Inputs:
+        game, player -- see probe
+        """
+        if player is None:
+            player = game.to_move
+        result = self.probe(game, player)
+        if result is None:
+            return None
+        opponent = player.get_opponent()
+        best = None
+        best_key = None
+        for move in list(game.legal_moves(player)):
+            game.make_move(player, *move)
+            child = self.probe(game, opponent)
+            game.unmake_move()
+            if child is None:
+                continue
+            # Prefer the opponent's quickest loss, then a draw, then the opponent's slowest win
+            if child.wdl < 0:
+                key = (0, child.plies)
+            elif child.wdl == 0:
+                key = (1, 0)
+            else:
+                key = (2, -child.plies)
+            if best_key is None or key < best_key:
+                best, best_key = move, key
+        return best, result
+
+
+def _piece_list(player):
+    return [(cp.letter, cp.get_row() * 8 + cp.get_col()) for cp in player.pieces if cp.get_pos() is not None]
+
+
+# Per process state of the workers, set up once by _init_worker
+_worker = None
+
+
+class _Enumerator:
+    """
+    Finds the legal moves of every position in a table, runs in each worker.
+    Attributes:
+    white, black -- the piece letters of each side
+    slots -- number of pieces
+    game -- ChessGame holding one piece object for each slot, moved square by square between positions
+    pieces -- the piece objects in index order
+    squares -- the square each piece is on now
+    tablebases -- Tablebases for the smaller tables captures and promotions lead to
+    """
+    def __init__(self, signature, directory):
+        self.white, self.black = split_signature(signature)
+        self.slots = len(self.white) + len(self.black)
+        self.tablebases = Tablebases(directory)
+        self.game = cg.ChessGame()
+        # Start from any placement, each position moves the pieces to their own squares
+        placements = [(_CLASSES[letter], i < len(self.white), (i // 8, i % 8), True)
+                      for i, letter in enumerate(self.white + self.black)]
+        self.game.setup_position(placements)
+        self.pieces = [self.game.board[i // 8][i % 8] for i in range(self.slots)]
+        self.squares = list(range(self.slots))
+
+    def _set_squares(self, squares):
+        """Moves the pieces onto squares, lifting every moving piece first so they can swap squares"""
+        game = self.game
+        moving = [i for i in range(self.slots) if squares[i] != self.squares[i]]
+        for i in moving:
+            sq = self.squares[i]
+            game._lift((sq >> 3, sq & 7))
+        for i in moving:
+            sq = squares[i]
+            piece = self.pieces[i]
+            if piece.kind == p.PAWN:
+                # A pawn on its starting row can still push two squares
+                piece.set_moved((sq >> 3) != (1 if piece.get_player().isWhite else 6))
+            game._place(piece, (sq >> 3, sq & 7))
+        self.squares = list(squares)
+
+    def run(self, lo, hi):
+        """Returns the moves of the positions with indices lo to hi as arrays
+        flags -- 0 for an illegal position, 1 for a legal one and 2 for a legal one with the side to move in check
+        moves -- number of legal moves of each position
+        successors -- the indices the moves inside this table lead to, in position order
+        counts -- number of successors of each position
+        ext_loss -- the smallest distance of a move out of the table to a position the opponent loses, or -1
+        ext_win -- the biggest distance of a move out of the table to a position the opponent wins, or -1
+        ext_draw -- 1 if a move out of the table leads to a draw
+        """
+        flags = bytearray(hi - lo)
+        moves = array.array('H', bytes(2 * (hi - lo)))
+        counts = array.array('H', bytes(2 * (hi - lo)))
+        ext_loss = array.array('h', [-1]) * (hi - lo)
+        ext_win = array.array('h', [-1]) * (hi - lo)
+        ext_draw = bytearray(hi - lo)
+        successors = array.array('I')
+        n_white = len(self.white)
+        slots = self.slots
+        size = 64 ** slots
+        game = self.game
+        for index in range(lo, hi):
+            rest, squares = index, [0] * slots
+            for i in range(slots - 1, -1, -1):
+                rest, squares[i] = divmod(rest, 64)
+            if len(set(squares)) != slots or any(
+                    self.pieces[i].kind == p.PAWN and squares[i] >> 3 in (0, 7) for i in range(slots)):
+                continue
+            self._set_squares(squares)
+            white_to_move = rest == 0
+            player = game.playerWhite if white_to_move else game.playerBlack
+            opponent = player.get_opponent()
+            if game.is_attacked(opponent.get_king().get_pos(), player):
+                # The side that just moved left its King in check
+                continue
+            k = index - lo
+            flags[k] = 2 if game.is_attacked(player.get_king().get_pos(), opponent) else 1
+            for start_pos, end_pos, promotion in game.legal_moves(player):
+                moves[k] += 1
+                start, end = start_pos[0] * 8 + start_pos[1], end_pos[0] * 8 + end_pos[1]
+                child = list(squares)
+                child[squares.index(start)] = end
+                captured = squares.index(end) if end in squares else None
+                if captured is None and promotion is None:
+                    successors.append((size if white_to_move else 0) + _index(child))
+                    counts[k] += 1
+                    continue
+                # The move leaves this table, look the position up in the smaller one
+                letters = list(self.white + self.black)
+                if promotion is not None:
+                    letters[squares.index(start)] = promotion.letter
+                white, black = [], []
+                for i in range(slots):
+                    if i != captured:
+                        (white if i < n_white else black).append((letters[i], child[i]))
+                value = self.tablebases.probe_pieces(white, black, not white_to_move)
+                if value is None:
+                    raise ValueError('The table for {} is needed first'.format(
+                        canonical(''.join(letter for letter, sq in white) + ''.join(letter for letter, sq in black))))
+                if value == DRAW:
+                    ext_draw[k] = 1
+                elif (value - 1) & 1:
+                    ext_win[k] = max(ext_win[k], value - 1)
+                elif ext_loss[k] < 0 or value - 1 < ext_loss[k]:
+                    ext_loss[k] = value - 1
+        return flags, moves, successors, counts, ext_loss, ext_win, ext_draw
+
+
+def _index(squares):
+    index = 0
+    for sq in squares:
+        index = index * 64 + sq
+    return index
+
+
+def _init_worker(signature, directory):
+    global _worker
+    _worker = _Enumerator(signature, directory)
+
+
+def _run_chunk(lo, hi):
+    """Runs in a worker: returns the moves of the positions with indices lo to hi, see _Enumerator.run"""
+    return _worker.run(lo, hi)
+
+
+def _solve(flags, moves, successors, counts, ext_loss, ext_win, ext_draw):
+    """Retrograde analysis over the move graph, returns the bytes of the table values"""
+    # Only generating needs NumPy, reading the tables doesn't
+    import numpy as np
+
+    flags = np.frombuffer(flags, dtype=np.uint8)
+    moves = np.frombuffer(moves, dtype=np.uint16)
+    counts = np.frombuffer(counts, dtype=np.uint16).astype(np.int64)
+    successors = np.frombuffer(successors, dtype=np.uint32).astype(np.int64)
+    ext_loss = np.frombuffer(ext_loss, dtype=np.int16)
+    ext_win = np.frombuffer(ext_win, dtype=np.int16)
+    ext_draw = np.frombuffer(ext_draw, dtype=np.uint8).astype(bool)
+    n = len(flags)
+    owner = np.repeat(np.arange(n), counts)
+
+    # dist is the distance to mate in plies, -1 while the position is still open
+    dist = np.full(n, -1, dtype=np.int16)
+    dist[(flags == 2) & (moves == 0)] = 0
+    open_ = (flags != 0) & (moves > 0)
+    last_ext = int(max(ext_loss.max(initial=-1), ext_win.max(initial=-1)))
+    ply = 0
+    quiet = 0
+    while quiet < 2 or ply <= last_ext + 1:
+        ply += 1
+        child = dist[successors]
+        if ply & 1:
+            # Won in ply if a move reaches a position the opponent loses in ply - 1
+            hits = np.bincount(owner, weights=child == ply - 1, minlength=n) > 0
+            found = open_ & (hits | (ext_loss == ply - 1))
+        else:
+            # Lost in ply if every move reaches a position the opponent wins, the slowest in ply - 1
+            wins = np.bincount(owner, weights=(child > 0) & (child & 1 == 1), minlength=n)
+            found = open_ & (wins == counts) & ~ext_draw & (ext_loss < 0) & (ext_win < ply)
+        dist[found] = ply
+        open_ &= ~found
+        quiet = 0 if found.any() else quiet + 1
+    if ply + 1 >= ILLEGAL:
+        raise ValueError('Distance to mate too long to store')
+
+    values = np.where(dist >= 0, dist + 1, DRAW).astype(np.uint8)
+    values[flags == 0] = ILLEGAL
+    return values.tobytes()
+
+
+def generate(signature, directory, workers=1, chunk_size=1 << 14, log=None):
+    """Generates the table for a signature and the smaller tables it needs, returns the path written
+    Tables that already exist in directory are kept.
+    Inputs:
+    signature -- material signature such as 'KQK'
+    directory -- where to write the tables
+    workers -- number of worker processes finding the moves, 1 does it in this process
+    chunk_size -- positions sent to a worker at a time
+    log -- optional function called with a progress message for each table
+    """
+    signature = canonical(signature)
+    os.makedirs(directory, exist_ok=True)
+    for dependency in sorted(_dependencies(signature), key=len):
+        if not os.path.exists(table_path(directory, dependency)):
+            generate(dependency, directory, workers, chunk_size, log)
+
+    start = time.perf_counter()
+    size = 2 * 64 ** len(signature)
+    chunks = [(lo, min(lo + chunk_size, size)) for lo in range(0, size, chunk_size)]
+    if workers <= 1:
+        _init_worker(signature, directory)
+        results = [_run_chunk(lo, hi) for lo, hi in chunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                    initargs=(signature, directory)) as pool:
+            results = list(pool.map(_run_chunk, *zip(*chunks)))
+
+    # Join the chunks, the successor indices are already global
+    joined = [bytearray(), array.array('H'), array.array('I'), array.array('H'), array.array('h'),
+              array.array('h'), bytearray()]
+    for result in results:
+        for whole, part in zip(joined, result):
+            whole.extend(part)
+    values = _solve(*joined)
+
+    path = table_path(directory, signature)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC + signature.ljust(8).encode('ascii'))
+        f.write(values)
+    os.replace(path + '.tmp', path)
+    if log is not None:
+        log('{}  {} positions  {:.1f}s'.format(signature, size, time.perf_counter() - start))
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate or probe endgame tablebases.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help='generate tables')
+    generate_parser.add_argument('signatures', nargs='+', help="material signatures, such as 'KQK'")
+    generate_parser.add_argument('--dir', default='tables', help='directory of the tables (default: tables)')
+    generate_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    probe_parser = commands.add_parser('probe', help='print the result and best move of a position')
+    probe_parser.add_argument('--dir', default='tables', help='directory of the tables (default: tables)')
+    probe_parser.add_argument('--fen', required=True, help='position to look up')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        for signature in args.signatures:
+            generate(signature, args.dir, args.workers, log=print)
+    else:
+        from engine import format_move
+
+        game = cg.ChessGame.from_fen(args.fen)
+        with Tablebases(args.dir) as tablebases:
+            found = tablebases.best_move(game)
+            if found is None:
+                print('no table for this position')
+            else:
+                move, result = found
+                print('{}  {}  best move {}'.format(('loss', 'draw', 'win')[result.wdl + 1],
+                                                   'mate in {} plies'.format(result.plies) if result.wdl else '',
+                                                   format_move(move) if move else 'none'))
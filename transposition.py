@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Transposition table for the Chess Package
+
+A fixed size table of search results keyed by the Zobrist hash of a position (see zobrist.py).  The table never
+grows: each hash maps to one slot, and a new result only replaces the one already there if it comes from a newer
+search or a search at least as deep.
+"""
+
+# Bound stored with a score
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of search results.
+    Attributes:
+    size -- number of slots, rounded down to a power of two
+    hits -- probes that found the position
+    misses -- probes that didn't
+    stores -- results written to the table
+    overwrites -- stores that replaced a different position
+    _keys, _depths, _scores, _bounds, _moves, _ages -- the slots, kept in parallel lists instead of one object per
+        slot so the table costs a fixed amount of memory
+    _age -- search counter, entries left over from earlier searches are replaced first
+    """
+    def __init__(self, size=1 << 16):
+        if size < 1:
+            raise ValueError('Transposition table size must be at least 1')
+        self.size = 1 << (size.bit_length() - 1)
+        self._mask = self.size - 1
+        self.clear()
+
+    def clear(self):
+        """Empties the table and resets the counters"""
+        self._keys = [None] * self.size
+        self._depths = [0] * self.size
+        self._scores = [0] * self.size
+        self._bounds = [EXACT] * self.size
+        self._moves = [None] * self.size
+        self._ages = [0] * self.size
+        self._age = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        """Marks the start of a new search so entries from earlier searches lose their priority"""
+        self._age += 1
+
+    def probe(self, key):
+        """Returns (depth, score, bound, move) stored for key, or None if the position isn't in the table"""
+        i = key & self._mask
+        if self._keys[i] == key:
+            self.hits += 1
+            return self._depths[i], self._scores[i], self._bounds[i], self._moves[i]
+        self.misses += 1
+        return None
+
+    def get_move(self, key):
+        """Returns the best move stored for key, or None, without touching the hit and miss counters"""
+        i = key & self._mask
+        return self._moves[i] if self._keys[i] == key else None
+
+    def store(self, key, depth, score, bound, move=None):
+        """Stores a search result for key
+        Inputs:
+        key -- Zobrist hash of the position
+        depth -- remaining search depth the score was found with
+        score -- score of the position
+        bound -- EXACT, LOWER (score is at least this) or UPPER (score is at most this)
+        move -- best move found, kept for move ordering
+        """
+        i = key & self._mask
+        old_key = self._keys[i]
+        if old_key is not None and old_key != key:
+            # Depth preferred replacement, but anything from an earlier search can go
+            if self._ages[i] == self._age and self._depths[i] > depth:
+                return
+            self.overwrites += 1
+        elif old_key == key and move is None:
+            # Keep the best move from an earlier result for the same position
+            move = self._moves[i]
+        self._keys[i] = key
+        self._depths[i] = depth
+        self._scores[i] = score
+        self._bounds[i] = bound
+        self._moves[i] = move
+        self._ages[i] = self._age
+        self.stores += 1
+
+    def hashfull(self):
+        """Returns how full the table is in permille, estimated from the first 1000 slots"""
+        sample = min(self.size, 1000)
+        used = sum(1 for i in range(sample) if self._keys[i] is not None and self._ages[i] == self._age)
+        return used * 1000 // sample
+
+    def stats(self):
+        """Returns a dict of the table counters"""
+        probes = self.hits + self.misses
+        return {
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / probes if probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'hashfull': self.hashfull(),
+        }
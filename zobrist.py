@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Zobrist position hashing for the Chess Package
+
+A position's hash is the XOR of one random 64 bit key for each piece on its square, one for the side to move, one
+for the castling rights and one for the column of a ghost pawn (En Passant).  ChessGame keeps it up to date by
+XOR-ing keys in and out as the board changes.  The keys come from a fixed seed so the same position hashes the same
+in every process.
+"""
+
+import random
+
+import pieces as p
+
+_rng = random.Random(0x5EED)
+
+# PIECE_KEYS[color][kind][square], color 0 is White and 1 is Black, square is row * 8 + col
+PIECE_KEYS = [[[_rng.getrandbits(64) for _ in range(64)] for _ in range(6)] for _ in range(2)]
+# XOR-ed in when Black is to move
+SIDE_KEY = _rng.getrandbits(64)
+# CASTLING_KEYS[rights] for each combination of the castling rights bits, no rights hashes to 0
+CASTLING_KEYS = [0] + [_rng.getrandbits(64) for _ in range(15)]
+# EN_PASSANT_KEYS[col] for a ghost pawn in that column
+EN_PASSANT_KEYS = [_rng.getrandbits(64) for _ in range(8)]
+
+# Castling rights bits
+WHITE_RIGHT, WHITE_LEFT, BLACK_RIGHT, BLACK_LEFT = 1, 2, 4, 8
+
+
+def piece_key(piece, pos):
+    """Returns the key for piece standing on pos, a ghost pawn gives the En Passant key for its column"""
+    if piece.kind is None:
+        return EN_PASSANT_KEYS[pos[1]]
+    return PIECE_KEYS[0 if piece.get_player().isWhite else 1][piece.kind][pos[0] * 8 + pos[1]]
+
+
+def castling_rights(board):
+    """Returns the castling rights bits for board, a King and Rook that haven't moved from their starting squares"""
+    rights = 0
+    for row, white, right, left in ((0, True, WHITE_RIGHT, WHITE_LEFT), (7, False, BLACK_RIGHT, BLACK_LEFT)):
+        king = board[row][4]
+        if king is None or king.kind != p.KING or king.has_moved() or king.get_player().isWhite != white:
+            continue
+        for col, flag in ((7, right), (0, left)):
+            rook = board[row][col]
+            if rook is None or rook.kind != p.ROOK or rook.has_moved() or rook.get_player().isWhite != white:
+                continue
+            rights |= flag
+    return rights
+
+
+def compute_hash(game):
+    """Computes the hash of a game's position from scratch, ChessGame.hash should always be equal to this"""
+    h = 0
+    for r, row in enumerate(game.board):
+        for c, cp in enumerate(row):
+            if cp is not None:
+                h ^= piece_key(cp, (r, c))
+    h ^= CASTLING_KEYS[castling_rights(game.board)]
+    if not game.to_move.isWhite:
+        h ^= SIDE_KEY
+    return h